@@ -0,0 +1,67 @@
+# 批量提交基准测试: 提交一个参数扫描 (默认为 test/task_builder.py 的 900 个配置: data x model x method x domain x seed)
+# per-task 为原来的方式, 每个配置调用一次 create_task (各自加锁、开会话、提交)
+# bulk 为 create_tasks: 服务端展开扫描, 一个事务 executemany 插入全部任务; 另外验证带幂等键的重试不会重复创建
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flowline.core.sweep import expand_sweep
+from flowline.core.task import TaskManager
+
+SWEEP = {
+    "name": "{data_name}-{model_name}-{method_name}-{domain_num}-{seed}",
+    "cmd": "python main.py",
+    "params": {
+        "data_name": ["rotate_mnist", "color_mnist", "portraits"],
+        "model_name": ["cnn", "vgg", "resnet"],
+        "method_name": ["GST", "GOAT", "GDO", "GAS"],
+        "domain_num": [2, 3, 4, 5, 6],
+        "seed": [1, 2, 3, 4, 5],
+    },
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FlowLine bulk task submission benchmark")
+    parser.add_argument("--seeds", type=int, default=5, help="seeds per configuration, 5 gives the 900 point grid")
+    args = parser.parse_args()
+
+    sweep = dict(SWEEP, params=dict(SWEEP["params"], seed=list(range(1, args.seeds + 1))))
+    tasks = expand_sweep(sweep)
+    directory = tempfile.mkdtemp()
+
+    task_manager = TaskManager(os.path.join(directory, "per_task.db"))
+    start = time.perf_counter()
+    for task in tasks:
+        task_manager.create_task(task["name"], task["cmd"], 1, task["config_dict"])
+    per_task = time.perf_counter() - start
+
+    task_manager = TaskManager(os.path.join(directory, "bulk.db"))
+    start = time.perf_counter()
+    task_ids, _ = task_manager.create_tasks(expand_sweep(sweep), idempotency_key="grid")
+    bulk = time.perf_counter() - start
+    start = time.perf_counter()
+    retried_ids, created = task_manager.create_tasks(expand_sweep(sweep), idempotency_key="grid")
+    retry = time.perf_counter() - start
+
+    print(f"{len(tasks)} tasks")
+    print(f"per-task create_task: {per_task * 1000:.1f} ms ({per_task / len(tasks) * 1000:.3f} ms per task)")
+    print(f"bulk create_tasks:    {bulk * 1000:.1f} ms ({per_task / bulk:.0f}x faster)")
+    print(f"retry with the same idempotency key: {retry * 1000:.1f} ms, created again: {created}, "
+          f"same task ids: {retried_ids == task_ids}, tasks in DB: {len(task_manager.get_task_dict())}")
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
+
+"""
+python benchmark/bulk_submit.py
+python benchmark/bulk_submit.py --seeds 50
+"""
@@ -0,0 +1,77 @@
+# 调度延迟基准测试: 从"槽位释放"到"下一个进程启动"的时间
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flowline.core import ProgramManager
+from flowline.core.process import ProcessStatus
+
+
+def run(num_runs, job_time, max_processes):
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_tasks.db")
+    program = ProgramManager(lambda dict, gpu_id: f"sleep {job_time}", db_path)
+    program.set_min_process_memory(0)
+    program.set_max_processes(max_processes)
+
+    freed_times = []
+    latencies = []
+    done = threading.Event()
+    lock = threading.Lock()
+    on_process_changed = program.on_process_changed
+
+    def hooked(task_id, process_id, gpu_id, pid, status):
+        now = time.time()
+        with lock:
+            if status == ProcessStatus.RUNNING and freed_times:
+                latencies.append(now - freed_times.pop(0))
+            elif status in [ProcessStatus.COMPLETED, ProcessStatus.FAILED, ProcessStatus.KILLED]:
+                freed_times.append(now)
+        on_process_changed(task_id, process_id, gpu_id, pid, status)
+        if len(latencies) >= num_runs - max_processes:
+            done.set()
+
+    program.process_manager.on_process_changed = hooked
+    program.create_task("bench", "sleep", num_runs)
+
+    start = time.time()
+    program.switch_run()
+    done.wait(timeout=num_runs * (job_time + program.loop_sleep_time) + 60)
+    elapsed = time.time() - start
+    program.switch_run()
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FlowLine dispatch latency benchmark")
+    parser.add_argument("--runs", type=int, default=20, help="number of runs to dispatch")
+    parser.add_argument("--job-time", type=float, default=0.5, help="duration of each job (s)")
+    parser.add_argument("--max-processes", type=int, default=1, help="max concurrent processes")
+    args = parser.parse_args()
+
+    latencies, elapsed = run(args.runs, args.job_time, args.max_processes)
+    if not latencies:
+        print("no dispatch measured")
+        return
+    latencies.sort()
+    print(f"runs: {args.runs}, job time: {args.job_time}s, max processes: {args.max_processes}")
+    print(f"total time: {elapsed:.2f}s")
+    print(f"dispatch latency (slot freed -> next process started), {len(latencies)} samples:")
+    print(f"  mean {statistics.mean(latencies) * 1000:.1f} ms")
+    print(f"  p50  {latencies[len(latencies) // 2] * 1000:.1f} ms")
+    print(f"  p95  {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+    print(f"  max  {latencies[-1] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
+
+"""
+python benchmark/dispatch_latency.py --runs 20 --job-time 0.5
+"""
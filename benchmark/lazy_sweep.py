@@ -0,0 +1,76 @@
+# 惰性参数扫描基准测试: 一个 100 万个配置点的网格, 展开成任务 (bulk) 与一个扫描任务 (lazy, 运行时按序号生成配置) 对比
+# 测量创建耗时、数据库大小、get_task_dict 耗时, 以及 lazy 分配配置点 (next_point) 和运行结束记录 (finish_run) 的开销
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flowline.core.process import ProcessStatus
+from flowline.core.sweep import expand_sweep
+from flowline.core.task import TaskManager
+
+
+def make_sweep(points, lazy):
+    params = {"lr": [1e-4, 3e-4, 1e-3, 3e-3], "batch_size": [32, 64, 128, 256, 512], "dropout": [0.0, 0.1, 0.2, 0.3, 0.5]}
+    params["seed"] = list(range(max(points // 100, 1)))
+    return {"name": "grid", "cmd": "python train.py", "params": params, "lazy": lazy}
+
+
+def submit(db_path, sweep):
+    task_manager = TaskManager(db_path)
+    start = time.perf_counter()
+    task_manager.create_tasks(expand_sweep(sweep))
+    create = time.perf_counter() - start
+    start = time.perf_counter()
+    task_dict = task_manager.get_task_dict()
+    listing = time.perf_counter() - start
+    task_manager.engine.dispose()
+    size = os.path.getsize(db_path) + (os.path.getsize(db_path + "-wal") if os.path.exists(db_path + "-wal") else 0)
+    return task_manager, create, listing, len(task_dict), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FlowLine lazy parameter sweep benchmark")
+    parser.add_argument("--points", type=int, default=1000000)
+    parser.add_argument("--eager-points", type=int, default=100000, help="points expanded into tasks for comparison")
+    parser.add_argument("--dispatch", type=int, default=2000, help="points dispatched and finished on the lazy sweep")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    print(f"{'Sweep':<8} {'points':>9} {'create':>10} {'tasks':>8} {'list':>10} {'DB size':>10}")
+    for name, points, lazy in [("bulk", args.eager_points, False), ("lazy", args.points, True)]:
+        task_manager, create, listing, task_num, size = submit(os.path.join(directory, f"{name}.db"), make_sweep(points, lazy))
+        print(f"{name:<8} {points:>9} {create * 1000:>8.1f}ms {task_num:>8} {listing * 1000:>8.1f}ms {size / 1024 ** 2:>8.2f}MB")
+
+    task_id = task_manager.peek_tasks(1)[0].task_id
+    assign, finish = [], []
+    for i in range(args.dispatch):
+        task_manager.claim_task(task_id)
+        start = time.perf_counter()
+        point, config_dict = task_manager.next_point(task_id)
+        assign.append(time.perf_counter() - start)
+        run_id = task_manager.start_run(task_id, [0], f"python train.py {config_dict}", ProcessStatus.PENDING, point)
+        start = time.perf_counter()
+        # every 10th run fails and its point is run again later
+        task_manager.finish_run(run_id, ProcessStatus.FAILED if i % 10 == 0 else ProcessStatus.COMPLETED, 0, {})
+        finish.append(time.perf_counter() - start)
+        task_manager.put_task_ids(task_id) if i % 10 == 0 else task_manager.update_task_ids([task_id])
+    task = task_manager.get_task_dict()[0]
+    print(f"\nlazy: {args.dispatch} runs, next_point median {statistics.median(assign) * 1000:.3f} ms, "
+          f"finish_run median {statistics.median(finish) * 1000:.3f} ms")
+    print(f"completed {task['run_num']} points, cursor {task['point_cursor']}, {task['retry_point_num']} points to retry")
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
+
+"""
+python benchmark/lazy_sweep.py --points 1000000 --eager-points 100000
+"""
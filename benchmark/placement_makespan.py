@@ -0,0 +1,149 @@
+# 放置策略基准测试: 在合成任务组合上比较 makespan
+#
+# 离散事件模拟, 不启动真实进程. 每个调度点和 ProgramManager.new_process 一样:
+# 至多看队列前 max(空闲槽位数, BACKFILL_WINDOW) 个任务, 按队列顺序用 place_one 逐个放置, 启动至多"空闲槽位数"个,
+# 队首放不下时为它保留空闲显存最多的 GPU, 后面的任务只能回填到其它 GPU 上.
+# legacy 模拟原来的 choose_gpu: 只比较全局 min_process_memory 阈值并选利用率最低的 GPU,
+# 任务实际显存超过剩余显存时 OOM, 浪费 OOM_TIME 后重新排队.
+
+import argparse
+import heapq
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flowline.core.placement import GPUSlot, PLACEMENT_KEYS, place_one
+
+GPU_MEMORY = 24564  # MB, RTX 4090
+OOM_TIME = 5
+BACKFILL_WINDOW = 64  # config.DEFAULT_BACKFILL_WINDOW
+
+
+def place_legacy(gpus, demands, min_process_memory):
+    placements = []
+    for _ in demands:
+        choose_gpu = None
+        for gpu in gpus:
+            if gpu.free_slots <= 0 or gpu.free_memory <= min_process_memory:
+                continue
+            key = (gpu.placed_num, gpu.utilization, -gpu.free_memory)
+            if choose_gpu is None or key < (choose_gpu.placed_num, choose_gpu.utilization, -choose_gpu.free_memory):
+                choose_gpu = gpu
+        if choose_gpu is None:
+            placements.append(None)
+            continue
+        choose_gpu.take(min_process_memory)
+        placements.append([choose_gpu.gpu_id])
+    return placements
+
+
+def place_in_queue_order(policy, gpus, queue, jobs, num, hold):
+    """
+    one pass of new_process: place in queue order until num jobs are chosen, return [(job_id, gpu_ids)]
+    hold: [blocked job, held gpu_ids], kept across passes like blocked_task_id and the held GPUs
+    """
+    if not queue or queue[0] != hold[0]:
+        hold[:] = [None, []]
+    chosen = []
+    skipped = False
+    for job_id in queue[:max(num, BACKFILL_WINDOW)]:
+        if len(chosen) >= num:
+            break
+        candidates = gpus if job_id == hold[0] else [gpu for gpu in gpus if gpu.gpu_id not in hold[1]]
+        gpu_ids = place_one(candidates, jobs[job_id][0], 1, PLACEMENT_KEYS[policy])
+        if gpu_ids is None:
+            if not skipped and hold[0] is None:
+                hold[:] = [job_id, [max(gpus, key=lambda gpu: gpu.free_memory).gpu_id]]
+            skipped = True
+            continue
+        if job_id == hold[0]:
+            hold[:] = [None, []]
+        chosen.append((job_id, gpu_ids))
+    return chosen
+
+
+def make_jobs(mix, num_jobs, seed):
+    rng = random.Random(seed)
+    large_ratio = {"small": 0.0, "mixed": 0.2, "large": 0.5}[mix]
+    jobs = []
+    for _ in range(num_jobs):
+        if rng.random() < large_ratio:
+            jobs.append((rng.uniform(16000, 22000), rng.uniform(100, 300)))
+        else:
+            jobs.append((rng.uniform(2000, 6000), rng.uniform(50, 150)))
+    return jobs
+
+
+def simulate(policy, jobs, gpu_num, slots_per_gpu, min_process_memory):
+    queue = list(range(len(jobs)))
+    used_memory = [0.0] * gpu_num
+    running_num = [0] * gpu_num
+    events = []
+    now = 0.0
+    oom_num = 0
+    busy_memory_time = 0.0
+    hold = [None, []]
+    while queue or events:
+        free_slots = sum(slots_per_gpu - n for n in running_num)
+        if queue and free_slots:
+            gpus = [GPUSlot(i, GPU_MEMORY - used_memory[i], min(100, running_num[i] * 50), slots_per_gpu - running_num[i])
+                    for i in range(gpu_num)]
+            if policy == "legacy":
+                claimed, queue = queue[:free_slots], queue[free_slots:]
+                placements = place_legacy(gpus, [(jobs[i][0], 1) for i in claimed], min_process_memory)
+                chosen = [(job_id, gpu_ids) for job_id, gpu_ids in zip(claimed, placements) if gpu_ids is not None]
+                queue = sorted([job_id for job_id, gpu_ids in zip(claimed, placements) if gpu_ids is None] + queue)
+            else:
+                chosen = place_in_queue_order(policy, gpus, queue, jobs, free_slots, hold)
+                started = {job_id for job_id, _ in chosen}
+                queue = [job_id for job_id in queue if job_id not in started]
+            for job_id, gpu_ids in chosen:
+                gpu_id = gpu_ids[0]
+                memory, duration = jobs[job_id]
+                if used_memory[gpu_id] + memory > GPU_MEMORY:
+                    oom_num += 1
+                    heapq.heappush(events, (now + OOM_TIME, job_id, gpu_id, 0.0, False))
+                    running_num[gpu_id] += 1
+                    continue
+                used_memory[gpu_id] += memory
+                running_num[gpu_id] += 1
+                heapq.heappush(events, (now + duration, job_id, gpu_id, memory, True))
+        if not events:
+            break
+        end_time, job_id, gpu_id, memory, success = heapq.heappop(events)
+        busy_memory_time += sum(used_memory) * (end_time - now)
+        now = end_time
+        used_memory[gpu_id] -= memory
+        running_num[gpu_id] -= 1
+        if not success:
+            queue = sorted(queue + [job_id])
+    memory_utilization = busy_memory_time / (now * gpu_num * GPU_MEMORY) if now else 0
+    return now, oom_num, memory_utilization
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FlowLine placement makespan benchmark")
+    parser.add_argument("--gpus", type=int, default=8, help="number of simulated GPUs")
+    parser.add_argument("--jobs", type=int, default=500, help="number of jobs per mix")
+    parser.add_argument("--slots", type=int, default=4, help="max processes per GPU")
+    parser.add_argument("--min-memory", type=int, default=10000, help="legacy global min_process_memory (MB)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{args.gpus} GPUs x {GPU_MEMORY} MB, {args.slots} slots per GPU, {args.jobs} jobs per mix")
+    print(f"{'Mix':<8} {'Policy':<8} {'Makespan':>10} {'OOM':>6} {'MemUtil':>8}")
+    for mix in ["small", "mixed", "large"]:
+        jobs = make_jobs(mix, args.jobs, args.seed)
+        for policy in ["legacy", "spread", "pack"]:
+            makespan, oom_num, memory_utilization = simulate(policy, jobs, args.gpus, args.slots, args.min_memory)
+            print(f"{mix:<8} {policy:<8} {makespan:>10.0f} {oom_num:>6} {memory_utilization:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
+
+"""
+python benchmark/placement_makespan.py --gpus 8 --jobs 500
+"""
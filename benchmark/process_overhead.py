@@ -0,0 +1,79 @@
+# 进程监管开销基准测试: 启动延迟和 N 个并发任务时的常驻内存
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flowline.core.process import ProcessManager
+
+
+def tree_usage(job_cmd):
+    """RSS/进程数/线程数: FlowLine 自身及其所有子进程, 以及扣除任务命令本身之后的部分"""
+    me = psutil.Process()
+    procs = [me] + me.children(recursive=True)
+    total_rss, overhead_rss, overhead_num, thread_num = 0, 0, 0, 0
+    for proc in procs:
+        try:
+            rss = proc.memory_info().rss
+            cmdline = " ".join(proc.cmdline())
+            threads = proc.num_threads()
+        except psutil.Error:
+            continue
+        total_rss += rss
+        thread_num += threads
+        if cmdline != job_cmd:
+            overhead_rss += rss
+            overhead_num += 1
+    return len(procs), overhead_num, thread_num, total_rss, overhead_rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FlowLine process supervision overhead benchmark")
+    parser.add_argument("--jobs", type=int, default=64, help="number of concurrent jobs")
+    parser.add_argument("--job-time", type=int, default=60, help="duration of each job (s), must outlast the measurement")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    job_cmd = f"sleep {args.job_time}"
+    process_manager = ProcessManager()
+    base = tree_usage(job_cmd)
+
+    latencies = []
+    for i in range(args.jobs):
+        start = time.time()
+        process_manager.add_process(job_cmd, i, 0)
+        latencies.append(time.time() - start)
+    time.sleep(2)
+    proc_num, overhead_num, thread_num, total_rss, overhead_rss = tree_usage(job_cmd)
+
+    latencies.sort()
+    mb = 1024 ** 2
+    print(f"{args.jobs} concurrent jobs ({job_cmd})")
+    print(f"launch latency: mean {statistics.mean(latencies) * 1000:.1f} ms, "
+          f"p95 {latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000:.1f} ms, "
+          f"max {latencies[-1] * 1000:.1f} ms")
+    print(f"processes: {proc_num} total, {overhead_num} besides the jobs (idle: {base[0]})")
+    print(f"threads in tree: {thread_num} (idle: {base[2]})")
+    print(f"RSS: {total_rss / mb:.0f} MB total, {overhead_rss / mb:.0f} MB besides the jobs (idle: {base[4] / mb:.0f} MB)")
+    print(f"per-job overhead: {(overhead_rss - base[4]) / args.jobs / mb:.1f} MB, "
+          f"{(overhead_num - base[1]) / args.jobs:.1f} processes")
+
+    killer = threading.Thread(target=process_manager.kill_all_processes)
+    killer.start()
+    killer.join(timeout=60)
+
+
+if __name__ == "__main__":
+    main()
+
+"""
+python benchmark/process_overhead.py --jobs 64
+"""
@@ -0,0 +1,70 @@
+# 任务队列基准测试: 大量待执行运行 (例如 need_run_num=50000 的种子扫描) 时的启动时间、队列内存和调度开销
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flowline.core.task import TaskManager, TaskModel
+
+
+def populate(db_path, num_tasks, runs_per_task):
+    task_manager = TaskManager(db_path)
+    with task_manager.engine.begin() as connection:
+        connection.execute(TaskModel.__table__.insert(), [
+            {"name": f"sweep{i}", "cmd": "python train.py", "need_run_num": runs_per_task, "run_num": 0,
+             "need_gpu_num": 1, "priority": 0, "owner": f"user{i % 4}"}
+            for i in range(num_tasks)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FlowLine task queue startup benchmark")
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--runs-per-task", type=int, default=50000)
+    parser.add_argument("--window", type=int, default=64, help="runs peeked per scheduling pass")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_tasks.db")
+    populate(db_path, args.tasks, args.runs_per_task)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    task_manager = TaskManager(db_path)
+    startup = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{args.tasks} tasks x {args.runs_per_task} runs = {len(task_manager.task_ids)} pending runs")
+    print(f"startup: {startup * 1000:.1f} ms, peak memory while loading: {peak / 1024 ** 2:.1f} MB")
+
+    dispatch, batch, requeue = [], [], []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        tasks = task_manager.peek_tasks(args.window)
+        task_manager.claim_task(tasks[0].task_id)
+        dispatch.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        task_manager.put_task_ids(tasks[0].task_id, unclaim=True)
+        requeue.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        claimed = task_manager.claim_tasks([(task.task_id, False) for task in tasks])
+        batch.append(time.perf_counter() - start)
+        for task, ok in zip(tasks, claimed):
+            if ok:
+                task_manager.put_task_ids(task.task_id, unclaim=True)
+    print(f"peek {args.window} + claim: median {statistics.median(dispatch) * 1000:.3f} ms")
+    print(f"claim {args.window} runs in one statement: median {statistics.median(batch) * 1000:.3f} ms")
+    print(f"requeue: median {statistics.median(requeue) * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
+
+"""
+python benchmark/queue_startup.py --tasks 100 --runs-per-task 50000
+"""
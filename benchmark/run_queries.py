@@ -0,0 +1,88 @@
+# 运行历史查询基准测试: 在有大量运行记录的数据库上查询 "最近 100 次失败" / "某任务的运行" 等
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flowline.core.task import TaskManager, TaskModel, RunModel
+
+STATUSES = ["COMPLETED"] * 90 + ["FAILED"] * 8 + ["KILLED"] * 2
+
+
+def populate(task_manager, num_tasks, num_runs, seed, batch_size=50000):
+    rng = random.Random(seed)
+    start = datetime.utcnow() - timedelta(seconds=num_runs * 30)
+    with task_manager.engine.begin() as connection:
+        connection.execute(TaskModel.__table__.insert(), [
+            {"name": f"task{i}", "cmd": "python train.py", "need_run_num": 1, "run_num": 1, "need_gpu_num": 1, "priority": 0}
+            for i in range(num_tasks)])
+    for offset in range(0, num_runs, batch_size):
+        rows = []
+        for i in range(offset, min(offset + batch_size, num_runs)):
+            start_time = start + timedelta(seconds=i * 30)
+            rows.append({
+                "task_id": rng.randint(1, num_tasks),
+                "gpu_ids": [rng.randint(0, 7)],
+                "status": rng.choice(STATUSES),
+                "returncode": 0,
+                "start_time": start_time,
+                "end_time": start_time + timedelta(seconds=600),
+                "sample_num": 0,
+            })
+        with task_manager.engine.begin() as connection:
+            connection.execute(RunModel.__table__.insert(), rows)
+
+
+def timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FlowLine run history query benchmark")
+    parser.add_argument("--runs", type=int, default=1000000, help="number of runs in the database")
+    parser.add_argument("--tasks", type=int, default=10000, help="number of tasks the runs belong to")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench_runs.db")
+    task_manager = TaskManager(db_path)
+    start = time.time()
+    populate(task_manager, args.tasks, args.runs, args.seed)
+    print(f"{args.runs} runs of {args.tasks} tasks inserted in {time.time() - start:.1f}s")
+
+    task_id = args.tasks // 2
+    last_id = args.runs // 2
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    queries = [
+        ("last 100 failed runs", lambda: task_manager.get_runs(status="FAILED", limit=100)),
+        ("runs for task X", lambda: task_manager.get_runs(task_id=task_id)),
+        ("failed runs for task X", lambda: task_manager.get_runs(task_id=task_id, status="FAILED")),
+        ("runs started in last 7 days", lambda: task_manager.get_runs(since=week_ago, limit=100)),
+        ("next page of runs", lambda: task_manager.get_runs(before_id=last_id, limit=100)),
+        ("one run by id", lambda: [task_manager.get_run(last_id)]),
+    ]
+    print(f"{'Query':<30} {'Median':>10} {'Rows':>6}")
+    for name, func in queries:
+        median, rows = timed(func, args.repeat)
+        print(f"{name:<30} {median * 1000:>8.2f}ms {rows:>6}")
+
+
+if __name__ == "__main__":
+    main()
+
+"""
+python benchmark/run_queries.py --runs 1000000
+"""
@@ -0,0 +1,91 @@
+# 模拟集群调度基准测试: 在 CPU 机器上用 simulated 遥测后端模拟 N 块 GPU, 任务启动后显存和利用率随之上升
+# 测量调度吞吐 (完成的运行数 / 秒) 和放置质量 (忙碌 GPU 的显存利用率, 超出显存的 GPU 次数)
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flowline.config import config
+from flowline.core import ProgramManager
+from flowline.core.process import ProcessStatus
+
+MEMORY_CHOICES = [10000, 20000, 40000]  # MB per GPU
+GPU_NUM_CHOICES = [1, 1, 1, 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FlowLine simulated cluster scheduling benchmark")
+    parser.add_argument("--gpus", type=int, default=64, help="number of simulated GPUs")
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--runs-per-task", type=int, default=5)
+    parser.add_argument("--job-time", type=float, default=1.0, help="mean duration of each job (s)")
+    parser.add_argument("--ramp-time", type=float, default=0.5, help="memory ramp-up time of a job (s)")
+    parser.add_argument("--policy", type=str, default="pack", help="placement policy")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    config.DEFAULT_TELEMETRY_BACKEND = "simulated"
+    config.DEFAULT_SIMULATED_GPU_NUM = args.gpus
+    config.DEFAULT_GPU_MONITOR_INTERVAL = 0.5
+    config.DEFAULT_GPU_SNAPSHOT_MAX_AGE = 0.5
+    program = ProgramManager(lambda dict, gpu_id: f"sleep {dict['time']}", "bench_tasks.db")
+    program.gpu_manager.telemetry.backend.ramp_time = args.ramp_time
+    program.gpu_manager.telemetry.backend.rng.seed(args.seed)
+    for gpu_id in range(1, args.gpus):
+        program.switch_gpu(gpu_id)
+    program.set_placement_policy(args.policy)
+
+    rng = random.Random(args.seed)
+    total_runs = args.tasks * args.runs_per_task
+    for i in range(args.tasks):
+        program.create_task(f"task{i}", "sleep", args.runs_per_task, {"time": round(rng.uniform(0.5, 1.5) * args.job_time, 2)},
+                            need_memory=rng.choice(MEMORY_CHOICES), need_gpu_num=rng.choice(GPU_NUM_CHOICES))
+
+    finished = []
+    done = threading.Event()
+    on_process_changed = program.process_manager.on_process_changed
+
+    def hooked(task_id, process_id, gpu_id, pid, status):
+        on_process_changed(task_id, process_id, gpu_id, pid, status)
+        if status in [ProcessStatus.COMPLETED, ProcessStatus.FAILED, ProcessStatus.KILLED]:
+            finished.append(status)
+            if len(finished) >= total_runs:
+                done.set()
+
+    program.process_manager.on_process_changed = hooked
+
+    memory_usage, overcommitted = [], 0
+    start = time.time()
+    program.switch_run()
+    while not done.wait(0.25):
+        if time.time() - start > total_runs * args.job_time * 2 + 120:
+            break
+        for info in program.gpu_manager.telemetry.snapshot.values():
+            if info.process_memory:
+                memory_usage.append(1 - info.free_memory / info.total_memory)
+                overcommitted += sum(info.process_memory.values()) > info.total_memory
+    elapsed = time.time() - start
+    program.switch_run()
+
+    print(f"{args.gpus} simulated GPUs, {total_runs} runs, policy {args.policy}")
+    print(f"finished {len(finished)} runs ({finished.count(ProcessStatus.COMPLETED)} completed) in {elapsed:.1f}s, "
+          f"{len(finished) / elapsed:.1f} runs/s")
+    if memory_usage:
+        print(f"memory utilization of busy GPUs: mean {statistics.mean(memory_usage) * 100:.1f}%, "
+              f"overcommitted samples: {overcommitted}")
+
+
+if __name__ == "__main__":
+    main()
+
+"""
+python benchmark/simulated_cluster.py --gpus 64 --tasks 100 --runs-per-task 5
+"""
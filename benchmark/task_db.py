@@ -0,0 +1,160 @@
+# 任务数据库基准测试: 10 万个任务时, 原来的默认 SQLite 配置 (回滚日志, 无索引) 与 WAL + pragma + 索引 + 连接池的对比
+# 测量启动时查询待执行任务、按用户/状态翻页列出任务的耗时, 以及调度线程写入时 API 线程并发读取的延迟和 "database is locked" 次数
+
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.exc import OperationalError
+
+from flowline.core.task import TaskManager, TaskModel, create_db_engine
+
+
+def populate(db_path, num_tasks, pending_ratio, owners):
+    task_manager = TaskManager(db_path)
+    pending_every = max(int(1 / pending_ratio), 1)
+    with task_manager.engine.begin() as connection:
+        connection.execute(TaskModel.__table__.insert(), [
+            {"name": f"task{i}", "cmd": "python train.py", "need_run_num": 1, "run_num": 0 if i % pending_every == 0 else 1,
+             "need_gpu_num": 1, "priority": 0, "owner": f"user{i % owners}"}
+            for i in range(num_tasks)])
+    task_manager.engine.dispose()
+
+
+def make_legacy(db_path, legacy_path):
+    """the same data as FlowLine stored it before: rollback journal and no index on tasks"""
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    connection.close()
+    shutil.copy(db_path, legacy_path)
+    connection = sqlite3.connect(legacy_path)
+    for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='tasks'").fetchall():
+        connection.execute(f"DROP INDEX {name}")
+    connection.execute("PRAGMA journal_mode=DELETE")
+    connection.close()
+
+
+def timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def queries(engine, repeat):
+    def pending():
+        with engine.connect() as connection:
+            connection.execute(select(TaskModel.id).where(TaskModel.pending_num > 0)).fetchall()
+
+    def owner_page():
+        with engine.connect() as connection:
+            connection.execute(select(TaskModel).where(TaskModel.owner == "user3")
+                               .order_by(TaskModel.id.desc()).limit(100)).fetchall()
+
+    def pending_page():
+        with engine.connect() as connection:
+            connection.execute(select(TaskModel).where(TaskModel.pending_num > 0)
+                               .order_by(TaskModel.id.desc()).limit(100)).fetchall()
+
+    return [("pending tasks (startup)", timed(pending, repeat)),
+            ("list page by owner", timed(owner_page, repeat)),
+            ("list page of pending tasks", timed(pending_page, repeat))]
+
+
+def contention(engine, num_tasks, duration, readers):
+    """one writer claiming and releasing runs like the scheduler, readers listing tasks like the web UI"""
+    stop = threading.Event()
+    writes, reads, errors = [], [], [0]
+
+    def writer():
+        task_id = 1
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with engine.begin() as connection:
+                    connection.execute(update(TaskModel).where(TaskModel.id == task_id)
+                                       .values(claimed_num=TaskModel.claimed_num + 1))
+                with engine.begin() as connection:
+                    connection.execute(update(TaskModel).where(TaskModel.id == task_id)
+                                       .values(claimed_num=TaskModel.claimed_num - 1))
+                writes.append(time.perf_counter() - start)
+            except OperationalError:
+                errors[0] += 1
+            task_id = task_id % num_tasks + 1
+
+    def reader(owner):
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with engine.connect() as connection:
+                    connection.execute(select(TaskModel).where(TaskModel.owner == owner)
+                                       .order_by(TaskModel.id.desc()).limit(100)).fetchall()
+                    connection.execute(select(TaskModel.id).where(TaskModel.pending_num > 0)).fetchall()
+                reads.append(time.perf_counter() - start)
+            except OperationalError:
+                errors[0] += 1
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader, args=(f"user{i}",)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return writes, reads, errors[0]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q / 100 * len(values)), len(values) - 1)] if values else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FlowLine task database benchmark")
+    parser.add_argument("--tasks", type=int, default=100000)
+    parser.add_argument("--pending-ratio", type=float, default=0.01, help="fraction of tasks with runs left")
+    parser.add_argument("--owners", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=5, help="seconds of concurrent reads and writes")
+    parser.add_argument("--readers", type=int, default=4, help="threads listing tasks while the scheduler writes")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, "bench_tasks.db")
+    legacy_path = os.path.join(directory, "bench_tasks_legacy.db")
+    populate(db_path, args.tasks, args.pending_ratio, args.owners)
+    make_legacy(db_path, legacy_path)
+    engines = [("default", create_engine(f"sqlite:///{legacy_path}")), ("tuned", create_db_engine(db_path))]
+    print(f"{args.tasks} tasks, {args.pending_ratio * 100:g}% pending, {args.owners} owners")
+
+    results = {name: queries(engine, args.repeat) for name, engine in engines}
+    print(f"{'Query':<30} {'default':>10} {'tuned':>10}")
+    for i, (query, _) in enumerate(results["default"]):
+        print(f"{query:<30} {results['default'][i][1] * 1000:>8.2f}ms {results['tuned'][i][1] * 1000:>8.2f}ms")
+
+    print(f"\n1 writer + {args.readers} readers for {args.duration:g}s")
+    print(f"{'Profile':<10} {'writes':>8} {'write p50':>10} {'write p99':>10} {'reads':>8} {'read p50':>10} {'read p99':>10} {'locked':>7}")
+    for name, engine in engines:
+        writes, reads, errors = contention(engine, args.tasks, args.duration, args.readers)
+        print(f"{name:<10} {len(writes):>8} {percentile(writes, 50) * 1000:>8.2f}ms {percentile(writes, 99) * 1000:>8.2f}ms "
+              f"{len(reads):>8} {percentile(reads, 50) * 1000:>8.2f}ms {percentile(reads, 99) * 1000:>8.2f}ms {errors:>7}")
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
+
+"""
+python benchmark/task_db.py --tasks 100000
+"""
@@ -0,0 +1,83 @@
+# GPU 遥测开销基准测试: 每个 GPU 每次采样的耗时, 以及监控线程数
+# legacy 模拟原来的 GPU.flash: 每个 GPU 各自 nvmlInit / 取 handle / 读全部字段 / nvmlShutdown
+# batched 为 GPUTelemetry.sample: NVML 只初始化一次, handle 和静态字段已缓存, 一次遍历所有 GPU
+# 另外测量 choose_gpu (get_gpu_slots + place_task) 的耗时: 快照未过期时直接使用, 与每次调度都重新采样 (snapshot_max_age=0) 对比
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flowline.core import telemetry as telemetry_module
+from flowline.core.gpu import GPU_Manager
+from flowline.core.telemetry import GPUTelemetry, create_backend
+
+
+def legacy_flash(gpu_id):
+    pynvml = telemetry_module.pynvml
+    pynvml.nvmlInit()
+    handle = pynvml.nvmlDeviceGetHandleByIndex(gpu_id)
+    pynvml.nvmlDeviceGetMemoryInfo(handle)
+    pynvml.nvmlDeviceGetUtilizationRates(handle)
+    pynvml.nvmlDeviceGetComputeRunningProcesses(handle)
+    pynvml.nvmlDeviceGetName(handle)
+    pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU)
+    pynvml.nvmlDeviceGetPowerUsage(handle)
+    try:
+        pynvml.nvmlDeviceGetPowerManagementLimit(handle)
+    except pynvml.NVMLError:
+        pass
+    pynvml.nvmlShutdown()
+
+
+def timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FlowLine GPU telemetry cost benchmark")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--backend", type=str, default="auto", help="auto, nvml, psutil, simulated or virtual")
+    parser.add_argument("--gpus", type=int, default=None, help="number of GPUs of the simulated backend")
+    args = parser.parse_args()
+
+    kwargs = {"gpu_num": args.gpus} if args.backend == "simulated" else {}
+    telemetry = GPUTelemetry(interval=3600, backend=create_backend(args.backend, **kwargs))
+    gpu_num = telemetry.gpu_count
+    print(f"{gpu_num} GPU ({telemetry.backend.name} backend)")
+
+    results = []
+    if telemetry.backend.name == "nvml":
+        results.append(("legacy (init/shutdown per GPU)", timed(lambda: [legacy_flash(i) for i in range(gpu_num)], args.repeat)))
+    results.append(("batched (shared session)", timed(telemetry.sample, args.repeat)))
+    print(f"{'Sampler':<32} {'Per pass':>10} {'Per GPU':>10}")
+    for name, median in results:
+        print(f"{name:<32} {median * 1000:>8.3f}ms {median / gpu_num * 1000:>8.3f}ms")
+
+    before = threading.active_count()
+    gpu_manager = GPU_Manager(list(range(gpu_num)), backend=create_backend(args.backend, **kwargs))
+    print(f"monitor threads started by GPU_Manager: {threading.active_count() - before} (one per GPU before)")
+
+    gpu_manager.set_min_process_memory(0)
+    fresh = timed(lambda: gpu_manager.choose_gpu(), args.repeat)
+    gpu_manager.set_snapshot_max_age(0)
+    resampled = timed(lambda: gpu_manager.choose_gpu(), args.repeat)
+    print(f"choose_gpu: {fresh * 1000:.3f}ms from the snapshot, {resampled * 1000:.3f}ms resampling every call")
+
+
+if __name__ == "__main__":
+    main()
+
+"""
+python benchmark/telemetry_cost.py --repeat 50
+python benchmark/telemetry_cost.py --backend simulated --gpus 64
+"""
@@ -9,6 +9,7 @@ from flask_cors import CORS
 # from flask_socketio import SocketIO, send, emit
 
 from flowline.core import ProgramManager
+from flowline.core.process import ProcessStatus
 from flowline.utils import Log
 
 
@@ -48,13 +49,19 @@ def get_processes():
         logger.error(f"Error getting processes: {e}")
         return jsonify({'error': str(e)})
     
+def get_grace_period():
+    data = request.get_json(silent=True) or {}
+    grace_period = data.get('grace_period')
+    return None if grace_period is None else float(grace_period)
+
 @app.route('/api/process/<process_id>/kill', methods=['POST'])
 def kill_process(process_id):
     try:
-        if_success = program_manager.kill_process(int(process_id))
-        return jsonify({'success': if_success})
+        if_success = program_manager.kill_process(int(process_id), get_grace_period())
+        return jsonify({'success': if_success, 'status': ProcessStatus.KILLING if if_success else None})
     except Exception as e:
         logger.error(f"Error killing process: {e}")
+        return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/api/gpu/<gpu_id>/process', methods=['GET'])
 def get_gpu_tasks(gpu_id):
@@ -74,6 +81,30 @@ def switch_gpu(gpu_id):
         logger.error(f"Error switching GPU: {e}")
         return jsonify({'gpu_id': gpu_id, 'success': False, 'error': str(e)})
 
+@app.route('/api/gpu/<gpu_id>/kill', methods=['POST'])
+def kill_gpu_processes(gpu_id):
+    try:
+        num = program_manager.kill_process_by_gpu(int(gpu_id), get_grace_period())
+        return jsonify({'gpu_id': gpu_id, 'success': True, 'killing_num': num})
+    except Exception as e:
+        logger.error(f"Error killing GPU processes: {e}")
+        return jsonify({'gpu_id': gpu_id, 'success': False, 'error': str(e)})
+
+@app.route('/api/gpu/<int:gpu_id>/history', methods=['GET'])
+def get_gpu_history(gpu_id):
+    try:
+        metrics = request.args.get('metric', default='utilization', type=str).split(',')
+        history = program_manager.get_gpu_history(gpu_id, metrics,
+                                                  request.args.get('from', type=float),
+                                                  request.args.get('to', type=float),
+                                                  request.args.get('step', type=int))
+        if history is None:
+            return jsonify({'error': 'Invalid GPU or metric'}), 400
+        return jsonify({'gpu_id': gpu_id, 'history': history})
+    except Exception as e:
+        logger.error(f"Error getting GPU history: {e}")
+        return jsonify({'error': str(e)})
+
 @app.route('/api/run', methods=['POST'])
 def run_process_loop():
     try:
@@ -86,12 +117,26 @@ def run_process_loop():
 @app.route('/api/task/list', methods=['GET'])
 def get_task_list():
     try:
-        task_dict = program_manager.get_task_dict()
+        limit = request.args.get('limit', type=int)
+        task_dict = program_manager.get_task_dict(
+            owner=request.args.get('owner'),
+            status=request.args.get('status', type=str.upper),
+            before_id=request.args.get('before', type=int),
+            limit=min(limit, 1000) if limit is not None else None,
+        )
         return jsonify(task_dict)
     except Exception as e:
         logger.error(f"Error getting tasks: {e}")
         return jsonify({'error': str(e)})
 
+@app.route('/api/task/queue/stats', methods=['GET'])
+def get_queue_stats():
+    try:
+        return jsonify(program_manager.get_queue_stats())
+    except Exception as e:
+        logger.error(f"Error getting queue stats: {e}")
+        return jsonify({'error': str(e)})
+
 @app.route('/api/task/<int:task_id>', methods=['GET'])
 def get_task_detail(task_id):
     try:
@@ -113,11 +158,16 @@ def create_task():
         need_run_num = data.get('need_run_num', 1)
         config_dict = data.get('config_dict', {})
         working_dir = data.get('working_dir', None)
+        need_memory = data.get('need_memory', None)
+        need_gpu_num = data.get('need_gpu_num', 1)
+        priority = data.get('priority', 0)
+        owner = data.get('owner', None)
         
         if not cmd:
             return jsonify({'success': False, 'error': 'Command is required'})
             
-        task_id = program_manager.create_task(name, cmd, need_run_num, config_dict, working_dir)
+        task_id = program_manager.create_task(name, cmd, need_run_num, config_dict, working_dir, need_memory, need_gpu_num,
+                                              priority, owner)
         if task_id:
             return jsonify({'success': True, 'task_id': task_id})
         else:
@@ -126,6 +176,22 @@ def create_task():
         logger.error(f"Error creating task: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/task/bulk', methods=['POST'])
+def create_tasks_bulk():
+    try:
+        data = request.json
+        sweeps = data.get('sweeps', [])
+        if data.get('sweep'):
+            sweeps = sweeps + [data['sweep']]
+        idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+        task_ids, created = program_manager.create_tasks(data.get('tasks', []), sweeps, idempotency_key)
+        return jsonify({'success': True, 'task_ids': task_ids, 'created': created})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error creating tasks: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/task/copy', methods=['POST'])
 def copy_task():
     try:
@@ -146,6 +212,89 @@ def copy_task():
         logger.error(f"Error copying task: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/task/<int:task_id>/priority', methods=['POST'])
+def set_task_priority(task_id):
+    try:
+        data = request.json
+        priority = data.get('priority')
+        if priority is None:
+            return jsonify({'success': False, 'error': 'Priority is required'})
+        if_success = program_manager.set_task_priority(task_id, int(priority))
+        return jsonify({'success': if_success})
+    except Exception as e:
+        logger.error(f"Error setting task priority: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/task/<int:task_id>/kill', methods=['POST'])
+def kill_task_processes(task_id):
+    try:
+        num = program_manager.kill_process_by_task(task_id, get_grace_period())
+        return jsonify({'success': True, 'killing_num': num})
+    except Exception as e:
+        logger.error(f"Error killing task processes: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/runs', methods=['GET'])
+def get_runs():
+    try:
+        since = request.args.get('since')
+        until = request.args.get('until')
+        runs = program_manager.get_runs(
+            task_id=request.args.get('task_id', type=int),
+            status=request.args.get('status', type=str.upper),
+            since=datetime.datetime.fromisoformat(since) if since else None,
+            until=datetime.datetime.fromisoformat(until) if until else None,
+            before_id=request.args.get('before', type=int),
+            limit=min(request.args.get('limit', default=100, type=int), 1000),
+        )
+        return jsonify(runs)
+    except Exception as e:
+        logger.error(f"Error getting runs: {e}")
+        return jsonify({'error': str(e)})
+
+@app.route('/api/run/<int:run_id>', methods=['GET'])
+def get_run(run_id):
+    try:
+        run = program_manager.get_run(run_id)
+        if run:
+            return jsonify(run)
+        return jsonify({'error': 'Run not found'}), 404
+    except Exception as e:
+        logger.error(f"Error getting run: {e}")
+        return jsonify({'error': str(e)})
+
+@app.route('/api/run/<int:run_id>/output', methods=['GET'])
+def get_run_output(run_id):
+    stream = request.args.get('stream', default='stdout', type=str)
+    try:
+        tail = request.args.get('tail', type=int)
+        if tail is not None:
+            lines = program_manager.get_run_output_tail(run_id, stream, tail)
+            if lines is None:
+                return jsonify({'error': 'Run not found'}), 404
+            return jsonify({'lines': lines})
+        output = program_manager.get_run_output(run_id, stream, request.args.get('offset', default=0, type=int),
+                                                min(request.args.get('limit', default=65536, type=int), 1024 * 1024))
+        if output is None:
+            return jsonify({'error': 'Run not found'}), 404
+        return jsonify(output)
+    except Exception as e:
+        logger.error(f"Error getting run output: {e}")
+        return jsonify({'error': str(e)})
+
+@app.route('/api/owner/<owner>/weight', methods=['POST'])
+def set_owner_weight(owner):
+    try:
+        data = request.json
+        weight = data.get('weight')
+        if weight is None or float(weight) <= 0:
+            return jsonify({'success': False, 'error': 'Weight must be a positive number'})
+        program_manager.set_owner_weight(owner, float(weight))
+        return jsonify({'success': True})
+    except Exception as e:
+        logger.error(f"Error setting owner weight: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/task/<int:task_id>', methods=['DELETE'])
 def delete_task(task_id):
     try:
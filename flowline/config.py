@@ -4,9 +4,37 @@ class BaseConfig:
     # API_HOST = "127.0.0.1"
     # API_PORT = 5000
     DEFAULT_MIN_PROCESS_MEMORY = 10000 # MB
-    DEFAULT_MAX_PROCESSES = 4
+    DEFAULT_MAX_PROCESSES_PER_GPU = 4
+    DEFAULT_TELEMETRY_BACKEND = "auto" # nvml, psutil, simulated or virtual, auto: nvml if pynvml is installed else virtual
+    DEFAULT_SIMULATED_GPU_NUM = 8 # GPUs modelled by the simulated telemetry backend
+    DEFAULT_GPU_MONITOR_INTERVAL = 5 # s, all GPUs are sampled in one pass this often
+    DEFAULT_GPU_SMOOTHING_WINDOW = 60 # s, window of the EWMA / percentile load signals placement ranks GPUs by
+    DEFAULT_GPU_HISTORY_DIR = None # directory the GPU metric history is saved to, None keeps it in memory only
+    DEFAULT_GPU_HISTORY_SAVE_INTERVAL = 300 # s
+    DEFAULT_GPU_SNAPSHOT_MAX_AGE = 10 # s, placement resamples the GPUs first if the telemetry snapshot is older
+    DEFAULT_RESERVATION_RAMP_TIMEOUT = 120 # s, memory of a new process is reserved until it shows up in NVML (levels off without need_memory) or this timeout
+    DEFAULT_PLACEMENT_POLICY = "spread" # spread: least loaded GPU first, pack: best fit, busiest GPU that fits first (opt in to fill GPUs)
+    DEFAULT_FOREIGN_POLICY = "avoid" # share, avoid (GPUs used by processes outside FlowLine are taken last) or exclude
+    DEFAULT_FOREIGN_MEMORY_MARGIN = 0.1 # fraction of the memory of foreign processes kept free in case they grow
+    DEFAULT_BATCH_DISPATCH = True # fill every free slot in one scheduling pass
+    DEFAULT_BACKFILL_WINDOW = 64 # queued runs scanned per pass when the head of the queue doesn't fit
+    DEFAULT_FAIR_SHARE_HALF_LIFE = 3600 # s, half life of the GPU-seconds an owner used recently
+    DEFAULT_FAIR_SHARE_RUN_COST = 600 # GPU-seconds charged per run picked in the same pass, so owners interleave
+    DEFAULT_BULK_MAX_TASKS = 100000 # tasks one bulk request (sweeps expanded) may create
+    DEFAULT_DB_POOL_SIZE = 8 # pooled SQLite connections shared by the scheduler, API and monitor threads
+    DEFAULT_DB_BUSY_TIMEOUT = 30 # s, a connection waits this long for another writer before "database is locked"
+    DEFAULT_DB_MMAP_SIZE = 256 * 1024 * 1024 # bytes of the task DB read through mmap
     DEBUG = False
-    DEFAULT_LOOP_SLEEP_TIME = 10
+    DEFAULT_LOOP_SLEEP_TIME = 10 # s, fallback tick, the main loop is woken up by events
+    DEFAULT_REAP_INTERVAL = 0.1 # s, reaper poll interval when pidfd is unavailable
+    DEFAULT_RETRY_DELAY = 5 # s, a task whose run failed is retried after this, doubled for every consecutive failure
+    DEFAULT_RETRY_MAX_DELAY = 300 # s, cap of the retry backoff
+    DEFAULT_KILL_GRACE_PERIOD = 10 # s, between SIGTERM and SIGKILL when killing a process
+    DEFAULT_SAMPLE_INTERVAL = 5 # s, CPU / RSS / IO / GPU memory sampling of running jobs
+    DEFAULT_OUTPUT_POLL_INTERVAL = 1 # s, how often the output files of live jobs are followed
+    DEFAULT_OUTPUT_ROTATE_SIZE = 64 * 1024 * 1024 # bytes, a job output file is rotated and compressed past this size
+    DEFAULT_OUTPUT_MAX_SEGMENTS = 10 # rotated segments kept per output file
+    DEFAULT_OUTPUT_RING_LINES = 1000 # last lines of each live job kept in memory
 
 class DevConfig(BaseConfig):
     DEBUG = True
@@ -1,135 +1,35 @@
-try:
-    import pynvml
-    PYNVML_AVAILABLE = True
-except ImportError:
-    PYNVML_AVAILABLE = False
-    
+import os
 import time
 import threading
+import psutil
 
 from flowline.config import config
 from flowline.utils import Log
+from .placement import GPUSlot, PLACEMENT_KEYS, choose_group, place_one
+from .metrics import MetricHistory, METRICS
+from .telemetry import GPUTelemetry, create_backend, virtual_gpu_info
+from .process import ProcessStatus
 
 logger = Log(__name__)
 
+# how placement treats GPUs that processes outside FlowLine are using
+# share: their memory is just used memory, avoid: such GPUs are taken last, exclude: never placed on
+FOREIGN_POLICIES = ["share", "avoid", "exclude"]
+
 
-class GPU_info:
-    def __init__(self, free_memory, total_memory, utilization, all_process_num, name, temperature, power, max_power):
-        self.free_memory = free_memory
-        self.total_memory = total_memory
-        self.utilization = utilization
-        self.user_process_num = 0
-        self.all_process_num = all_process_num
-        self.time = time.time(),
-        self.name = name
-        self.temperature = temperature
-        self.power = power
-        self.max_power = max_power
-        
-    def to_dict(self):
-        return {
-            "free_memory": self.free_memory,
-            "total_memory": self.total_memory,
-            "utilization": self.utilization,
-            "user_process_num": self.user_process_num,
-            "all_process_num": self.all_process_num,
-            "name": self.name,
-            "temperature": self.temperature,
-            "power": self.power,
-            "max_power": self.max_power
-        }
-        
 class GPU:
+    """view of one GPU, info is replaced by every telemetry snapshot"""
     def __init__(self, gpu_id, on_flash=None):
         self.gpu_id = gpu_id
-        self.info_history = []
-        self.info_history_length = 10
-        self.info = []
-        self.user_process_num = 0
+        self.history = MetricHistory()
+        self.info = virtual_gpu_info(gpu_id)
         self.on_flash = on_flash
-        self.monitor_interval = 5
-        self.monitor_thread = self._run_monitor()
-        
-    def flash(self):
-        if not PYNVML_AVAILABLE:
-            # 模拟GPU信息用于非GPU环境
-            total_memory = 8192  # 8GB
-            free_memory = 6144   # 6GB
-            utilization = 0
-            all_process_num = 0
-            name = f"Virtual GPU {self.gpu_id}"
-            temperature = 45
-            power = 50
-            max_power = 250
-            
-            self.info = GPU_info(free_memory, total_memory, utilization, all_process_num, name, temperature, power, max_power)
-            self.info_history.append(self.info)
-            self.info_history = self.info_history[-self.info_history_length:]
-            
-            if self.on_flash:
-                self.on_flash(self.gpu_id, self.info)
-            return
-            
-        try:
-            pynvml.nvmlInit()
-            handle = pynvml.nvmlDeviceGetHandleByIndex(self.gpu_id)
-            memory_info = pynvml.nvmlDeviceGetMemoryInfo(handle)
-            utilization_info = pynvml.nvmlDeviceGetUtilizationRates(handle)
-            process_info = pynvml.nvmlDeviceGetComputeRunningProcesses(handle)
-
-            total_memory = memory_info.total / (1024 ** 2)
-            free_memory = memory_info.free / (1024 ** 2)
-            utilization = utilization_info.gpu
-            all_process_num = len(process_info)
-            gpu_name = pynvml.nvmlDeviceGetName(handle)
-            name = gpu_name.decode('utf-8') if isinstance(gpu_name, bytes) else gpu_name
-            temperature = pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU)
-            power = pynvml.nvmlDeviceGetPowerUsage(handle) / 1000
-            try:
-                max_power = pynvml.nvmlDeviceGetPowerManagementLimit(handle) / 1000
-            except pynvml.NVMLError as e:
-                if e.value == pynvml.NVML_ERROR_NOT_SUPPORTED:
-                    max_power = '?'
-                else:
-                    raise
-                
-            self.info = GPU_info(free_memory, total_memory, utilization, all_process_num, name, temperature, power, max_power)
-            self.info_history.append(self.info)
-            self.info_history = self.info_history[-self.info_history_length:]
-            
-            # logger.info(f"GPU: GPU {self.gpu_id} flashed") 
-            if self.on_flash:
-                self.on_flash(self.gpu_id, self.info)
-            pynvml.nvmlShutdown()
-        except Exception as e:
-            logger.error(f"Error flashing GPU {self.gpu_id}: {e}")
-            # 回退到模拟模式
-            total_memory = 8192
-            free_memory = 6144
-            utilization = 0
-            all_process_num = 0
-            name = f"Virtual GPU {self.gpu_id}"
-            temperature = 45
-            power = 50
-            max_power = 250
-            
-            self.info = GPU_info(free_memory, total_memory, utilization, all_process_num, name, temperature, power, max_power)
-            self.info_history.append(self.info)
-            self.info_history = self.info_history[-self.info_history_length:]
-            
-            if self.on_flash:
-                self.on_flash(self.gpu_id, self.info)
         
-    def _monitor_gpu(self):
-        while True:
-            self.flash()
-            time.sleep(self.monitor_interval)
-            
-    def _run_monitor(self):
-        thread = threading.Thread(target=self._monitor_gpu)
-        thread.daemon = True
-        thread.start()
-        return thread
+    def update(self, info):
+        self.info = info
+        self.history.add(info)
+        if self.on_flash:
+            self.on_flash(self.gpu_id, info)
     
     def get_dict(self):
         return self.info.to_dict()
@@ -137,29 +37,65 @@ class GPU:
     def __str__(self) -> str:
         return f"GPU:{self.gpu_id}"
     
-def get_gpu_count():
-    if not PYNVML_AVAILABLE:
-        # 在非GPU环境中返回1个虚拟GPU
-        return 1
+class MemoryReservation:
+    """memory promised to a freshly launched process that it has not allocated yet"""
+    def __init__(self, process_id, gpu_id, memory, estimated=False):
+        self.process_id = process_id
+        self.gpu_id = gpu_id
+        self.memory = memory
+        self.estimated = estimated  # the task didn't set need_memory, memory is min_process_memory
+        self.start_time = time.time()
+        self.sample_time = None
+        self.last_allocated = 0
+        self.levelled = False
         
-    try:
-        pynvml.nvmlInit()
-        gpu_count = pynvml.nvmlDeviceGetCount()
-        pynvml.nvmlShutdown()
-        return gpu_count
-    except Exception as e:
-        logger.warning(f"Failed to get GPU count: {e}, falling back to virtual GPU")
-        return 1
-    
+    def allocated_memory(self, info):
+        """memory NVML already reports for the process tree of the run, as attributed by GPU_Manager"""
+        return info.run_memory.get(self.process_id, 0)
+        
+    def outstanding_memory(self, info):
+        """part of the reservation not yet visible in the reported free memory"""
+        return max(self.memory - self.allocated_memory(info), 0)
+        
+    def levelled_off(self, info):
+        """the process has allocated memory and it didn't grow since the previous sample"""
+        if info.time != self.sample_time:
+            allocated = self.allocated_memory(info)
+            self.levelled = 0 < allocated <= self.last_allocated
+            self.sample_time, self.last_allocated = info.time, allocated
+        return self.levelled
+
 class GPU_Manager:
-    def __init__(self, use_gpu_id: list, on_flash=None):
+    def __init__(self, use_gpu_id: list, on_flash=None, backend=None):
+        """backend: TelemetryBackend, created from config.DEFAULT_TELEMETRY_BACKEND if None"""
         self._lock = threading.Lock()
-        self.all_gpu = [GPU(i, on_flash) for i in range(get_gpu_count())]
+        self.telemetry = GPUTelemetry(config.DEFAULT_GPU_MONITOR_INTERVAL, self.on_sample,
+                                      backend or create_backend(config.DEFAULT_TELEMETRY_BACKEND), self._attribute,
+                                      config.DEFAULT_GPU_SMOOTHING_WINDOW)
+        self.all_gpu = [GPU(i, on_flash) for i in range(self.telemetry.gpu_count)]
         self.usable_mark = [False] * len(self.all_gpu)
         for gpu_id in use_gpu_id:
             self.usable_mark[gpu_id] = True
-        self.user_process_pid = []
+        self.user_processes = {}  # {pid: process_id} of the running FlowLine jobs
+        self.pid_runs = {}  # {pid: process_id or None}, cached attribution of the pids NVML reports
+        self.foreign_policy = config.DEFAULT_FOREIGN_POLICY
+        self.foreign_memory_margin = config.DEFAULT_FOREIGN_MEMORY_MARGIN
         self.min_process_memory = config.DEFAULT_MIN_PROCESS_MEMORY
+        self.max_processes_per_gpu = config.DEFAULT_MAX_PROCESSES_PER_GPU
+        self.placement_policy = config.DEFAULT_PLACEMENT_POLICY
+        self.reservations = {}  # {(process_id, gpu_id): MemoryReservation}
+        self.reservation_ramp_timeout = config.DEFAULT_RESERVATION_RAMP_TIMEOUT
+        self.snapshot_max_age = config.DEFAULT_GPU_SNAPSHOT_MAX_AGE
+        self.dirty_gpu_ids = set()  # GPUs whose reservations were released since they were last sampled
+        self.topology = self.telemetry.backend.get_topology()
+        self.held_gpu_ids = []
+        self.history_dir = config.DEFAULT_GPU_HISTORY_DIR
+        self.history_save_time = time.time()
+        if self.history_dir:
+            os.makedirs(self.history_dir, exist_ok=True)
+            for gpu in self.all_gpu:
+                gpu.history.load(self._history_path(gpu.gpu_id))
+        self.telemetry.start()
         
     def synchronized(func):
         def wrapper(self, *args, **kwargs):
@@ -167,37 +103,229 @@ class GPU_Manager:
                 return func(self, *args, **kwargs)
         return wrapper
     
-    def update_user_process_num(self, gpu_id, pid, status):
-        if status == "running":
-            self.all_gpu[gpu_id].user_process_num += 1
-        elif status == "completed":
-            self.all_gpu[gpu_id].user_process_num -= 1
-        elif status == "killed":
-            self.all_gpu[gpu_id].user_process_num -= 1
+    def update_user_process(self, process_id, pid, status):
+        """track the root pids of running FlowLine jobs, NVML pids are attributed to them"""
+        if pid is None:
+            return
+        if status == ProcessStatus.RUNNING:
+            self.user_processes[pid] = process_id
+        elif status in [ProcessStatus.COMPLETED, ProcessStatus.FAILED, ProcessStatus.KILLED]:
+            self.user_processes.pop(pid, None)
+        else:
+            return
+        self.pid_runs = {}
+        
+    def _find_run(self, pid):
+        """process_id of the FlowLine job whose process tree contains pid, None for a foreign process"""
+        if pid in self.pid_runs:
+            return self.pid_runs[pid]
+        user_processes = self.user_processes
+        process_id = user_processes.get(pid)
+        if process_id is None:
+            try:
+                for parent in psutil.Process(pid).parents():
+                    if parent.pid in user_processes:
+                        process_id = user_processes[parent.pid]
+                        break
+            except psutil.Error:
+                pass
+        if len(self.pid_runs) > 10000:
+            self.pid_runs = {}
+        self.pid_runs[pid] = process_id
+        return process_id
+    
+    def _attribute(self, info):
+        """split the memory and processes NVML reports on a GPU into FlowLine jobs (ours) and the rest (foreign)"""
+        run_memory, user_process_num, foreign_process_num = {}, 0, 0
+        for pid, memory in info.process_memory.items():
+            process_id = self._find_run(pid)
+            if process_id is None:
+                foreign_process_num += 1
+                continue
+            run_memory[process_id] = run_memory.get(process_id, 0) + memory
+            user_process_num += 1
+        info.run_memory = run_memory
+        info.user_process_num = user_process_num
+        info.user_memory = sum(run_memory.values())
+        info.foreign_memory = max(info.total_memory - info.free_memory - info.user_memory, 0)
+        # a GPU is shared only if a process the backend reports by pid is not ours,
+        # processes it counts without a pid can't be attributed and are taken as foreign
+        info.foreign_process_num = foreign_process_num + max(info.all_process_num - len(info.process_memory), 0)
             
-    def flash_all_gpu(self):
+    def on_sample(self, snapshot):
+        for gpu_id, info in snapshot.items():
+            self.all_gpu[gpu_id].update(info)
+        if self.history_dir and time.time() - self.history_save_time > config.DEFAULT_GPU_HISTORY_SAVE_INTERVAL:
+            self.save_history()
+            
+    def _history_path(self, gpu_id):
+        return os.path.join(self.history_dir, f"gpu{gpu_id}.history")
+    
+    def save_history(self):
+        self.history_save_time = time.time()
         for gpu in self.all_gpu:
-            gpu.flash()
+            try:
+                gpu.history.save(self._history_path(gpu.gpu_id))
+            except OSError as e:
+                logger.error(f"GPU_Manager save_history: GPU {gpu.gpu_id}: {e}")
+                
+    def get_gpu_history(self, gpu_id, metrics, start=None, end=None, step=None):
+        """
+        {metric: [(time, value)]} of one GPU between start and end (unix time, default the last hour),
+        None if gpu_id or a metric is invalid
+        """
+        if gpu_id < 0 or gpu_id >= len(self.all_gpu) or any(metric not in METRICS for metric in metrics):
+            return None
+        end = time.time() if end is None else end
+        start = end - 3600 if start is None else start
+        history = {}
+        for metric in metrics:
+            points_step, points = self.all_gpu[gpu_id].history.query(metric, start, end, step)
+            history[metric] = {"step": points_step, "points": points}
+        return history
+            
+    def refresh_snapshot(self):
+        """
+        resample all GPUs if the snapshot is older than snapshot_max_age, otherwise only the GPUs whose
+        reservations were released (the memory freed by the process isn't in the snapshot yet)
+        the free memory history of those GPUs is dropped too, so the freed memory counts right away
+        runs outside the lock, placement never waits for NVML while holding it
+        """
+        with self._lock:
+            dirty_gpu_ids, self.dirty_gpu_ids = self.dirty_gpu_ids, set()
+        self.telemetry.reset_free_memory(dirty_gpu_ids)
+        if self.telemetry.get_age() > self.snapshot_max_age:
+            self.telemetry.sample()
+        elif dirty_gpu_ids:
+            self.telemetry.sample(sorted(dirty_gpu_ids))
     
-    @synchronized
     def choose_gpu(self):
-        self.flash_all_gpu()
-        choose_gpu = None
-        for gpu in self.all_gpu:
-            if self.usable_mark[gpu.gpu_id]:
-                info = gpu.info
-                if info.free_memory > self.min_process_memory:
-                    if choose_gpu is None:
-                        choose_gpu = gpu
-                        continue
-                    elif info.utilization < choose_gpu.info.utilization:
-                        choose_gpu = gpu
-                    elif info.utilization == gpu.info.utilization:
-                        if info.free_memory > choose_gpu.info.free_memory:
-                            choose_gpu = gpu
-        logger.info(f"GPU_Manager choose_gpu: {choose_gpu}")
-        return choose_gpu.gpu_id if choose_gpu is not None else None
+        gpu_ids = self.place_task(self.get_gpu_slots(), None, 1)
+        return gpu_ids[0] if gpu_ids else None
+    
+    def get_free_slot_num(self, process_num: dict = None):
+        """number of free process slots summed over usable GPUs"""
+        process_num = process_num or {}
+        return sum(max(self.max_processes_per_gpu - process_num.get(gpu.gpu_id, 0), 0)
+                   for gpu in self.all_gpu if self.usable_mark[gpu.gpu_id])
+    
+    def get_gpu_slots(self, process_num: dict = None, flash: bool = True):
+        """
+        free capacity of the usable GPUs from a single telemetry snapshot, for placing the tasks of
+        a scheduling pass one at a time with place_task, every placed task takes its share
+        flash: refresh the snapshot first if it is stale
+        """
+        if flash:
+            self.refresh_snapshot()
+        with self._lock:
+            return self._gpu_slots(process_num or {})
+    
+    def place_task(self, gpus: list, memory, gpu_num: int, exclude_gpu_ids: list = None):
+        """place one task on gpus (from get_gpu_slots) with the current policy, return its gpu_ids or None"""
+        memory = self.min_process_memory if memory is None else memory
+        exclude_gpu_ids = exclude_gpu_ids or []
+        gpu_ids = place_one([gpu for gpu in gpus if gpu.gpu_id not in exclude_gpu_ids], memory, gpu_num,
+                            PLACEMENT_KEYS[self.placement_policy], self.topology)
+        logger.info(f"GPU_Manager place_task ({self.placement_policy}): {gpu_ids}")
+        return gpu_ids
+    
+    def _gpu_slots(self, process_num):
+        gpus = []
+        for gpu_id, info in self.telemetry.snapshot.items():
+            if not self.usable_mark[gpu_id]:
+                continue
+            shared = info.foreign_process_num > 0
+            if shared and self.foreign_policy == "exclude":
+                continue
+            # foreign processes may grow without warning, keep a margin of their memory free
+            free_memory = self._free_memory(info) - self._reserved_memory(gpu_id, info) - (info.foreign_memory * self.foreign_memory_margin if shared else 0)
+            # rank by smoothed utilization, a training job sampled between two steps reads 0%
+            gpus.append(GPUSlot(gpu_id, free_memory, info.utilization_ewma, self.max_processes_per_gpu - process_num.get(gpu_id, 0),
+                                shared and self.foreign_policy == "avoid"))
+        return gpus
+    
+    @staticmethod
+    def _free_memory(info):
+        """free memory to place by: the low end (p10) of the recent samples, a dip in usage between two steps isn't free"""
+        return min(info.free_memory, info.free_memory_p10)
+    
+    @synchronized
+    def hold_gpus(self, memory, gpu_num):
+        """
+        hold GPUs for a task that can't be placed now, so that smaller tasks stop
+        landing on them and the task starts once their processes finish
+        the current hold is kept while it is still valid, return None if the task can never fit
+        """
+        memory = self.min_process_memory if memory is None else memory
+        candidates = [gpu for gpu in self.all_gpu
+                      if self.usable_mark[gpu.gpu_id] and gpu.info.total_memory >= memory
+                      and not (self.foreign_policy == "exclude" and gpu.info.foreign_process_num > 0)]
+        candidate_ids = [gpu.gpu_id for gpu in candidates]
+        if len(self.held_gpu_ids) == gpu_num and all(gpu_id in candidate_ids for gpu_id in self.held_gpu_ids):
+            return self.held_gpu_ids
+        candidates.sort(key=lambda gpu: -(self._free_memory(gpu.info) - self._reserved_memory(gpu.gpu_id)))
+        group = choose_group(candidates, gpu_num, self.topology)
+        self.held_gpu_ids = [gpu.gpu_id for gpu in group] if group else []
+        logger.info(f"GPU_Manager hold_gpus: {self.held_gpu_ids}")
+        return self.held_gpu_ids or None
+    
+    def release_held_gpus(self):
+        self.held_gpu_ids = []
+    
+    def get_held_gpu_ids(self):
+        return list(self.held_gpu_ids)
 
+    @synchronized
+    def reserve_memory(self, process_id, gpu_ids, memory):
+        """
+        hold memory for a process about to be launched until NVML shows it allocated or the ramp timeout expires,
+        made before the launch so a job exiting right away releases it like any other
+        without memory (the task didn't set need_memory) min_process_memory is held only until the memory
+        of the process levels off, a job smaller than that doesn't keep it for the whole ramp timeout
+        """
+        estimated = memory is None
+        memory = self.min_process_memory if estimated else memory
+        for gpu_id in gpu_ids:
+            self.reservations[(process_id, gpu_id)] = MemoryReservation(process_id, gpu_id, memory, estimated)
+        logger.info(f"GPU_Manager reserve_memory: process {process_id} reserved {memory} MB on GPU {gpu_ids}")
+        
+    @synchronized
+    def on_process_start(self, process_id, pid):
+        """the reserved process is running as pid, tell the telemetry backend"""
+        reservations = [r for r in self.reservations.values() if r.process_id == process_id]
+        if reservations:
+            self.telemetry.backend.on_process_start(pid, [r.gpu_id for r in reservations], reservations[0].memory)
+        
+    @synchronized
+    def release_memory(self, process_id, pid=None):
+        """pid: the exited process, passed on to the telemetry backend"""
+        if pid is not None:
+            self.telemetry.backend.on_process_end(pid)
+        keys = [key for key in self.reservations if key[0] == process_id]
+        for key in keys:
+            del self.reservations[key]
+            self.dirty_gpu_ids.add(key[1])
+        # the memory of a job that ramped up long ago is freed too
+        self.dirty_gpu_ids.update(gpu.gpu_id for gpu in self.all_gpu if process_id in gpu.info.run_memory)
+        if keys:
+            logger.info(f"GPU_Manager release_memory: process {process_id} released")
+            
+    def _reserved_memory(self, gpu_id, info=None):
+        """outstanding reserved memory on gpu_id, drop the reservations that have ramped up or timed out"""
+        reserved_memory = 0
+        info = info or self.all_gpu[gpu_id].info
+        now = time.time()
+        for key, reservation in list(self.reservations.items()):
+            if reservation.gpu_id != gpu_id:
+                continue
+            outstanding_memory = reservation.outstanding_memory(info)
+            if (outstanding_memory == 0 or now - reservation.start_time > self.reservation_ramp_timeout
+                    or (reservation.estimated and reservation.levelled_off(info))):
+                del self.reservations[key]
+                continue
+            reserved_memory += outstanding_memory
+        return reserved_memory
+        
     @synchronized
     def switch_gpu(self, gpu_id):
         if gpu_id < 0 or gpu_id >= len(self.all_gpu):
@@ -211,14 +339,70 @@ class GPU_Manager:
         for gpu in self.all_gpu:
             dict = gpu.get_dict()
             dict['status'] = "available" if self.usable_mark[gpu.gpu_id] else "disabled"
+            dict['reserved_memory'] = sum(r.memory for r in list(self.reservations.values()) if r.gpu_id == gpu.gpu_id)
+            dict['held'] = gpu.gpu_id in self.held_gpu_ids
             gpu_dict[gpu.gpu_id] = dict
         return gpu_dict
                 
+    def get_run_gpu_memory(self):
+        """{process_id: {gpu_id: used GPU memory (MB)}} of the FlowLine jobs, from the last snapshot"""
+        run_gpu_memory = {}
+        for gpu_id, info in self.telemetry.snapshot.items():
+            for process_id, memory in info.run_memory.items():
+                run_gpu_memory.setdefault(process_id, {})[gpu_id] = memory
+        return run_gpu_memory
+    
+    def get_process_memory(self):
+        """{pid: used GPU memory (MB)} over all GPUs, from the last flash"""
+        process_memory = {}
+        for gpu in self.all_gpu:
+            for pid, memory in getattr(gpu.info, "process_memory", {}).items():
+                process_memory[pid] = process_memory.get(pid, 0) + memory
+        return process_memory
+    
     def set_min_process_memory(self, min_process_memory):
         self.min_process_memory = min_process_memory
 
     def get_min_process_memory(self):
         return self.min_process_memory
+    
+    def set_max_processes_per_gpu(self, max_processes_per_gpu):
+        self.max_processes_per_gpu = max_processes_per_gpu
+        
+    def get_max_processes_per_gpu(self):
+        return self.max_processes_per_gpu
+    
+    def set_placement_policy(self, placement_policy):
+        if placement_policy not in PLACEMENT_KEYS:
+            logger.error(f"GPU_Manager set_placement_policy: Invalid policy: {placement_policy}")
+            return False
+        self.placement_policy = placement_policy
+        return True
+    
+    def get_placement_policy(self):
+        return self.placement_policy
+    
+    def set_foreign_policy(self, foreign_policy):
+        if foreign_policy not in FOREIGN_POLICIES:
+            logger.error(f"GPU_Manager set_foreign_policy: Invalid policy: {foreign_policy}")
+            return False
+        self.foreign_policy = foreign_policy
+        return True
+    
+    def get_foreign_policy(self):
+        return self.foreign_policy
+    
+    def set_smoothing_window(self, smoothing_window):
+        self.telemetry.set_smoothing_window(smoothing_window)
+        
+    def get_smoothing_window(self):
+        return self.telemetry.smoothing_window
+    
+    def set_snapshot_max_age(self, snapshot_max_age):
+        self.snapshot_max_age = snapshot_max_age
+        
+    def get_snapshot_max_age(self):
+        return self.snapshot_max_age
                 
 # 示例使用
 # gpu_manager = GPU_Manager([0, 1, 2, 3, 4, 5, 6, 7])
@@ -34,7 +34,7 @@ class CommandLineInterface(cmd.Cmd):
         try:
             gpu_id = int(arg.strip())
             num = self.program_manager.kill_process_by_gpu(gpu_id)
-            print(f"killed {num} processes on GPU {gpu_id}")
+            print(f"killing {num} processes on GPU {gpu_id}")
         except ValueError:
             print("error: GPU ID must be a number")
             
@@ -44,17 +44,38 @@ class CommandLineInterface(cmd.Cmd):
             process_id = int(arg.strip())
             if_success = self.program_manager.kill_process(process_id)
             if if_success:
-                print(f"process {process_id} killed")
+                print(f"process {process_id} killing (SIGKILL after {self.program_manager.get_kill_grace_period()}s)")
             else:
-                print(f"error: process ID {process_id} not found")
+                print(f"error: process ID {process_id} not found or not running")
         except ValueError:
             print("error: process ID must be a number")
             
+    def do_killtask(self, arg):
+        """kill all processes of specified task: killtask <task_id>"""
+        try:
+            task_id = int(arg.strip())
+            num = self.program_manager.kill_process_by_task(task_id)
+            print(f"killing {num} processes of task {task_id}")
+        except ValueError:
+            print("error: task ID must be a number")
+            
+    def do_grace(self, arg):
+        """set the seconds between SIGTERM and SIGKILL when killing: grace <seconds>"""
+        if not arg.strip():
+            print(f"kill grace period: {self.program_manager.get_kill_grace_period()}s")
+            return
+        try:
+            grace_period = float(arg.strip())
+            self.program_manager.set_kill_grace_period(grace_period)
+            print(f"kill grace period set to {grace_period}s")
+        except ValueError:
+            print("error: grace period must be a number")
+            
     def do_ls(self, arg):
         """list all processes: ls"""
         dict = self.program_manager.get_process_dict()
         terminal_width = shutil.get_terminal_size().columns
-        print(f"now processes: {len(dict)}, max processes: {self.program_manager.get_max_processes()}")
+        print(f"now processes: {len(dict)}, max processes per GPU: {self.program_manager.get_max_processes()}")
         if len(dict) == 0:
             print("no running processes")
             return
@@ -62,7 +83,8 @@ class CommandLineInterface(cmd.Cmd):
         print(f"{'ProcID':<8} {'PID':<8} {'TaskID':<8} {'GPUID':<8} {'Status':<8} {'Cmd':<100}")
         print("-" * 130)
         for k, v in dict.items():
-            print(f"{k:<8} {v['pid']:<8} {v['task_id']:<8} {v['gpu_id']:<8} {v['status']:<8} {v['cmd'][:80]}")
+            gpu_str = ",".join(str(gpu_id) for gpu_id in v['gpu_ids'])
+            print(f"{k:<8} {v['pid']:<8} {v['task_id']:<8} {gpu_str:<8} {v['status']:<8} {v['cmd'][:80]}")
             while len(v['cmd']) > 80:
                 print(" "*45, end="")
                 v['cmd'] = v['cmd'][80:]
@@ -75,16 +97,17 @@ class CommandLineInterface(cmd.Cmd):
         dict = self.program_manager.get_gpu_dict()
         terminal_width = shutil.get_terminal_size().columns
         print(f"min process memory: {self.program_manager.get_min_process_memory()} MB")
-        print("-" * 100)
-        print(f"{'ID':<5} {'Status':<12} {'Util':<10} {'Free/Total(MB)':<18} {'Use/All':<10} {'Temp':<8} {'Power/Max(W)':<20}")
-        print("-" * 100)
+        print("-" * 120)
+        print(f"{'ID':<5} {'Status':<12} {'Util/Avg':<10} {'Free/Total(MB)':<18} {'Ours/Foreign(MB)':<18} {'Use/All':<10} {'Temp':<8} {'Power/Max(W)':<20}")
+        print("-" * 120)
         for k, v in dict.items():
-            util_str = f"{v['utilization']:>3.0f}%"
+            util_str = f"{v['utilization']:>3.0f}%/{v['utilization_ewma']:>3.0f}%"
             memory_str = f"{v['free_memory']:>6.0f}/{v['total_memory']:<6.0f}"
+            owner_str = f"{v['user_memory']:>6.0f}/{v['foreign_memory']:<6.0f}"
             process_str = f"{v['user_process_num']:>3}/{v['all_process_num']:<3}"
             power_str = f"{v['power']:>6}/{v['max_power']:<6}"
-            print(f"{k:<5} {v['status']:<12} {util_str:<10} {memory_str:<18} {process_str:<10} {v['temperature']:<8} {power_str:<20}")
-        print("-" * 100)
+            print(f"{k:<5} {v['status']:<12} {util_str:<10} {memory_str:<18} {owner_str:<18} {process_str:<10} {v['temperature']:<8} {power_str:<20}")
+        print("-" * 120)
 
     def do_min(self, arg):
         """set the min process memory (MB): min <num>"""
@@ -104,13 +127,33 @@ class CommandLineInterface(cmd.Cmd):
         return self.do_exit(arg)
     
     def do_max(self, arg):
-        """set the max processes: max <num>"""
+        """set the max processes per GPU: max <num>"""
         try:
             max_processes = int(arg.strip())
             self.program_manager.set_max_processes(max_processes)
         except ValueError:
             print("error: max processes must be a number")
             
+    def do_policy(self, arg):
+        """set the GPU placement policy: policy <spread|pack>"""
+        placement_policy = arg.strip()
+        if not placement_policy:
+            print(f"placement policy: {self.program_manager.get_placement_policy()}")
+        elif self.program_manager.set_placement_policy(placement_policy):
+            print(f"placement policy switched to {placement_policy}")
+        else:
+            print(f"error: invalid placement policy: {placement_policy}")
+            
+    def do_foreign(self, arg):
+        """set how GPUs used by processes outside FlowLine are treated: foreign <share|avoid|exclude>"""
+        foreign_policy = arg.strip()
+        if not foreign_policy:
+            print(f"foreign policy: {self.program_manager.get_foreign_policy()}")
+        elif self.program_manager.set_foreign_policy(foreign_policy):
+            print(f"foreign policy switched to {foreign_policy}")
+        else:
+            print(f"error: invalid foreign policy: {foreign_policy}")
+            
     def do_task(self, arg):
         """list the task: task"""
         tasks = self.program_manager.get_task_dict()
@@ -120,14 +163,93 @@ class CommandLineInterface(cmd.Cmd):
             return
         print(f"Pending task num: {len(tasks)}")
         print("-" * 100)
-        print(f"{'Task_ID':<8} {'Name':<12} {'run_num':<8} {'Dict':<20}")
+        print(f"{'Task_ID':<8} {'Name':<12} {'run_num':<8} {'Priority':<9} {'Owner':<12} {'Dict':<20}")
         print("-" * 100)
         for k, v in enumerate(tasks):
             if k >= max_show_num:
                 print(f"...")
                 break
-            print(f"{v['task_id']:<8} {v['name']:<12} {v['run_num']:<8} {v['dict']:<20}")
+            print(f"{v['task_id']:<8} {v['name']:<12} {v['run_num']:<8} {v['priority']:<9} {v['owner'] or '-':<12} {v['dict']:<20}")
+        print("-" * 100)
+
+    def do_priority(self, arg):
+        """set the priority of a task, larger runs first: priority <task_id> <num>"""
+        try:
+            task_id, priority = (int(x) for x in arg.split())
+            if self.program_manager.set_task_priority(task_id, priority):
+                print(f"task {task_id} priority set to {priority}")
+            else:
+                print(f"error: task ID {task_id} not found")
+        except ValueError:
+            print("error: usage: priority <task_id> <num>")
+            
+    def do_weight(self, arg):
+        """set the fair-share weight of an owner: weight <owner> <num>"""
+        try:
+            owner, weight = arg.split()
+            weight = float(weight)
+            if weight <= 0:
+                raise ValueError
+            self.program_manager.set_owner_weight(owner, weight)
+            print(f"owner {owner} weight set to {weight}")
+        except ValueError:
+            print("error: usage: weight <owner> <positive number>")
+            
+    def do_runs(self, arg):
+        """list run history, newest first: runs [task=<id>] [status=<status>] [limit=<num>], e.g. runs status=failed limit=100"""
+        try:
+            options = dict(item.split("=", 1) for item in arg.split())
+            task_id = int(options["task"]) if "task" in options else None
+            status = options["status"].upper() if "status" in options else None
+            limit = int(options.get("limit", 20))
+        except ValueError:
+            print("error: usage: runs [task=<id>] [status=<status>] [limit=<num>]")
+            return
+        runs = self.program_manager.get_runs(task_id=task_id, status=status, limit=limit)
+        if len(runs) == 0:
+            print("no run")
+            return
+        print("-" * 100)
+        print(f"{'Run_ID':<8} {'Task_ID':<8} {'GPU':<8} {'Status':<10} {'Code':<6} {'Start':<20} {'Wall':<9} {'Peak RSS':<10} {'Peak GPU':<10}")
         print("-" * 100)
+        for run in runs:
+            gpu_ids = ",".join(str(gpu_id) for gpu_id in run['gpu_ids'] or [])
+            start_time = (run['start_time'] or "-")[:19]
+            wall_time = "-" if run['wall_time'] is None else f"{run['wall_time']:.0f}s"
+            peak_rss = "-" if run['peak_rss'] is None else f"{run['peak_rss']:.0f}MB"
+            peak_gpu_memory = "-" if run['peak_gpu_memory'] is None else f"{run['peak_gpu_memory']:.0f}MB"
+            returncode = "-" if run['returncode'] is None else run['returncode']
+            print(f"{run['run_id']:<8} {run['task_id']:<8} {gpu_ids:<8} {run['status']:<10} {returncode:<6} {start_time:<20} {wall_time:<9} {peak_rss:<10} {peak_gpu_memory:<10}")
+        print("-" * 100)
+            
+    def do_output(self, arg):
+        """show the last lines of a run's output: output <run_id> [lines] [err]"""
+        args = arg.split()
+        try:
+            run_id = int(args[0])
+            num = int(args[1]) if len(args) > 1 and args[1].isdigit() else 20
+        except (IndexError, ValueError):
+            print("error: usage: output <run_id> [lines] [err]")
+            return
+        stream = "stderr" if "err" in args[1:] else "stdout"
+        lines = self.program_manager.get_run_output_tail(run_id, stream, num)
+        if lines is None:
+            print(f"error: run ID {run_id} not found")
+            return
+        for line in lines:
+            print(line)
+            
+    def do_stats(self, arg):
+        """show the task queue wait statistics: stats"""
+        stats = self.program_manager.get_queue_stats()
+        def fmt(wait):
+            return "-" if wait is None else f"{wait:.1f}s"
+        print(f"pending runs: {stats['pending_num']}, dispatched: {stats['dispatched_num']}, backfilled: {stats['backfilled_num']}")
+        print(f"queue wait: mean {fmt(stats['wait_mean'])}, p50 {fmt(stats['wait_p50'])}, p95 {fmt(stats['wait_p95'])}, max {fmt(stats['wait_max'])}")
+        if stats['blocked_task_id'] is not None:
+            print(f"blocked task: {stats['blocked_task_id']}, held GPUs: {stats['held_gpu_ids']}")
+        for owner, share in stats['fair_share'].items():
+            print(f"owner {owner}: usage {share['usage']:.0f} GPU-s, weight {share['weight']}, running GPUs {share['running_gpus']}")
 
 def run_cli(func, task_dir=None):
     """run the command line interface"""
@@ -0,0 +1,166 @@
+import math
+import os
+import time
+from array import array
+from collections import deque
+
+from flowline.utils import Log
+
+logger = Log(__name__)
+
+METRICS = ["utilization", "used_memory", "free_memory", "temperature", "power"]
+# (step (s), points) of each resolution: raw 5 s for 1 hour, 1 min for 1 day, 10 min for 30 days
+RESOLUTIONS = [(5, 720), (60, 1440), (600, 4320)]
+
+
+class LoadSignal:
+    """
+    smoothed view of one noisy GPU metric: an EWMA with time constant window (s), so irregular
+    sample intervals weigh correctly, and percentiles over the samples of the last window seconds
+    """
+    def __init__(self, window: float):
+        self.window = window
+        self.ewma = None
+        self.last_time = None
+        self.samples = deque()  # (time, value)
+
+    def add(self, t: float, value: float):
+        if self.last_time is not None and t <= self.last_time:
+            return
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            alpha = 1 - math.exp(-(t - self.last_time) / self.window) if self.window > 0 else 1
+            self.ewma += alpha * (value - self.ewma)
+        self.last_time = t
+        self.samples.append((t, value))
+        while self.samples[0][0] < t - self.window:
+            self.samples.popleft()
+
+    def percentile(self, q: float) -> float:
+        """nearest-rank q-th percentile (0-100) of the window"""
+        values = sorted(value for _, value in self.samples)
+        if not values:
+            return 0
+        return values[min(max(math.ceil(q / 100 * len(values)) - 1, 0), len(values) - 1)]
+
+
+class RingSeries:
+    """
+    fixed-size ring of (bucket start, mean value) of one metric at one resolution, backed by two
+    array('d') so samples never allocate, samples falling in the same step-aligned bucket are averaged
+    """
+    def __init__(self, step: int, size: int):
+        self.step = step
+        self.size = size
+        self.times = array('d', bytes(8 * size))
+        self.values = array('d', bytes(8 * size))
+        self.head = 0  # next slot to write
+        self.count = 0
+        self.bucket = None  # start of the bucket being filled, not in the ring yet
+        self.sum = 0.0
+        self.num = 0
+
+    def add(self, t: float, value: float):
+        bucket = t - t % self.step
+        if self.bucket is not None and bucket < self.bucket:
+            return
+        if self.bucket is not None and bucket != self.bucket:
+            self._push(self.bucket, self.sum / self.num)
+            self.sum, self.num = 0.0, 0
+        self.bucket = bucket
+        self.sum += value
+        self.num += 1
+
+    def _push(self, t: float, value: float):
+        self.times[self.head] = t
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def points(self, start: float, end: float) -> list:
+        """[(bucket start, value)] with start <= bucket start <= end, oldest first, the open bucket included"""
+        points = []
+        for i in range(self.head - self.count, self.head):
+            t = self.times[i % self.size]
+            if start <= t <= end:
+                points.append((t, self.values[i % self.size]))
+        if self.bucket is not None and start <= self.bucket <= end:
+            points.append((self.bucket, self.sum / self.num))
+        return points
+
+    def oldest(self) -> float:
+        if self.count:
+            return self.times[(self.head - self.count) % self.size]
+        return self.bucket if self.bucket is not None else time.time()
+
+    def dump(self) -> bytes:
+        return array('q', [self.head, self.count]).tobytes() + self.times.tobytes() + self.values.tobytes()
+
+    def load(self, data: bytes):
+        header = array('q')
+        header.frombytes(data[:16])
+        self.head, self.count = header
+        self.times = array('d')
+        self.times.frombytes(data[16:16 + 8 * self.size])
+        self.values = array('d')
+        self.values.frombytes(data[16 + 8 * self.size:])
+
+    def nbytes(self) -> int:
+        return 16 + 16 * self.size
+
+
+class MetricHistory:
+    """multi-resolution history of the metrics of one GPU, every sample goes into all resolutions"""
+    def __init__(self):
+        self.series = {metric: [RingSeries(step, size) for step, size in RESOLUTIONS] for metric in METRICS}
+
+    def add(self, info):
+        values = {
+            "utilization": info.utilization,
+            "used_memory": info.total_memory - info.free_memory,
+            "free_memory": info.free_memory,
+            "temperature": info.temperature,
+            "power": info.power,
+        }
+        for metric, value in values.items():
+            for series in self.series[metric]:
+                series.add(info.time, float(value))
+
+    def query(self, metric: str, start: float, end: float, step: int = None):
+        """
+        points of metric between start and end from the finest resolution that still covers start,
+        averaged into step (s) buckets if step is coarser than that resolution
+        return (step of the points, [(time, value)])
+        """
+        resolutions = self.series[metric]
+        series = next((s for s in resolutions if s.oldest() <= start or s.count < s.size), resolutions[-1])
+        points = series.points(start, end)
+        if not step or step <= series.step:
+            return series.step, points
+        buckets = {}
+        for t, value in points:
+            buckets.setdefault(t - t % step, []).append(value)
+        return step, [(t, sum(values) / len(values)) for t, values in sorted(buckets.items())]
+
+    def save(self, path: str):
+        data = b"".join(series.dump() for metric in METRICS for series in self.series[metric])
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    def load(self, path: str):
+        """load a saved history, ignored if missing or saved with other resolutions"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        all_series = [series for metric in METRICS for series in self.series[metric]]
+        if len(data) != sum(series.nbytes() for series in all_series):
+            logger.warning(f"MetricHistory: ignore {path}, saved with another layout")
+            return
+        offset = 0
+        for series in all_series:
+            series.load(data[offset:offset + series.nbytes()])
+            offset += series.nbytes()
@@ -0,0 +1,256 @@
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+import gzip
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from flowline.utils import Log
+
+logger = Log(__name__)
+
+"""
+job output files: jobs write straight into log/{run_id}.out / .err (opened O_APPEND), so they
+keep running while FlowLine restarts. once a file grows past rotate_size it is read, truncated
+right away and written as a raw segment log/{run_id}.out.{start}-{end}.raw, which is then
+compressed into .zst (.gz without zstandard) off the critical path, start/end are byte offsets
+in the whole output so offsets stay valid across rotations
+"""
+
+
+def list_segments(path):
+    """rotated segments of an output file: [(start, end, segment_path)] ordered by start"""
+    directory, name = os.path.split(path)
+    pattern = re.compile(re.escape(name) + r"\.(\d+)-(\d+)\.(gz|zst|raw)$")
+    segments = {}
+    try:
+        file_names = os.listdir(directory or ".")
+    except OSError:
+        return []
+    for file_name in file_names:
+        match = pattern.match(file_name)
+        if match:
+            key = (int(match.group(1)), int(match.group(2)))
+            # a raw segment being compressed may briefly sit next to its compressed copy, prefer the latter
+            if key not in segments or segments[key].endswith(".raw"):
+                segments[key] = os.path.join(directory, file_name)
+    return sorted((start, end, segment_path) for (start, end), segment_path in segments.items())
+
+
+def write_raw_segment(data: bytes, path: str, start: int) -> str:
+    segment_path = f"{path}.{start}-{start + len(data)}.raw"
+    with open(segment_path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(segment_path + ".tmp", segment_path)
+    return segment_path
+
+
+def compress_segment(data: bytes, path: str, start: int) -> str:
+    suffix = "zst" if ZSTD_AVAILABLE else "gz"
+    segment_path = f"{path}.{start}-{start + len(data)}.{suffix}"
+    compressed = zstandard.ZstdCompressor().compress(data) if ZSTD_AVAILABLE else gzip.compress(data)
+    with open(segment_path + ".tmp", "wb") as f:
+        f.write(compressed)
+    os.replace(segment_path + ".tmp", segment_path)
+    return segment_path
+
+
+def decompress_segment(segment_path: str) -> bytes:
+    if segment_path.endswith(".raw"):
+        try:
+            with open(segment_path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # compressed in the meantime, the raw segment is removed once its copy is in place
+            suffix = "zst" if ZSTD_AVAILABLE else "gz"
+            segment_path = f"{segment_path[:-len('raw')]}{suffix}"
+    with open(segment_path, "rb") as f:
+        data = f.read()
+    if segment_path.endswith(".zst"):
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def read_output(path: str, offset: int = 0, limit: int = 65536) -> dict:
+    """
+    read at most limit bytes of a job's output starting at offset (counted over the whole output,
+    rotated segments included), offsets older than the oldest kept segment jump to it (truncated)
+    """
+    segments = list_segments(path)
+    first = segments[0][0] if segments else 0
+    base = segments[-1][1] if segments else 0
+    truncated = offset < first
+    offset = max(offset, first)
+    data = b""
+    if offset < base:
+        for start, end, segment_path in segments:
+            if start <= offset < end:
+                data = decompress_segment(segment_path)[offset - start:offset - start + limit]
+                break
+    try:
+        size = os.path.getsize(path)
+        if offset >= base:
+            with open(path, "rb") as f:
+                f.seek(offset - base)
+                data = f.read(limit)
+    except OSError:
+        size = 0
+    return {
+        "offset": offset,
+        "next_offset": offset + len(data),
+        "size": base + size,
+        "truncated": truncated,
+        "data": data.decode("utf-8", errors="replace"),
+    }
+
+
+def tail_lines(path: str, num: int, block_size: int = 65536) -> list:
+    """last num lines of an output file, the newest rotated segment is read too if the file is short of lines"""
+    data = b""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            pointer = f.tell()
+            while pointer > 0 and data.count(b"\n") <= num:
+                read_size = min(block_size, pointer)
+                pointer -= read_size
+                f.seek(pointer)
+                data = f.read(read_size) + data
+    except OSError:
+        pass
+    segments = list_segments(path)
+    if data.count(b"\n") <= num and segments:
+        data = decompress_segment(segments[-1][2]) + data
+    return data.decode("utf-8", errors="replace").splitlines()[-num:]
+
+
+class OutputStream:
+    """one output file of a live job: follows it, keeps its last lines and rotates it"""
+    def __init__(self, path: str, ring_lines: int):
+        self.path = path
+        segments = list_segments(path)
+        self.base = segments[-1][1] if segments else 0  # bytes already rotated into segments
+        self.position = 0  # bytes of the current file already read
+        self.lines = deque(maxlen=ring_lines)
+        self.partial = b""
+
+    def _feed(self, data: bytes):
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        self.lines.extend(line.decode("utf-8", errors="replace") for line in lines)
+
+    def poll(self, rotate_size: int):
+        """read what the job wrote, returns a rotated segment still to compress or None"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return None
+        if size < self.position:
+            # truncated by someone else
+            self.position = 0
+        if size > self.position:
+            with open(self.path, "rb") as f:
+                f.seek(self.position)
+                data = f.read(size - self.position)
+            self.position += len(data)
+            self._feed(data)
+        if self.position >= rotate_size:
+            return self.rotate()
+        return None
+
+    def rotate(self):
+        """
+        copy-truncate: the job keeps its O_APPEND fd, so after the truncate it simply writes at
+        the new end, only bytes written between the read and the truncate right after it are lost
+        (as with logrotate), the copy is kept as a raw segment and compressed later by finish_rotate
+        """
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            f.truncate(0)
+        self._feed(data[self.position:])
+        raw_path = write_raw_segment(data, self.path, self.base)
+        start = self.base
+        self.base += len(data)
+        self.position = 0
+        return data, start, raw_path
+
+    def finish_rotate(self, rotated, max_segments: int):
+        """compress a segment returned by rotate and drop the oldest segments beyond max_segments"""
+        data, start, raw_path = rotated
+        compress_segment(data, self.path, start)
+        os.remove(raw_path)
+        for _, _, segment_path in list_segments(self.path)[:-max_segments]:
+            try:
+                os.remove(segment_path)
+            except OSError:
+                pass
+
+    def tail(self, num: int) -> list:
+        lines = list(self.lines)
+        if self.partial:
+            lines.append(self.partial.decode("utf-8", errors="replace"))
+        return lines[-num:]
+
+
+class OutputPipeline:
+    """one thread following the output files of all live jobs every interval"""
+    def __init__(self, interval: float, rotate_size: int, max_segments: int, ring_lines: int):
+        self.interval = interval
+        self.rotate_size = rotate_size
+        self.max_segments = max_segments
+        self.ring_lines = ring_lines
+        self.streams = {}  # {run_id: {"stdout": OutputStream, "stderr": OutputStream}}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def watch(self, run_id: int, paths: dict):
+        """paths: {stream name: output file}"""
+        streams = {name: OutputStream(path, self.ring_lines) for name, path in paths.items()}
+        with self._lock:
+            self.streams[run_id] = streams
+
+    def unwatch(self, run_id: int):
+        """the job has exited: read what is left, rotate if needed and forget it"""
+        with self._lock:
+            streams = self.streams.pop(run_id, {})
+            rotated = [(stream, stream.poll(self.rotate_size)) for stream in streams.values()]
+        self._finish_rotations(rotated)
+
+    def tail(self, run_id: int, name: str, num: int):
+        """last num lines of a live job from memory, None if the job isn't followed"""
+        with self._lock:
+            stream = self.streams.get(run_id, {}).get(name)
+            return stream.tail(num) if stream else None
+
+    def poll_once(self):
+        rotated = []
+        with self._lock:
+            for streams in self.streams.values():
+                for stream in streams.values():
+                    try:
+                        rotated.append((stream, stream.poll(self.rotate_size)))
+                    except Exception as e:
+                        logger.error(f"OutputPipeline: failed to follow {stream.path}: {e}")
+        # compressing takes a while, the lock is only needed to read and truncate
+        self._finish_rotations(rotated)
+
+    def _finish_rotations(self, rotated: list):
+        for stream, segment in rotated:
+            if segment is None:
+                continue
+            try:
+                stream.finish_rotate(segment, self.max_segments)
+            except Exception as e:
+                logger.error(f"OutputPipeline: failed to compress a segment of {stream.path}: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.poll_once()
@@ -0,0 +1,71 @@
+from typing import Dict, List, Optional, Tuple
+
+
+class GPUSlot:
+    """snapshot of one usable GPU as seen by a placement pass"""
+    def __init__(self, gpu_id: int, free_memory: float, utilization: float, free_slots: int, shared: bool = False):
+        self.gpu_id = gpu_id
+        self.free_memory = free_memory
+        self.utilization = utilization
+        self.free_slots = free_slots
+        self.shared = shared  # used by processes outside FlowLine, only taken when no other GPU fits
+        self.placed_num = 0
+
+    def fit(self, memory: float) -> bool:
+        return self.free_slots > 0 and self.free_memory >= memory
+
+    def take(self, memory: float):
+        self.free_memory -= memory
+        self.free_slots -= 1
+        self.placed_num += 1
+
+    def __str__(self) -> str:
+        return f"GPUSlot:{self.gpu_id}"
+
+
+def choose_group(candidates: list, gpu_num: int, topology: Dict[Tuple[int, int], int] = None) -> Optional[list]:
+    """
+    choose gpu_num GPUs out of candidates (ordered by preference) for one task
+    topology: {(gpu_id, gpu_id): distance}, smaller is closer (same NVLink/PCIe switch),
+    the group with the smallest max pairwise distance wins, ties go to preference order
+    """
+    if len(candidates) < gpu_num:
+        return None
+    if gpu_num == 1 or not topology:
+        return candidates[:gpu_num]
+    best_group, best_key = None, None
+    for i, seed in enumerate(candidates):
+        others = sorted(candidates[:i] + candidates[i + 1:], key=lambda gpu: topology.get((seed.gpu_id, gpu.gpu_id), 0))
+        group = [seed] + others[:gpu_num - 1]
+        distance = max(topology.get((a.gpu_id, b.gpu_id), 0) for a in group for b in group if a is not b)
+        if best_key is None or (distance, i) < best_key:
+            best_group, best_key = group, (distance, i)
+    return best_group
+
+
+def spread_key(gpu: GPUSlot):
+    """spread: not shared with foreign processes, fewest processes placed in this pass, lowest utilization, most free memory"""
+    return gpu.shared, gpu.placed_num, gpu.utilization, -gpu.free_memory
+
+
+def pack_key(gpu: GPUSlot):
+    """pack (best fit): not shared with foreign processes, least free memory left, then lowest utilization"""
+    return gpu.shared, gpu.free_memory, gpu.utilization
+
+
+def place_one(gpus: List[GPUSlot], memory: float, gpu_num: int, key, topology=None) -> Optional[List[int]]:
+    """place one task on the gpu_num GPUs ranked first by key that fit it and take their capacity, None if it doesn't fit"""
+    candidates = sorted([gpu for gpu in gpus if gpu.fit(memory)], key=key)
+    group = choose_group(candidates, gpu_num, topology)
+    if group is None:
+        return None
+    for gpu in group:
+        gpu.take(memory)
+    return [gpu.gpu_id for gpu in group]
+
+
+# placement policies: the GPU ranking used when the tasks of a pass are placed one at a time in queue order
+PLACEMENT_KEYS = {
+    "spread": spread_key,
+    "pack": pack_key,
+}
@@ -1,9 +1,15 @@
-import multiprocessing
+import heapq
+import itertools
+import os
+import selectors
+import signal
 import time
 import threading
 
 from flowline.config import config
 from flowline.utils import PopenProcess, Log
+from .sampler import RunUsage, ResourceSampler
+from .output import OutputPipeline
 
 logger = Log(__name__)
 
@@ -25,82 +31,110 @@ PENDING ─> RUNNING ─> COMPLETED √
 """
 
 class Process:
-    def __init__(self, process_id: int, cmd: str, task_id: int, gpu_id: int, working_dir: str = None, on_status_changed=None):
-        self.manager = multiprocessing.Manager()
-        self.shared_dict = self.manager.dict()
-        self.shared_dict["status"] = ProcessStatus.PENDING
+    def __init__(self, process_id: int, cmd: str, task_id: int, gpu_id, working_dir: str = None, on_status_changed=None,
+                 attach_run: dict = None):
+        """attach_run: the run record of a job an earlier FlowLine started, reattach to it instead of starting cmd"""
+        self._lock = threading.Lock()
+        self.status = ProcessStatus.PENDING
         self.on_status_changed = on_status_changed
         
         self.process_id = process_id
         self.cmd = cmd
         self.task_id = task_id
-        self.gpu_id = gpu_id
+        self.gpu_ids = list(gpu_id) if isinstance(gpu_id, (list, tuple)) else [gpu_id]
+        self.gpu_id = self.gpu_ids[0]
         self.working_dir = working_dir
         self.start_time = time.time()
         
         self.pid = None
-        self._process = None
-        self.result_queue = multiprocessing.Queue()
-        self.run()
-        self.pid = self._process.pid
+        self.returncode = None
+        self.rusage = None
+        self.usage = RunUsage()
+        self._exited = threading.Event()
+        self._process = PopenProcess(self.process_id, self.working_dir)
+        if attach_run is None:
+            self.run()
+        else:
+            self.attach(attach_run)
         
-    def change_status(self, status: ProcessStatus):
+    def change_status(self, status: ProcessStatus, from_status: list = None):
+        """change status, only if the current status is in from_status when given"""
+        with self._lock:
+            if from_status is not None and self.status not in from_status:
+                return False
+            logger.info(f"[ID {self.process_id}] [Task {self.task_id}] [GPU {self.gpu_id}] Change status from '{self.status}' to '{status}'")
+            self.status = status
         try:
-            logger.info(f"[ID {self.process_id}] [Task {self.task_id}] [GPU {self.gpu_id}] Change status from '{self.shared_dict['status']}' to '{status}'")
-            self.shared_dict["status"] = status
             if self.on_status_changed:
                 self.on_status_changed(self)
         except Exception as e:
             logger.error(f"Process change_status: failed: {e}")
+        return True
             
     def get_status(self):
-        return self.shared_dict["status"]
+        return self.status
         
     def run(self):
         try:
-            self._process = multiprocessing.Process(target=PopenProcess(self.result_queue, self.process_id, self.working_dir).fcb, args=(self.cmd,))
-            self._process.daemon = True
-            self._process.start()
+            self.pid = self._process.start(self.cmd)
             self.change_status(ProcessStatus.RUNNING)
-            threading.Thread(target=self._wait_result, daemon=True).start()
         except Exception as e:
             logger.error(f"Process run: failed: {e}")
             raise e
-    
-    def _wait_result(self):
-        try:
-            self._process.join()
-            success, result = self.result_queue.get()
-            if success:
-                self.on_completed()
-            else:
-                if self.get_status() != ProcessStatus.KILLED and self.get_status() != ProcessStatus.KILLING:
-                    self.on_failed(result)
-        except Exception as e:
-            logger.error(f"Process _wait_result: failed: {e}")
             
-    def kill(self):
-        if self.shared_dict["status"] in [ProcessStatus.RUNNING]:
-            self._process.terminate()
-            self.change_status(ProcessStatus.KILLING)
-            self._process.join()
-            if self._process.is_alive():
-                logger.warning(f"[ID {self.process_id}] [Task {self.task_id}] [GPU {self.gpu_id}] Process is can't be killed")
-                return False
-            else:
-                self.change_status(ProcessStatus.KILLED)
-                return True
+    def attach(self, run: dict):
+        self.pid = self._process.attach(run["pid"], run["stdout_path"], run["stderr_path"], run["exit_path"])
+        logger.info(f"[ID {self.process_id}] [Task {self.task_id}] [GPU {self.gpu_id}] Reattached to pid {self.pid}")
+        self.change_status(ProcessStatus.RUNNING)
+    
+    def on_exit(self, returncode, rusage=None):
+        """
+        called by the reaper of ProcessManager once the job has been reaped,
+        returncode is None for a reattached job, it is read from the exit file then
+        """
+        if returncode is None:
+            returncode = self._process.read_exit_status()
+        self.returncode = returncode
+        self.rusage = rusage
+        self.usage.on_exit(rusage)
+        self._process.on_exit(returncode)
+        logger.info(f"Process {self.process_id} finished with return code {returncode}")
+        if self.change_status(ProcessStatus.KILLED, [ProcessStatus.KILLING]):
+            pass
+        elif returncode == 0:
+            self.on_completed()
         else:
+            self.on_failed("exit status lost" if returncode is None else f"return code {returncode}")
+        self._exited.set()
+
+    def kill(self):
+        """send SIGTERM to the process group, the status stays KILLING until the reaper sees the exit"""
+        if not self.change_status(ProcessStatus.KILLING, [ProcessStatus.RUNNING]):
             logger.warning(f"[ID {self.process_id}] [Task {self.task_id}] [GPU {self.gpu_id}] Process is not running")
             return False
+        self._process.terminate()
+        return True
+    
+    def force_kill(self):
+        """escalate to SIGKILL if the job is still alive after the grace period"""
+        if self._exited.is_set():
+            return
+        logger.warning(f"[ID {self.process_id}] [Task {self.task_id}] [GPU {self.gpu_id}] Still alive after SIGTERM, sending SIGKILL")
+        self._process.kill()
+        
+    def wait(self, timeout: float = None) -> bool:
+        return self._exited.wait(timeout)
         
     def on_completed(self, result = None):
-        logger.info(f"[ID {self.process_id}] [Task {self.task_id}] [GPU {self.gpu_id}] Completed (result:{result})")
-        self.change_status(ProcessStatus.COMPLETED)
+        if self.change_status(ProcessStatus.COMPLETED, [ProcessStatus.RUNNING]):
+            logger.info(f"[ID {self.process_id}] [Task {self.task_id}] [GPU {self.gpu_id}] Completed (result:{result})")
         
     def on_failed(self, error):
-        logger.error(f"[ID {self.process_id}] [Task {self.task_id}] [GPU {self.gpu_id}] Failed (error:{error})")
-        self.change_status(ProcessStatus.FAILED)
+        if self.change_status(ProcessStatus.FAILED, [ProcessStatus.RUNNING]):
+            logger.error(f"[ID {self.process_id}] [Task {self.task_id}] [GPU {self.gpu_id}] Failed (error:{error})")
+        
+    def get_output_paths(self):
+        return {"stdout": self._process.stdout_path, "stderr": self._process.stderr_path}
         
     def get_dict(self):
         return {
@@ -108,19 +142,213 @@ class Process:
             "pid": self.pid,
             "task_id": self.task_id,
             "gpu_id": self.gpu_id,
+            "gpu_ids": self.gpu_ids,
             "start_time": self.start_time,
             "status": self.get_status(),
-            "cmd": self.cmd
+            "cmd": self.cmd,
+            "stdout_path": self._process.stdout_path,
+            "stderr_path": self._process.stderr_path,
+            "exit_path": self._process.exit_path,
+            "returncode": self.returncode,
+            "rusage": {
+                "utime": self.rusage.ru_utime,
+                "stime": self.rusage.ru_stime,
+                "maxrss": self.rusage.ru_maxrss,
+            } if self.rusage else None,
+            "usage": self.usage.to_dict(),
         }
-            
+
+
+def exit_code(status: int) -> int:
+    """returncode of a wait status as Popen reports it: the exit code, or -signal if killed"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    if os.WIFEXITED(status):
+        return os.WEXITSTATUS(status)
+    return status
+
+
+class ProcessReaper:
+    """
+    one thread that reaps all job processes and reports (pid, returncode, rusage) to on_exit,
+    it also runs the callbacks scheduled with call_later (kill escalation)
+    on Linux every child is watched through a pidfd registered in a selector,
+    otherwise a SIGCHLD handler (main thread only) or a poll_interval timeout wakes it up
+    and every watched pid is checked with os.wait4(WNOHANG)
+    adopted pids (jobs reattached after a restart) are not our children: there is no wait status
+    and no rusage, on_exit gets None and the caller reads the exit file
+    """
+    def __init__(self, on_exit, poll_interval: float):
+        self.on_exit = on_exit
+        self.poll_interval = poll_interval
+        self.pids = set()
+        self.adopted = set()
+        self.pending = []
+        self.timers = []  # [(deadline, seq, callback)]
+        self._timer_seq = itertools.count()
+        self._lock = threading.Lock()
+
+        self.selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ)
+
+        self.use_pidfd = hasattr(os, "pidfd_open")
+        self.use_sigchld = False
+        if not self.use_pidfd:
+            self._install_sigchld()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _install_sigchld(self):
+        try:
+            signal.signal(signal.SIGCHLD, lambda signum, frame: self.wakeup())
+            self.use_sigchld = True
+        except (ValueError, AttributeError):
+            # not in the main thread / no SIGCHLD on this platform, poll_interval only
+            self.use_sigchld = False
+
+    def wakeup(self):
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            pass
+
+    def watch(self, pid: int, adopted: bool = False):
+        with self._lock:
+            self.pending.append((pid, adopted))
+        self.wakeup()
+
+    def call_later(self, delay: float, callback):
+        with self._lock:
+            heapq.heappush(self.timers, (time.monotonic() + delay, next(self._timer_seq), callback))
+        self.wakeup()
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self.timers or self.timers[0][0] > now:
+                    return
+                _, _, callback = heapq.heappop(self.timers)
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"ProcessReaper: timer callback failed: {e}")
+
+    def _timeout(self):
+        timeout = None if self.use_pidfd else self.poll_interval
+        with self._lock:
+            if self.timers:
+                delay = max(self.timers[0][0] - time.monotonic(), 0)
+                timeout = delay if timeout is None else min(timeout, delay)
+        return timeout
+
+    def _register(self, pid: int, adopted: bool):
+        self.pids.add(pid)
+        if adopted:
+            self.adopted.add(pid)
+        if not self.use_pidfd:
+            return
+        try:
+            pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            # an adopted job that is already gone
+            self._reap(pid, exited=True)
+            return
+        except OSError as e:
+            # kernel without pidfd support (< 5.3), switch every pid to the fallback
+            logger.warning(f"ProcessReaper: pidfd_open failed ({e}), falling back to SIGCHLD / polling")
+            self.use_pidfd = False
+            self._install_sigchld()
+            return
+        self.selector.register(pidfd, selectors.EVENT_READ, pid)
+
+    def _alive(self, pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _reap(self, pid: int, exited: bool = False) -> bool:
+        """exited: the pidfd says the process is gone"""
+        returncode, rusage = None, None
+        if pid in self.adopted:
+            if not exited and self._alive(pid):
+                return False
+            self.adopted.discard(pid)
+        else:
+            try:
+                wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+            except ChildProcessError:
+                # reaped by someone else, the wait status is lost
+                wpid, status = pid, None
+            if wpid == 0:
+                return False
+            returncode = None if status is None else exit_code(status)
+        self.pids.discard(pid)
+        try:
+            self.on_exit(pid, returncode, rusage)
+        except Exception as e:
+            logger.error(f"ProcessReaper: on_exit of pid {pid} failed: {e}")
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                self._poll()
+            except Exception as e:
+                # the only reaper thread, log and keep going
+                logger.error(f"ProcessReaper: reaping failed: {e}")
+                time.sleep(self.poll_interval)
+
+    def _poll(self):
+        for key, _ in self.selector.select(self._timeout()):
+            if key.data is None:
+                try:
+                    while os.read(self._wakeup_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                continue
+            self.selector.unregister(key.fd)
+            os.close(key.fd)
+            self._reap(key.data, exited=True)
+        with self._lock:
+            pending, self.pending = self.pending, []
+        for pid, adopted in pending:
+            try:
+                self._register(pid, adopted)
+            except Exception as e:
+                logger.error(f"ProcessReaper: failed to watch pid {pid}: {e}")
+        if not self.use_pidfd:
+            for pid in list(self.pids):
+                try:
+                    self._reap(pid)
+                except Exception as e:
+                    logger.error(f"ProcessReaper: failed to reap pid {pid}: {e}")
+        self._run_timers()
+
+
 class ProcessManager:
-    def __init__(self, on_process_changed=None):
+    def __init__(self, on_process_changed=None, on_process_record=None):
         self._lock = threading.Lock()
         self.process_id_gen = self.id_generator()
         self.on_process_changed = on_process_changed
+        self.on_process_record = on_process_record  # gets the Process object on every status change, to persist the run
         
-        self.max_processes = config.DEFAULT_MAX_PROCESSES
         self.processes = []
+        self.pid_processes = {}
+        self.reaper = ProcessReaper(self.on_process_exit, config.DEFAULT_REAP_INTERVAL)
+        self.kill_grace_period = config.DEFAULT_KILL_GRACE_PERIOD
+        self.sampler = ResourceSampler(self.get_running_processes, config.DEFAULT_SAMPLE_INTERVAL)
+        self.output = OutputPipeline(config.DEFAULT_OUTPUT_POLL_INTERVAL, config.DEFAULT_OUTPUT_ROTATE_SIZE,
+                                     config.DEFAULT_OUTPUT_MAX_SEGMENTS, config.DEFAULT_OUTPUT_RING_LINES)
         
     def synchronized(func):
         def wrapper(self, *args, **kwargs):
@@ -134,74 +362,130 @@ class ProcessManager:
             yield current_id
             current_id += 1
             
-    def set_max_processes(self, max_processes: int):
-        self.max_processes = max_processes
-        
-    def get_max_processes(self):
-        return self.max_processes
-        
-    def have_space(self) -> bool:
-        return len(self.processes) < self.max_processes
+    def get_process_num_by_gpu(self):
+        process_num = {}
+        for process in self.processes:
+            for gpu_id in process.gpu_ids:
+                process_num[gpu_id] = process_num.get(gpu_id, 0) + 1
+        return process_num
+            
+    @synchronized
+    def adopt_process(self, run: dict):
+        """reattach to a job started before a restart, run: its record from the runs table"""
+        try:
+            process = Process(run["run_id"], run["cmd"], run["task_id"], run["gpu_ids"], None, self.on_process_state, run)
+            self.processes.append(process)
+            self.pid_processes[process.pid] = process
+            self.output.watch(process.process_id, process.get_output_paths())
+            self.reaper.watch(process.pid, adopted=True)
+            return process
+        except Exception as e:
+            logger.error(f"ProcessManager adopt_process: Failed to reattach run {run['run_id']}: {e}")
+            return None
+            
+    def get_running_processes(self):
+        return [p for p in self.processes if p.get_status() == ProcessStatus.RUNNING]
             
     def on_process_state(self, process):
-        # logger.info(f"ProcessManager on_process_state: Process {process.process_id} status: '{process.shared_dict['status']}'")
-        if process.shared_dict['status'] in [ProcessStatus.COMPLETED, ProcessStatus.FAILED, ProcessStatus.KILLED]: 
+        # logger.info(f"ProcessManager on_process_state: Process {process.process_id} status: '{process.get_status()}'")
+        if self.on_process_record:
+            try:
+                self.on_process_record(process)
+            except Exception as e:
+                logger.error(f"ProcessManager on_process_record: failed: {e}")
+        if process.get_status() in [ProcessStatus.COMPLETED, ProcessStatus.FAILED, ProcessStatus.KILLED]:
             self.remove_process(process)
         if self.on_process_changed:
             self.on_process_changed(process.task_id, process.process_id, process.gpu_id, process.pid, process.get_status())
         
+    def on_process_exit(self, pid, returncode, rusage):
+        process = self.pid_processes.pop(pid, None)
+        if process is None:
+            logger.warning(f"ProcessManager on_process_exit: unknown pid {pid}")
+            return
+        self.output.unwatch(process.process_id)
+        process.on_exit(returncode, rusage)
+        
     @synchronized
     def remove_process(self, process):
-        self.processes.remove(process)
+        if process in self.processes:
+            self.processes.remove(process)
         
     @synchronized
-    def add_process(self, cmd: str, task_id: int, gpu_id: int, working_dir: str = None):
+    def add_process(self, cmd: str, task_id: int, gpu_id, working_dir: str = None, process_id: int = None):
+        """process_id: the run id from the runs table, so ids and log files stay unique across restarts"""
         try:
-            if not self.have_space():
-                logger.warning(f"ProcessManager: Process number exceeds the maximum limit {self.max_processes}")
-                return None
-            process = Process(next(self.process_id_gen), cmd, task_id, gpu_id, working_dir, self.on_process_state)
+            if process_id is None:
+                process_id = next(self.process_id_gen)
+            process = Process(process_id, cmd, task_id, gpu_id, working_dir, self.on_process_state)
             self.processes.append(process)
+            self.pid_processes[process.pid] = process
+            self.output.watch(process.process_id, process.get_output_paths())
+            self.reaper.watch(process.pid)
             return process
         except Exception as e:
             logger.error(f"ProcessManager add_process: Failed to add process: {e}")
             return None
             
-    def kill_process_by_gpu(self, gpu_id: int):
-        processes_to_kill = [p for p in self.processes if p.gpu_id == gpu_id]
-        num = len(processes_to_kill)
-        logger.info(f"ProcessManager: Found {num} processes on GPU {gpu_id} to terminate")
+    def set_kill_grace_period(self, grace_period: float):
+        self.kill_grace_period = grace_period
+        
+    def get_kill_grace_period(self):
+        return self.kill_grace_period
+        
+    def _kill(self, process, grace_period: float = None):
+        """SIGTERM now, SIGKILL after grace_period unless the job exits first, never blocks"""
+        grace_period = self.kill_grace_period if grace_period is None else grace_period
+        if not process.kill():
+            return False
+        if grace_period <= 0:
+            process.force_kill()
+        else:
+            self.reaper.call_later(grace_period, process.force_kill)
+        return True
+        
+    def _kill_processes(self, processes_to_kill, grace_period: float = None):
+        num = 0
         for process in processes_to_kill:
             logger.info(f"ProcessManager: Terminate process {process.process_id} : {process.gpu_id}")
-            process.kill()
+            if self._kill(process, grace_period):
+                num += 1
         return num
         
-    def kill_process_by_id(self, process_id: int):
+    def kill_process_by_gpu(self, gpu_id: int, grace_period: float = None):
+        processes_to_kill = [p for p in self.processes if gpu_id in p.gpu_ids]
+        logger.info(f"ProcessManager: Found {len(processes_to_kill)} processes on GPU {gpu_id} to terminate")
+        return self._kill_processes(processes_to_kill, grace_period)
+        
+    def kill_process_by_task(self, task_id: int, grace_period: float = None):
+        processes_to_kill = [p for p in self.processes if p.task_id == task_id]
+        logger.info(f"ProcessManager: Found {len(processes_to_kill)} processes of task {task_id} to terminate")
+        return self._kill_processes(processes_to_kill, grace_period)
+        
+    def kill_process_by_id(self, process_id: int, grace_period: float = None):
         target_process = None
         for process in self.processes:
             if process.process_id == process_id:
                 target_process = process
                 break
         if target_process:
-            success = target_process.kill()
+            success = self._kill(target_process, grace_period)
             logger.info(f"ProcessManager kill_process_by_id: Terminate process ID {process_id} {'success' if success else 'failed'}")
             return success
         else:
             logger.warning(f"ProcessManager kill_process_by_id: Process ID {process_id} not found")
             return False
             
-    def kill_all_processes(self):
+    def kill_all_processes(self, grace_period: float = None):
         processes_to_kill = list(self.processes)
         logger.info(f"ProcessManager: Terminate all processes, {len(processes_to_kill)} processes")
-        for process in processes_to_kill:
-            process.kill()
-        return len(processes_to_kill)
+        return self._kill_processes(processes_to_kill, grace_period)
 
     def get_process_dict(self):
         return {p.process_id: p.get_dict() for p in self.processes}
     
     def get_process_dict_by_gpu(self, gpu_id: int):
-        return {p.process_id: p.get_dict() for p in self.processes if p.gpu_id == gpu_id}
+        return {p.process_id: p.get_dict() for p in self.processes if gpu_id in p.gpu_ids}
 
 if __name__ == "__main__":
     def on_completed(task_id, process_id, gpu_id, pid, status):
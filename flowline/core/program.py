@@ -5,25 +5,36 @@ import signal
 import sys
 import os
 
+import psutil
+
 from .gpu import GPU_Manager
 from .process import ProcessManager, ProcessStatus
 from .task import TaskManager
+from .output import read_output, tail_lines
+from .sweep import expand_sweep, sweep_task_num
 from flowline.config import config
-from flowline.utils import Log
+from flowline.utils import Log, read_exit_status
 
 logger = Log(__name__)
 
 class ProgramManager:
     def __init__(self, user_func, task_db_path="tasks.db"):
         self._lock = threading.Lock()
+        self._wakeup_event = threading.Event()
         self.gpu_manager = GPU_Manager([0], self.on_gpu_flash)
-        self.process_manager = ProcessManager(self.on_process_changed)
+        self.process_manager = ProcessManager(self.on_process_changed, self.on_process_record)
+        self.process_manager.sampler.get_gpu_memory = self.gpu_manager.get_process_memory
         self.task_manager = TaskManager(task_db_path)
         
         self.if_run = False
         self._main_thread = None 
         self.func = user_func
         self.loop_sleep_time = config.DEFAULT_LOOP_SLEEP_TIME
+        self.batch_dispatch = config.DEFAULT_BATCH_DISPATCH
+        self.backfill_window = config.DEFAULT_BACKFILL_WINDOW
+        self.blocked_task_id = None
+        
+        self._reattach_runs()
         
     ##################### lock #####################
         
@@ -37,48 +48,236 @@ class ProgramManager:
     
     def on_process_changed(self, task_id, process_id, gpu_id, pid, status):
         # logger.info(f"ProgramManager: process {process_id} status changed: {status}")
-        self.gpu_manager.update_user_process_num(gpu_id, pid, status)
+        self.gpu_manager.update_user_process(process_id, pid, status)
+        if status == ProcessStatus.RUNNING:
+            self.gpu_manager.on_process_start(process_id, pid)
+        if status in [ProcessStatus.COMPLETED, ProcessStatus.FAILED, ProcessStatus.KILLED]:
+            self.gpu_manager.release_memory(process_id, pid)
         if status == ProcessStatus.COMPLETED:
-            self.task_manager.update_task_ids(task_id)
-        elif status in [ProcessStatus.FAILED, ProcessStatus.KILLED]:
+            self.task_manager.update_task_ids([task_id])
+            self.wakeup()
+        elif status == ProcessStatus.FAILED:
+            # the task is retried after a backoff, the wakeup lets other tasks use the freed slot
+            self.task_manager.put_task_ids(task_id, failed=True)
+            self.wakeup()
+        elif status == ProcessStatus.KILLED:
             self.task_manager.put_task_ids(task_id)
-        elif status == ProcessStatus.RUNNING:
+            self.wakeup()
+        elif status in [ProcessStatus.RUNNING, ProcessStatus.KILLING]:
             pass
         else:
             logger.warning(f"Unknown process status: {status}")
             
+    def on_process_record(self, process):
+        """
+        persist the run, its process_id is the run_id: pid and log paths when it starts, KILLING while
+        it is being killed, status and resource usage when it ends
+        """
+        status = process.get_status()
+        if status == ProcessStatus.RUNNING:
+            process_dict = process.get_dict()
+            try:
+                pid_create_time = psutil.Process(process.pid).create_time()
+            except psutil.Error:
+                pid_create_time = None
+            self.task_manager.update_run(process.process_id, status=status, pid=process.pid, pid_create_time=pid_create_time,
+                                         stdout_path=process_dict["stdout_path"], stderr_path=process_dict["stderr_path"],
+                                         exit_path=process_dict["exit_path"])
+        elif status == ProcessStatus.KILLING:
+            # a restarted FlowLine finishes the kill of a job still in its grace period
+            self.task_manager.update_run(process.process_id, status=status)
+        elif status in [ProcessStatus.COMPLETED, ProcessStatus.FAILED, ProcessStatus.KILLED]:
+            self.task_manager.finish_run(process.process_id, status, process.returncode, process.usage.to_dict())
+            
+    def _reattach_runs(self):
+        """
+        pick up the runs an earlier FlowLine left unfinished: jobs run detached, so live ones are
+        reattached and keep their GPUs, finished ones get their exit code from the exit file
+        """
+        runs = self.task_manager.get_unfinished_runs([ProcessStatus.PENDING, ProcessStatus.RUNNING, ProcessStatus.KILLING])
+        for run in runs:
+            run_id, task_id = run["run_id"], run["task_id"]
+            task = self.task_manager.get_task_by_id(task_id)
+            if task is not None:
+                self.task_manager.remember_task(task)
+            if self._is_alive(run["pid"], run["pid_create_time"]):
+                self.task_manager.reclaim_task(task_id)
+                self.gpu_manager.reserve_memory(run_id, run["gpu_ids"], task.need_memory if task else None)
+                process = self.process_manager.adopt_process(run)
+                if process is None:
+                    self.gpu_manager.release_memory(run_id)
+                    continue
+                if run["status"] == ProcessStatus.KILLING:
+                    # the SIGKILL timer of the kill died with the earlier FlowLine: SIGTERM again and
+                    # start a fresh grace period, so the job is still escalated if it ignores SIGTERM
+                    logger.info(f"run {run_id} was being killed before the restart, resume the kill")
+                    self.process_manager.kill_process_by_id(run_id)
+                continue
+            returncode = read_exit_status(run["exit_path"])
+            if run["status"] == ProcessStatus.KILLING:
+                status = ProcessStatus.KILLED
+            elif returncode == 0:
+                status = ProcessStatus.COMPLETED
+            else:
+                status = ProcessStatus.FAILED
+            self.task_manager.finish_run(run_id, status, returncode, {})
+            if status != ProcessStatus.COMPLETED and task is not None:
+                # finish_run made the run pending again, it will be run again
+                self.task_manager.requeue_task(task_id)
+            logger.info(f"run {run_id} of task {task_id} finished while FlowLine was down: {status} (return code {returncode})")
+        if runs:
+            logger.info(f"reattached {len(self.process_manager.processes)} of {len(runs)} unfinished runs")
+            
+    @staticmethod
+    def _is_alive(pid, create_time):
+        """the job is still running, and pid was not reused by another process"""
+        if pid is None or create_time is None:
+            return False
+        try:
+            process = psutil.Process(pid)
+            return abs(process.create_time() - create_time) < 1 and process.status() != psutil.STATUS_ZOMBIE
+        except psutil.Error:
+            return False
+        
     def on_gpu_flash(self, gpu_id, info):
         # logger.info(f"ProgramManager: GPU {gpu_id} status changed: {info}")
-        pass
+        self.wakeup()
             
     ##################### main loop #####################
             
     @synchronized
     def new_process(self):
-        """create new process to handle task"""
-        if not self.process_manager.have_space():
-            logger.info(f"over max processes")
-            return
-        gpu_id = self.gpu_manager.choose_gpu()
-        if gpu_id is None:
-            logger.info(f"no available GPU")
+        """
+        create new processes to handle tasks, fill every free slot in one pass in batch dispatch mode
+        
+        backfill: when the task at the head of the queue doesn't fit, its GPUs are held for it
+        and later tasks within backfill_window that fit on the other GPUs start now,
+        so they never delay the head
+        """
+        process_num = self.process_manager.get_process_num_by_gpu()
+        num = self.gpu_manager.get_free_slot_num(process_num)
+        if not self.batch_dispatch:
+            num = min(num, 1)
+        if num == 0:
+            logger.info(f"no free process slot")
             return
-        task = self.task_manager.get_next_task()
-        if task is None:
+        candidates = self.task_manager.peek_tasks(max(num, self.backfill_window))
+        if not candidates or candidates[0].task_id != self.blocked_task_id:
+            self._release_blocked_task()
+        if not candidates:
             logger.info("no task to handle")
             return
-        task_id = task.id
-        cmd = self.func(task.to_dict(), gpu_id)
-        process = self.process_manager.add_process(cmd, task_id, gpu_id, task.working_dir)
+        
+        # place in queue order on one view of the GPUs, so the head is placed first and only runs
+        # that will start take capacity
+        gpus = self.gpu_manager.get_gpu_slots(process_num)
+        chosen = []
+        skipped = False
+        for task in candidates:
+            if len(chosen) >= num:
+                break
+            # the held GPUs are kept for the blocked task only
+            exclude_gpu_ids = [] if task.task_id == self.blocked_task_id else self.gpu_manager.get_held_gpu_ids()
+            gpu_ids = self.gpu_manager.place_task(gpus, task.need_memory, task.need_gpu_num, exclude_gpu_ids)
+            if gpu_ids is None:
+                if task.task_id == self.blocked_task_id:
+                    if self.gpu_manager.hold_gpus(task.need_memory, task.need_gpu_num) is None:
+                        self._release_blocked_task()
+                elif not skipped and self.blocked_task_id is None and self.gpu_manager.hold_gpus(task.need_memory, task.need_gpu_num):
+                    self.blocked_task_id = task.task_id
+                    logger.info(f"task {task.task_id} doesn't fit, hold GPU {self.gpu_manager.get_held_gpu_ids()} for it")
+                skipped = True
+                continue
+            if task.task_id == self.blocked_task_id:
+                self._release_blocked_task()
+            chosen.append((task, gpu_ids, skipped))
+        if not chosen:
+            return
+        # claim all chosen runs in one round-trip
+        claimed = self.task_manager.claim_tasks([(task.task_id, backfill) for task, _, backfill in chosen])
+        chosen = [run for run, ok in zip(chosen, claimed) if ok]
+        for i, (task, gpu_ids, backfill) in enumerate(chosen):
+            try:
+                self.start_process(task, gpu_ids, backfill, claimed=True)
+            except Exception as e:
+                # give back the claims of the runs of this batch that were not started
+                logger.error(f"failed to start task {task.task_id}: {e}, unclaim {len(chosen) - i - 1} runs not started yet")
+                for task, _, _ in chosen[i + 1:]:
+                    self.task_manager.put_task_ids(task.task_id, unclaim=True)
+                raise
+                
+    def _release_blocked_task(self):
+        if self.blocked_task_id is not None:
+            logger.info(f"task {self.blocked_task_id} is no longer blocked, release held GPUs")
+        self.blocked_task_id = None
+        self.gpu_manager.release_held_gpus()
+            
+    def start_process(self, task, gpu_ids, backfill=False, claimed=False):
+        """claim one run of task (unless already claimed) and start it on gpu_ids, put it back to queue if failed
+        
+        the user func gets a single gpu_id, or the list of gpu_ids for multi-GPU tasks
+        """
+        task_id = task.task_id
+        if not claimed and not self.task_manager.claim_task(task_id, backfill):
+            return False
+        config_dict, point = task.dict, None
+        if task.is_sweep:
+            # a sweep task runs one point per run, the user func gets the config of the point
+            assigned = self.task_manager.next_point(task_id)
+            if assigned is None:
+                self.task_manager.put_task_ids(task_id, unclaim=True)
+                return False
+            point, config_dict = assigned
+        try:
+            cmd = self.func(config_dict, gpu_ids if task.need_gpu_num > 1 else gpu_ids[0])
+        except Exception as e:
+            logger.error(f"user func failed for task {task_id}: {e}")
+            if point is not None:
+                self.task_manager.release_point(task_id, point)
+            self.task_manager.put_task_ids(task_id, unclaim=True, failed=True)
+            return False
+        run_id = self.task_manager.start_run(task_id, gpu_ids, cmd, ProcessStatus.PENDING, point)
+        if run_id is None:
+            if point is not None:
+                self.task_manager.release_point(task_id, point)
+            self.task_manager.put_task_ids(task_id, unclaim=True)
+            return False
+        # reserved before the launch: the job may exit, and release it, before add_process returns
+        self.gpu_manager.reserve_memory(run_id, gpu_ids, task.need_memory)
+        try:
+            process = self.process_manager.add_process(cmd, task_id, gpu_ids, task.working_dir, run_id)
+        except Exception as e:
+            logger.error(f"add_process failed for task {task_id}: {e}")
+            process = None
         if process is None:
-            self.task_manager.put_task_ids(task_id)
+            self.gpu_manager.release_memory(run_id)
+            self.task_manager.finish_run(run_id, ProcessStatus.FAILED, None, {})
+            self.task_manager.put_task_ids(task_id, failed=True)
             logger.info(f"failed to create process, task {task_id} put back to queue")
+            return False
+        return True
+        
+    def wakeup(self):
+        """wake the main loop up to run a scheduling pass right away"""
+        self._wakeup_event.set()
         
     def run_loop(self):
-        """main loop, check and create new task"""
+        """main loop, check and create new task
+        
+        a scheduling pass runs whenever something may have freed or added work
+        (process exit, new task, GPU enabled, GPU telemetry refreshed), the
+        loop_sleep_time tick is only a fallback
+        """
         while self.if_run:
-            self.new_process()
-            time.sleep(self.loop_sleep_time)
+            self._wakeup_event.clear()
+            try:
+                self.new_process()
+            except Exception as e:
+                # keep the only dispatch thread alive, the next pass retries
+                logger.error(f"scheduling pass failed: {e}")
+            # also wake up when the backoff of a failed task ends
+            retry_wait = self.task_manager.get_retry_wait()
+            self._wakeup_event.wait(self.loop_sleep_time if retry_wait is None else min(self.loop_sleep_time, retry_wait))
         logger.info("main loop stopped")
         
     ##################### operation #####################
@@ -99,39 +298,75 @@ class ProgramManager:
         self.if_run = not self.if_run
         if self.if_run:
             self.start_process_loop()
+        else:
+            self.wakeup()
         logger.info(f"main loop {'started' if self.if_run else 'stopped'}")
         return self.if_run
         
     def switch_gpu(self, gpu_id):
         """switch GPU available status"""
         if_success, is_on = self.gpu_manager.switch_gpu(gpu_id)
+        if if_success and is_on:
+            self.wakeup()
         return if_success, is_on
         
-    @synchronized
-    def kill_process_by_gpu(self, gpu_id):
-        """kill all processes on specified GPU"""
-        num = self.process_manager.kill_process_by_gpu(gpu_id)
+    def kill_process_by_gpu(self, gpu_id, grace_period=None):
+        """kill all processes on specified GPU, returns at once, they stay KILLING until they exit"""
+        num = self.process_manager.kill_process_by_gpu(gpu_id, grace_period)
         return num
         
-    @synchronized
-    def kill_process(self, process_id):
+    def kill_process_by_task(self, task_id, grace_period=None):
+        """kill all processes of specified task"""
+        return self.process_manager.kill_process_by_task(task_id, grace_period)
+        
+    def kill_process(self, process_id, grace_period=None):
         """kill process by specified ID"""
-        return self.process_manager.kill_process_by_id(process_id)
+        return self.process_manager.kill_process_by_id(process_id, grace_period)
+        
+    def set_kill_grace_period(self, grace_period: float):
+        self.process_manager.set_kill_grace_period(grace_period)
+        
+    def get_kill_grace_period(self):
+        return self.process_manager.get_kill_grace_period()
     
     def set_max_processes(self, max_processes: int):
-        self.process_manager.set_max_processes(max_processes)
+        """set the max processes per GPU"""
+        self.gpu_manager.set_max_processes_per_gpu(max_processes)
+        self.wakeup()
         
     def get_max_processes(self):
-        return self.process_manager.get_max_processes()
+        return self.gpu_manager.get_max_processes_per_gpu()
+    
+    def set_placement_policy(self, placement_policy: str):
+        return self.gpu_manager.set_placement_policy(placement_policy)
+    
+    def get_placement_policy(self):
+        return self.gpu_manager.get_placement_policy()
+    
+    def set_foreign_policy(self, foreign_policy: str):
+        if_success = self.gpu_manager.set_foreign_policy(foreign_policy)
+        self.wakeup()
+        return if_success
+    
+    def get_foreign_policy(self):
+        return self.gpu_manager.get_foreign_policy()
+        
+    def _add_gpu_memory(self, process_dict):
+        """current GPU memory of each process tree per GPU, {gpu_id: MB}"""
+        run_gpu_memory = self.gpu_manager.get_run_gpu_memory()
+        for process_id, process in process_dict.items():
+            process["gpu_memory"] = run_gpu_memory.get(process_id, {})
+        return process_dict
         
     def get_process_dict(self):
-        return self.process_manager.get_process_dict()
+        return self._add_gpu_memory(self.process_manager.get_process_dict())
     
     def get_process_dict_by_gpu(self, gpu_id: int):
-        return self.process_manager.get_process_dict_by_gpu(gpu_id)
+        return self._add_gpu_memory(self.process_manager.get_process_dict_by_gpu(gpu_id))
         
     def set_min_process_memory(self, min_process_memory):
         self.gpu_manager.set_min_process_memory(min_process_memory)
+        self.wakeup()
     
     def get_min_process_memory(self):
         return self.gpu_manager.get_min_process_memory()
@@ -139,18 +374,92 @@ class ProgramManager:
     def get_gpu_dict(self):
         return self.gpu_manager.get_gpu_dict()
     
-    def get_task_dict(self):
-        return self.task_manager.get_task_dict()
+    def get_gpu_history(self, gpu_id, metrics, start=None, end=None, step=None):
+        return self.gpu_manager.get_gpu_history(gpu_id, metrics, start, end, step)
+    
+    def get_task_dict(self, owner: str = None, status: str = None, before_id: int = None, limit: int = None):
+        return self.task_manager.get_task_dict(owner, status, before_id, limit)
+    
+    def get_queue_stats(self):
+        stats = self.task_manager.get_queue_stats()
+        stats["blocked_task_id"] = self.blocked_task_id
+        stats["held_gpu_ids"] = self.gpu_manager.get_held_gpu_ids()
+        return stats
 
-    def create_task(self, name: str, cmd: str, need_run_num: int = 1, config_dict: dict = None, working_dir: str = None):
-        return self.task_manager.create_task(name, cmd, need_run_num, config_dict, working_dir)
+    def create_task(self, name: str, cmd: str, need_run_num: int = 1, config_dict: dict = None, working_dir: str = None,
+                    need_memory: int = None, need_gpu_num: int = 1, priority: int = 0, owner: str = None):
+        task_id = self.task_manager.create_task(name, cmd, need_run_num, config_dict, working_dir, need_memory, need_gpu_num,
+                                                priority, owner)
+        if task_id is not None:
+            self.wakeup()
+        return task_id
+    
+    def create_tasks(self, tasks: list = None, sweeps: list = None, idempotency_key: str = None):
+        """
+        create tasks and the points of parameter sweeps in one transaction, return (task_ids, created)
+        created is False when idempotency_key was already used, task_ids are those of the first request then
+        """
+        tasks = list(tasks or [])
+        sweeps = sweeps or []
+        # sized before expanding, so an oversized grid is rejected without building its points
+        task_num = len(tasks) + sum(sweep_task_num(sweep) for sweep in sweeps)
+        if task_num > config.DEFAULT_BULK_MAX_TASKS:
+            raise ValueError(f"{task_num} tasks exceed the bulk limit of {config.DEFAULT_BULK_MAX_TASKS}")
+        for sweep in sweeps:
+            tasks.extend(expand_sweep(sweep))
+        task_ids, created = self.task_manager.create_tasks(tasks, idempotency_key)
+        if created and task_ids:
+            self.wakeup()
+        return task_ids, created
     
     def copy_task(self, task_id: int, new_name: str = None, new_need_run_num: int = None):
-        return self.task_manager.copy_task(task_id, new_name, new_need_run_num)
+        new_task_id = self.task_manager.copy_task(task_id, new_name, new_need_run_num)
+        if new_task_id is not None:
+            self.wakeup()
+        return new_task_id
+    
+    def set_task_priority(self, task_id: int, priority: int):
+        if_success = self.task_manager.set_task_priority(task_id, priority)
+        if if_success:
+            self.wakeup()
+        return if_success
+    
+    def set_owner_weight(self, owner: str, weight: float):
+        self.task_manager.set_owner_weight(owner, weight)
+        self.wakeup()
     
     def get_task_detail(self, task_id: int):
         task = self.task_manager.get_task_by_id(task_id)
-        return task.get_dict() if task else None
+        if task is None:
+            return None
+        task_dict = task.get_dict()
+        task_dict["runs"] = self.task_manager.get_runs(task_id)
+        return task_dict
+    
+    def get_run(self, run_id: int):
+        return self.task_manager.get_run(run_id)
+    
+    def get_run_output(self, run_id: int, stream: str = "stdout", offset: int = 0, limit: int = 65536):
+        """read the output of a run from offset, follow it by passing back next_offset"""
+        run = self.task_manager.get_run(run_id)
+        if run is None or stream not in ["stdout", "stderr"] or run[f"{stream}_path"] is None:
+            return None
+        output = read_output(run[f"{stream}_path"], offset, limit)
+        output["status"] = run["status"]
+        return output
+    
+    def get_run_output_tail(self, run_id: int, stream: str = "stdout", num: int = 100):
+        """last num lines of a run, from memory while it is running"""
+        lines = self.process_manager.output.tail(run_id, stream, num)
+        if lines is not None:
+            return lines
+        run = self.task_manager.get_run(run_id)
+        if run is None or stream not in ["stdout", "stderr"] or run[f"{stream}_path"] is None:
+            return None
+        return tail_lines(run[f"{stream}_path"], num)
+    
+    def get_runs(self, task_id: int = None, status: str = None, since=None, until=None, before_id: int = None, limit: int = 100):
+        return self.task_manager.get_runs(task_id, status, since, until, before_id, limit)
     
     def delete_task(self, task_id: int):
         return self.task_manager.delete_task(task_id)
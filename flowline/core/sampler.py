@@ -0,0 +1,106 @@
+import threading
+import time
+
+import psutil
+
+from flowline.utils import Log
+
+logger = Log(__name__)
+
+
+class RunUsage:
+    """resources used by the process tree of one job, filled in by ResourceSampler"""
+    def __init__(self):
+        self.sample_num = 0
+        self.peak_cpu_percent = 0.0
+        self.peak_rss = 0.0  # MB, summed over the process tree
+        self.peak_gpu_memory = 0.0  # MB, summed over the process tree and GPUs
+        self.cpu_times = {}  # {pid: user + system (s)}, the last value is kept after the pid exits
+        self.io_bytes = {}  # {pid: (read bytes, write bytes)}
+        self.procs = {}  # {pid: psutil.Process}, kept so cpu_percent measures between two passes
+        self.exit_cpu_time = 0.0
+        self.exit_maxrss = 0.0
+
+    def sample(self, pid: int, gpu_memory: dict):
+        """one pass over the process tree rooted at pid, gpu_memory: {pid: used GPU memory (MB)}"""
+        try:
+            root = self.procs.get(pid) or psutil.Process(pid)
+            tree = [root] + root.children(recursive=True)
+        except psutil.Error:
+            return
+        procs = {}
+        cpu_percent, rss, used_gpu_memory = 0.0, 0.0, 0.0
+        for proc in tree:
+            cached = self.procs.get(proc.pid)
+            proc = cached if cached is not None and cached == proc else proc
+            try:
+                with proc.oneshot():
+                    cpu_percent += proc.cpu_percent(None)
+                    rss += proc.memory_info().rss / (1024 ** 2)
+                    cpu_times = proc.cpu_times()
+                    self.cpu_times[proc.pid] = cpu_times.user + cpu_times.system
+                    try:
+                        io = proc.io_counters()
+                        self.io_bytes[proc.pid] = (io.read_bytes, io.write_bytes)
+                    except (psutil.AccessDenied, AttributeError):
+                        pass
+            except psutil.Error:
+                continue
+            used_gpu_memory += gpu_memory.get(proc.pid, 0)
+            procs[proc.pid] = proc
+        self.procs = procs
+        self.sample_num += 1
+        self.peak_cpu_percent = max(self.peak_cpu_percent, cpu_percent)
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_gpu_memory = max(self.peak_gpu_memory, used_gpu_memory)
+
+    def on_exit(self, rusage):
+        """fold in the rusage of the reaped job, it covers everything the job waited for"""
+        self.procs = {}
+        if rusage is None:
+            return
+        self.exit_cpu_time = rusage.ru_utime + rusage.ru_stime
+        self.exit_maxrss = rusage.ru_maxrss / 1024
+
+    @property
+    def cpu_time(self) -> float:
+        return max(sum(self.cpu_times.values()), self.exit_cpu_time)
+
+    def to_dict(self) -> dict:
+        return {
+            "sample_num": self.sample_num,
+            "cpu_time": self.cpu_time,
+            "peak_cpu_percent": self.peak_cpu_percent,
+            "peak_rss": max(self.peak_rss, self.exit_maxrss),
+            "peak_gpu_memory": self.peak_gpu_memory,
+            "io_read_bytes": sum(read for read, _ in self.io_bytes.values()),
+            "io_write_bytes": sum(write for _, write in self.io_bytes.values()),
+        }
+
+
+class ResourceSampler:
+    """
+    one thread sampling every running job once per interval
+    get_processes: returns the running Process objects
+    get_gpu_memory: returns {pid: used GPU memory (MB)}, read from the GPU monitor instead of querying NVML again
+    """
+    def __init__(self, get_processes, interval: float, get_gpu_memory=None):
+        self.get_processes = get_processes
+        self.interval = interval
+        self.get_gpu_memory = get_gpu_memory
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def sample_once(self):
+        gpu_memory = self.get_gpu_memory() if self.get_gpu_memory else {}
+        for process in self.get_processes():
+            if process.pid is not None:
+                process.usage.sample(process.pid, gpu_memory)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample_once()
+            except Exception as e:
+                logger.error(f"ResourceSampler: sample failed: {e}")
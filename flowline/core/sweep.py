@@ -0,0 +1,163 @@
+import bisect
+import math
+import operator
+import random
+import string
+from functools import reduce
+
+"""
+parameter sweeps expanded on the server: a spec maps parameter names to lists of values and
+a mode combining them
+  product: the cartesian product of all lists, the last parameter varies fastest
+  zip:     the i-th value of every list, all lists have the same length
+  random:  num points sampled without replacement from the product, reproducible from seed
+points are addressed by index, so the i-th point is decoded without building the others
+"""
+
+SWEEP_MODES = ["product", "zip", "random"]
+# fields of a sweep spec that are not copied into the generated tasks
+SPEC_FIELDS = ["mode", "params", "num", "seed", "base"]
+
+
+class SweepSpec:
+    def __init__(self, params: dict, mode: str = "product", num: int = None, seed: int = 0, base: dict = None):
+        if mode not in SWEEP_MODES:
+            raise ValueError(f"invalid sweep mode {mode!r}, expected one of {SWEEP_MODES}")
+        if not isinstance(params, dict) or not params:
+            raise ValueError("sweep params must be a non-empty dict of {name: [values]}")
+        for name, values in params.items():
+            if not isinstance(values, list) or not values:
+                raise ValueError(f"sweep param {name!r} must be a non-empty list")
+        self.params = params
+        self.names = list(params)
+        self.mode = mode
+        self.base = base or {}
+        self.seed = seed
+        self.size = reduce(operator.mul, (len(values) for values in params.values()), 1)  # points of the full product
+        if mode == "zip":
+            lengths = {len(values) for values in params.values()}
+            if len(lengths) != 1:
+                raise ValueError(f"zip sweep params must have the same length, got {sorted(lengths)}")
+            self.size = lengths.pop()
+        self.sample = None
+        if mode == "random":
+            if num is None or not 0 < num <= self.size:
+                raise ValueError(f"random sweep needs 0 < num <= {self.size}")
+            self.sample = sorted(random.Random(seed).sample(range(self.size), num))
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> "SweepSpec":
+        return cls(spec.get("params"), spec.get("mode", "product"), spec.get("num"), spec.get("seed", 0), spec.get("base"))
+
+    def __len__(self) -> int:
+        return len(self.sample) if self.sample is not None else self.size
+
+    def __getitem__(self, i: int) -> dict:
+        """config dict of the i-th point: base updated with the values of the point"""
+        if not 0 <= i < len(self):
+            raise IndexError(f"sweep point {i} out of range")
+        point = dict(self.base)
+        if self.mode == "zip":
+            point.update((name, self.params[name][i]) for name in self.names)
+            return point
+        index = self.sample[i] if self.sample is not None else i
+        values = []
+        for name in reversed(self.names):
+            index, j = divmod(index, len(self.params[name]))
+            values.append(self.params[name][j])
+        point.update(zip(self.names, reversed(values)))
+        return point
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class PointRanges:
+    """
+    set of point indexes kept as sorted disjoint [start, end) ranges, points of a sweep mostly finish
+    in dispatch order so a million points usually take a handful of ranges
+    """
+    def __init__(self, ranges: list = None):
+        self.ranges = [list(r) for r in ranges or []]
+
+    def add(self, i: int):
+        k = bisect.bisect_right(self.ranges, [i, math.inf])  # ranges[k - 1] starts at or before i
+        if k and self.ranges[k - 1][1] > i:
+            return
+        if k and self.ranges[k - 1][1] == i:
+            self.ranges[k - 1][1] = i + 1
+            if k < len(self.ranges) and self.ranges[k][0] == i + 1:
+                self.ranges[k - 1][1] = self.ranges.pop(k)[1]
+        elif k < len(self.ranges) and self.ranges[k][0] == i + 1:
+            self.ranges[k][0] = i
+        else:
+            self.ranges.insert(k, [i, i + 1])
+
+    def pop(self):
+        """remove and return the smallest point, None if empty"""
+        if not self.ranges:
+            return None
+        first = self.ranges[0]
+        i = first[0]
+        first[0] += 1
+        if first[0] == first[1]:
+            self.ranges.pop(0)
+        return i
+
+    def __contains__(self, i: int) -> bool:
+        k = bisect.bisect_right(self.ranges, [i, math.inf])
+        return bool(k) and self.ranges[k - 1][1] > i
+
+    def __len__(self) -> int:
+        return sum(end - start for start, end in self.ranges)
+
+    def to_list(self) -> list:
+        return [list(r) for r in self.ranges]
+
+
+def format_name(name: str, point: dict, i: int) -> str:
+    """name of the task of one point: name may use {param} (and {index}) fields, else the index is appended"""
+    fields = [field for _, field, _, _ in string.Formatter().parse(name) if field]
+    if not fields:
+        return f"{name}-{i}"
+    try:
+        return name.format(index=i, **point)
+    except (KeyError, IndexError, ValueError):
+        return f"{name}-{i}"
+
+
+def sweep_task_num(sweep: dict) -> int:
+    """number of tasks expand_sweep creates for a sweep, without building its points"""
+    if sweep.get("lazy"):
+        return 1
+    if sweep.get("mode") == "random" and isinstance(sweep.get("num"), int):
+        return sweep["num"]  # checked against the product when the sweep is expanded
+    return len(SweepSpec.from_dict(sweep))
+
+
+def expand_sweep(sweep: dict) -> list:
+    """
+    tasks of a sweep: sweep holds the spec fields and the task fields shared by every point
+    (name, cmd, need_run_num, ...), each task gets the config of one point as its config_dict
+
+    a lazy sweep becomes a single sweep task whose config_dict is the spec, the config of each
+    point is generated when one of its runs is dispatched
+    """
+    spec = SweepSpec.from_dict(sweep)
+    template = {key: value for key, value in sweep.items() if key not in SPEC_FIELDS + ["lazy"]}
+    if sweep.get("lazy"):
+        if template.get("need_run_num", 1) != 1:
+            raise ValueError("every point of a lazy sweep runs once, sweep over a seed parameter to repeat points")
+        template.setdefault("name", "sweep")
+        template["task_type"] = "sweep"
+        template["need_run_num"] = len(spec)
+        template["config_dict"] = {key: sweep[key] for key in SPEC_FIELDS if key in sweep}
+        return [template]
+    name = template.pop("name", "sweep")
+    tasks = []
+    for i, point in enumerate(spec):
+        task = dict(template)
+        task["name"] = format_name(name, point, i)
+        task["config_dict"] = point
+        tasks.append(task)
+    return tasks
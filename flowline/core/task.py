@@ -1,60 +1,207 @@
 import threading
-import queue
 import json
 import os
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+import time
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple
 
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON
+from sqlalchemy import create_engine, event, inspect, text, select, insert, update, case, Column, Integer, BigInteger, Float, String, Text, DateTime, JSON, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import sessionmaker, Session
 
+from flowline.config import config
 from flowline.utils import Log
+from .task_queue import TaskQueue, FairShare, QueueStats
+from .sweep import SweepSpec, PointRanges
 
 logger = Log(__name__)
 
 Base = declarative_base()
 
 
+DEFAULT_OWNER = "default"
+
+
+def create_db_engine(db_path: str):
+    """
+    创建任务数据库引擎：调度线程、API和监控线程共用一个连接池，
+    每个连接使用WAL日志(读不阻塞写)、synchronous=NORMAL、mmap读取，并在锁被占用时等待busy_timeout
+    """
+    engine = create_engine(f'sqlite:///{db_path}', echo=False,
+                           pool_size=config.DEFAULT_DB_POOL_SIZE, max_overflow=config.DEFAULT_DB_POOL_SIZE,
+                           connect_args={"check_same_thread": False, "timeout": config.DEFAULT_DB_BUSY_TIMEOUT})
+    
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={int(config.DEFAULT_DB_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config.DEFAULT_DB_BUSY_TIMEOUT * 1000)}")
+        cursor.close()
+    
+    return engine
+
+
 class TaskStatus:
     PENDING = "PENDING"
     RUNNING = "RUNNING"
     COMPLETED = "COMPLETED"
 
 
+class TaskType:
+    TASK = "task"  # config_dict即运行的配置
+    SWEEP = "sweep"  # 参数扫描，config_dict为参数空间，每次运行分配一个配置点，need_run_num为配置点数
+
+
 class TaskModel(Base):
     """SQLAlchemy模型类，对应数据库中的task表"""
     __tablename__ = 'tasks'
+    __table_args__ = (
+        # 部分索引：只包含还有可领取运行的任务，启动时建队列和按状态列出任务不用扫描整张表
+        Index('ix_tasks_pending_id', 'id',
+              sqlite_where=text('need_run_num - run_num - claimed_num - running_num > 0')),
+        Index('ix_tasks_running_id', 'id', sqlite_where=text('running_num > 0')),
+        Index('ix_tasks_owner_id', 'owner', 'id'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(255), nullable=False)
     cmd = Column(Text, nullable=False)
-    run_num = Column(Integer, default=0, nullable=False)
+    run_num = Column(Integer, default=0, nullable=False)  # 已完成的运行次数
     need_run_num = Column(Integer, default=1, nullable=False)
+    claimed_num = Column(Integer, default=0, nullable=False)  # 已领取、进程尚未开始运行的次数
+    running_num = Column(Integer, default=0, nullable=False)  # 正在运行的次数
     config_dict = Column(JSON, nullable=True)  # 存储配置字典
     working_dir = Column(String(500), nullable=True)  # 工作目录
+    need_memory = Column(Integer, nullable=True)  # 每个GPU预计需要的显存(MB)，为空时使用全局min_process_memory
+    need_gpu_num = Column(Integer, default=1, nullable=False)  # 需要的GPU数量
+    priority = Column(Integer, default=0, nullable=False)  # 优先级，越大越先执行
+    owner = Column(String(255), nullable=True)  # 所属用户/项目，用于公平共享
+    task_type = Column(String(20), default=TaskType.TASK, nullable=False)  # TaskType
+    point_cursor = Column(Integer, default=0, nullable=False)  # 扫描任务下一个从未分配过的配置点
+    retry_points = Column(JSON, nullable=True)  # 扫描任务失败后待重跑的配置点 [[start, end), ...]
+    completed_points = Column(JSON, nullable=True)  # 扫描任务已完成的配置点 [[start, end), ...]
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    @hybrid_property
+    def pending_num(self) -> int:
+        """还可以领取的运行次数"""
+        return self.need_run_num - self.run_num - (self.claimed_num or 0) - (self.running_num or 0)
+    
+    @pending_num.expression
+    def pending_num(cls):
+        # 与部分索引ix_tasks_pending_id的条件写法一致，SQLite才会使用该索引
+        return cls.need_run_num - cls.run_num - cls.claimed_num - cls.running_num
+    
     @property
     def status(self) -> str:
         """计算任务状态"""
-        return TaskStatus.COMPLETED if self.run_num >= self.need_run_num else TaskStatus.PENDING
+        if self.run_num >= self.need_run_num:
+            return TaskStatus.COMPLETED
+        return TaskStatus.RUNNING if self.running_num else TaskStatus.PENDING
     
     def to_dict(self) -> Dict[str, Any]:
-        """转换为字典格式"""
-        return {
+        """转换为字典格式，扫描任务只给出配置点的计数，不展开配置点"""
+        task_dict = {
             "task_id": self.id,
+            "task_type": self.task_type or TaskType.TASK,
             "dict": str(self.config_dict or {}),
             "run_num": self.run_num,
             "need_run_num": self.need_run_num,
+            "pending_num": self.pending_num,
+            "claimed_num": self.claimed_num or 0,
+            "running_num": self.running_num or 0,
             "name": self.name,
             "cmd": self.cmd,
             "working_dir": self.working_dir,
+            "need_memory": self.need_memory,
+            "need_gpu_num": self.need_gpu_num,
+            "priority": self.priority,
+            "owner": self.owner,
             "status": self.status,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
+        if self.task_type == TaskType.SWEEP:
+            task_dict["point_cursor"] = self.point_cursor
+            task_dict["retry_point_num"] = len(PointRanges(self.retry_points))
+        return task_dict
+
+
+class RunModel(Base):
+    """
+    SQLAlchemy模型类，对应数据库中的runs表，每一行是任务的一次运行及其资源用量
+    id即进程ID，全局唯一且不复用，日志文件按它命名
+    """
+    __tablename__ = 'runs'
+    __table_args__ = (
+        Index('ix_runs_task_id_id', 'task_id', 'id'),
+        Index('ix_runs_status_id', 'status', 'id'),
+        Index('ix_runs_start_time', 'start_time'),
+        {'sqlite_autoincrement': True},
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(Integer, ForeignKey('tasks.id'), nullable=False)
+    pid = Column(Integer, nullable=True)
+    gpu_ids = Column(JSON, nullable=True)
+    cmd = Column(Text, nullable=True)
+    status = Column(String(20), nullable=False)  # ProcessStatus
+    point = Column(Integer, nullable=True)  # 扫描任务的配置点序号
+    returncode = Column(Integer, nullable=True)
+    start_time = Column(DateTime, default=datetime.utcnow)
+    end_time = Column(DateTime, nullable=True)
+    pid_create_time = Column(Float, nullable=True)  # 进程创建时间戳，重启后重新接管时用来排除被复用的pid
+    stdout_path = Column(String(500), nullable=True)
+    stderr_path = Column(String(500), nullable=True)
+    exit_path = Column(String(500), nullable=True)  # 任务退出码文件，FlowLine不在时任务结束也能拿到退出码
+    wall_time = Column(Float, nullable=True)  # s
+    cpu_time = Column(Float, nullable=True)  # s, user + system of the whole process tree
+    peak_cpu_percent = Column(Float, nullable=True)
+    peak_rss = Column(Float, nullable=True)  # MB
+    peak_gpu_memory = Column(Float, nullable=True)  # MB
+    io_read_bytes = Column(BigInteger, nullable=True)
+    io_write_bytes = Column(BigInteger, nullable=True)
+    sample_num = Column(Integer, default=0, nullable=False)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式"""
+        return {
+            "run_id": self.id,
+            "task_id": self.task_id,
+            "pid": self.pid,
+            "gpu_ids": self.gpu_ids,
+            "cmd": self.cmd,
+            "point": self.point,
+            "status": self.status,
+            "returncode": self.returncode,
+            "start_time": self.start_time.isoformat() if self.start_time else None,
+            "end_time": self.end_time.isoformat() if self.end_time else None,
+            "stdout_path": self.stdout_path,
+            "stderr_path": self.stderr_path,
+            "exit_path": self.exit_path,
+            "pid_create_time": self.pid_create_time,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_cpu_percent": self.peak_cpu_percent,
+            "peak_rss": self.peak_rss,
+            "peak_gpu_memory": self.peak_gpu_memory,
+            "io_read_bytes": self.io_read_bytes,
+            "io_write_bytes": self.io_write_bytes,
+            "sample_num": self.sample_num,
+        }
+
+
+class SubmissionModel(Base):
+    """批量提交记录，带幂等键的请求重试时直接返回第一次创建的任务，不会重复创建"""
+    __tablename__ = 'submissions'
+    
+    key = Column(String(255), primary_key=True)  # 幂等键
+    task_ids = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 
 class Task:
@@ -74,6 +221,10 @@ class Task:
     def config_dict(self) -> Dict[str, Any]:
         return self._model.config_dict or {}
     
+    @property
+    def is_sweep(self) -> bool:
+        return self._model.task_type == TaskType.SWEEP
+    
     @property
     def run_num(self) -> int:
         return self._model.run_num
@@ -94,6 +245,22 @@ class Task:
     def working_dir(self) -> Optional[str]:
         return self._model.working_dir
     
+    @property
+    def need_memory(self) -> Optional[int]:
+        return self._model.need_memory
+    
+    @property
+    def need_gpu_num(self) -> int:
+        return self._model.need_gpu_num or 1
+    
+    @property
+    def priority(self) -> int:
+        return self._model.priority or 0
+    
+    @property
+    def owner(self) -> Optional[str]:
+        return self._model.owner
+    
     @property
     def state(self) -> str:
         return self._model.status
@@ -112,13 +279,20 @@ class TaskManager:
         self._lock = threading.Lock()
         self.db_path = db_path
         
-        # 创建数据库引擎和会话
-        self.engine = create_engine(f'sqlite:///{db_path}', echo=False)
+        # 创建数据库引擎和会话，会话从共享的连接池中取连接
+        self.engine = create_db_engine(db_path)
         Base.metadata.create_all(self.engine)
+        self._migrate_schema()
+        self._backfill_run_counts()
         self.SessionLocal = sessionmaker(bind=self.engine)
         
-        # 内存中的任务队列
-        self.task_ids = queue.PriorityQueue()
+        # 内存中的任务队列，每个任务一项，记录剩余运行次数，按优先级+公平共享排序
+        self.fair_share = FairShare(config.DEFAULT_FAIR_SHARE_HALF_LIFE)
+        self.task_ids = TaskQueue(self.fair_share, config.DEFAULT_FAIR_SHARE_RUN_COST)
+        self.task_meta = {}  # {task_id: (priority, owner, need_gpu_num)}
+        self.sweeps = {}  # {task_id: SweepSpec}，扫描任务的参数空间，分配配置点时按需解析
+        self.failures = {}  # {task_id: 连续失败的运行次数}，决定重试退避时间
+        self.queue_stats = QueueStats()
         
         # 初始化任务队列
         self._initialize_task_queue()
@@ -129,19 +303,67 @@ class TaskManager:
         """获取数据库会话"""
         return self.SessionLocal()
 
+    def _migrate_schema(self) -> set:
+        """为旧版本创建的数据库补齐新增的列和索引，返回新增的列 {"表名.列名"}"""
+        added_columns = set()
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=self.engine.dialect)
+                sql = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                if column.default is not None and column.default.is_scalar:
+                    sql += f" DEFAULT {column.default.arg!r}"
+                with self.engine.begin() as connection:
+                    connection.execute(text(sql))
+                logger.info(f"Added column {table.name}.{column.name}")
+                added_columns.add(f"{table.name}.{column.name}")
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(self.engine)
+                    logger.info(f"Created index {index.name}")
+        return added_columns
+    
+    def _backfill_run_counts(self):
+        """
+        启动时按runs表中未结束的运行重新计算领取/运行次数：旧数据库新增的计数列，
+        以及上次退出时已领取但没有创建运行记录的领取次数(不会再有finish_run归还)都由此修正
+        """
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                "UPDATE tasks SET "
+                "claimed_num = (SELECT COUNT(*) FROM runs WHERE runs.task_id = tasks.id AND runs.status = 'PENDING'), "
+                "running_num = (SELECT COUNT(*) FROM runs WHERE runs.task_id = tasks.id AND runs.status IN ('RUNNING', 'KILLING')) "
+                "WHERE claimed_num > 0 OR running_num > 0 "
+                "OR id IN (SELECT task_id FROM runs WHERE status IN ('PENDING', 'RUNNING', 'KILLING'))"))
+        logger.info("Recomputed claimed/running run counts of tasks from runs")
+
     def _initialize_task_queue(self):
-        """初始化任务队列，将未完成的任务加入队列"""
+        """初始化任务队列，将还有可领取运行的任务加入队列，已领取或运行中的运行由重新接管处理"""
         with self._get_session() as session:
             pending_tasks = session.query(TaskModel).filter(
-                TaskModel.run_num < TaskModel.need_run_num
+                TaskModel.pending_num > 0
             ).all()
             
             for task in pending_tasks:
-                remaining_runs = task.need_run_num - task.run_num
-                for _ in range(remaining_runs):
-                    self.task_ids.put(task.id)
+                remaining_runs = task.pending_num
+                enqueue_time = task.created_at.replace(tzinfo=timezone.utc).timestamp() if task.created_at else time.time()
+                self._remember(task)
+                self._put(task.id, enqueue_time, remaining_runs)
                     
-        logger.info(f"Initialized task queue with {self.task_ids.qsize()} pending task runs")
+        logger.info(f"Initialized task queue with {len(self.task_ids)} pending task runs")
+        
+    def _remember(self, task: TaskModel):
+        """记录任务的排序信息，供重新入队和公平共享计费使用"""
+        self.task_meta[task.id] = (task.priority or 0, task.owner or DEFAULT_OWNER, task.need_gpu_num or 1)
+        
+    def _put(self, task_id: int, enqueue_time: Optional[float] = None, count: int = 1):
+        """将任务的count次运行加入队列"""
+        priority, owner, _ = self.task_meta.get(task_id, (0, DEFAULT_OWNER, 1))
+        self.task_ids.push(task_id, priority, owner, enqueue_time, count)
 
     def synchronized(func):
         """同步装饰器"""
@@ -152,61 +374,182 @@ class TaskManager:
     
     # -------------------------------
     
-    def get_task_dict(self) -> List[Dict[str, Any]]:
-        """获取所有任务的字典列表"""
+    def get_task_dict(self, owner: Optional[str] = None, status: Optional[str] = None,
+                      before_id: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        获取任务的字典列表，可按所属用户、状态过滤
+        status: 与TaskModel.status的判断顺序一致，COMPLETED(完成次数已够)优先，其次RUNNING(有运行中的进程)，其余为PENDING
+        不翻页时按任务ID从旧到新返回全部任务；给出before_id或limit时按ID从新到旧，只返回ID小于before_id的至多limit个
+        """
         with self._get_session() as session:
-            tasks = session.query(TaskModel).all()
-            return [task.to_dict() for task in tasks]
+            query = session.query(TaskModel)
+            if owner is not None:
+                query = query.filter(TaskModel.owner == owner)
+            if status == TaskStatus.PENDING:
+                query = query.filter(TaskModel.run_num < TaskModel.need_run_num, TaskModel.running_num == 0)
+            elif status == TaskStatus.RUNNING:
+                query = query.filter(TaskModel.run_num < TaskModel.need_run_num, TaskModel.running_num > 0)
+            elif status == TaskStatus.COMPLETED:
+                query = query.filter(TaskModel.run_num >= TaskModel.need_run_num)
+            if before_id is not None:
+                query = query.filter(TaskModel.id < before_id)
+            if before_id is None and limit is None:
+                return [task.to_dict() for task in query.order_by(TaskModel.id).all()]
+            return [task.to_dict() for task in query.order_by(TaskModel.id.desc()).limit(limit).all()]
     
-    @synchronized
     def get_next_task(self) -> Optional[Task]:
         """获取下一个待执行的任务"""
-        while not self.task_ids.empty():
-            task_id = self.task_ids.get()
-            
+        tasks = self.get_next_tasks(1)
+        return tasks[0] if tasks else None
+    
+    def get_next_tasks(self, num: int) -> List[Task]:
+        """获取至多num个待执行的任务（批量调度，同一任务可被领取多次）"""
+        tasks = self.peek_tasks(num)
+        claimed = self.claim_tasks([(task.task_id, False) for task in tasks])
+        return [task for task, ok in zip(tasks, claimed) if ok]
+    
+    @synchronized
+    def peek_tasks(self, window: int) -> List[Task]:
+        """
+        按调度顺序查看前window次待执行的运行（不出队），一次查询取出涉及的任务，
+        队列中多于数据库里可领取次数的（已删除、已完成或已被领取）顺便裁掉
+        """
+        while True:
+            entries = self.task_ids.peek(window)
+            task_ids = {task_id for task_id, _ in entries}
             with self._get_session() as session:
-                task_model = session.query(TaskModel).filter(TaskModel.id == task_id).first()
-                if task_model is None:
-                    logger.warning(f"Task {task_id} not found in database")
-                    continue
-                
-                # 检查任务是否已完成
-                if task_model.run_num >= task_model.need_run_num:
-                    logger.info(f"Task {task_id} is already completed, skipping")
-                    continue
-                    
-                logger.info(f"get task {task_id} config: {task_model.config_dict}")
-                return Task(task_model)
+                task_models = {task.id: task for task in session.query(TaskModel).filter(TaskModel.id.in_(task_ids)).all()}
+            stale_ids = {task_id for task_id in task_ids
+                         if task_id not in task_models or task_models[task_id].pending_num < self.task_ids.count(task_id)}
+            if not stale_ids:
+                return [Task(task_models[task_id]) for task_id, _ in entries]
+            logger.info(f"trim deleted, completed or claimed runs of tasks {sorted(stale_ids)} from queue")
+            for task_id in stale_ids:
+                self.task_ids.trim(task_id, task_models[task_id].pending_num if task_id in task_models else 0)
+    
+    def claim_task(self, task_id: int, backfill: bool = False) -> bool:
+        """领取任务的一次运行，backfill表示它越过了排在前面但暂时放不下的任务"""
+        return self.claim_tasks([(task_id, backfill)])[0]
+    
+    @synchronized
+    def claim_tasks(self, claims: List[tuple]) -> List[bool]:
+        """
+        批量领取运行 [(task_id, backfill)]，同一任务可出现多次，返回每一项是否领取成功
+        数据库中只有一条UPDATE语句: 可领取次数足够的任务claimed_num加上领取次数，RETURNING领取成功的任务，
+        可领取次数不够的任务整体失败，并把队列裁到数据库里的可领取次数
+        """
+        counts = {}
+        for task_id, _ in claims:
+            counts[task_id] = counts.get(task_id, 0) + 1
+        if not counts:
+            return []
+        claim_num = case(counts, value=TaskModel.id)
+        with self.engine.begin() as connection:
+            if connection.dialect.update_returning:
+                statement = (update(TaskModel)
+                             .where(TaskModel.id.in_(counts),
+                                    TaskModel.pending_num >= claim_num)
+                             .values(claimed_num=TaskModel.claimed_num + claim_num)
+                             .returning(TaskModel.id))
+                claimed_ids = {row[0] for row in connection.execute(statement)}
+            else:
+                # SQLite 3.35之前没有RETURNING: 先拿写锁，查出可领取次数足够的任务再更新
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+                claimed_ids = set(connection.execute(select(TaskModel.id).where(TaskModel.id.in_(counts),
+                                                                                TaskModel.pending_num >= claim_num)).scalars())
+                if claimed_ids:
+                    connection.execute(update(TaskModel).where(TaskModel.id.in_(claimed_ids))
+                                       .values(claimed_num=TaskModel.claimed_num + claim_num))
         
-        return None
+        now = time.time()
+        for task_id, backfill in claims:
+            if task_id not in claimed_ids:
+                continue
+            enqueue_time = self.task_ids.remove_one(task_id)
+            self.queue_stats.record(now - (enqueue_time or now), backfill)
+            _, owner, need_gpu_num = self.task_meta.get(task_id, (0, DEFAULT_OWNER, 1))
+            self.fair_share.start(owner, need_gpu_num)
+        failed_ids = set(counts) - claimed_ids
+        if failed_ids:
+            logger.info(f"failed to claim tasks {sorted(failed_ids)}, not enough pending runs")
+            with self._get_session() as session:
+                pending = {task.id: task.pending_num for task in session.query(TaskModel).filter(TaskModel.id.in_(failed_ids)).all()}
+            for task_id in failed_ids:
+                self.task_ids.trim(task_id, pending.get(task_id, 0))
+        return [task_id in claimed_ids for task_id, _ in claims]
     
     @synchronized
-    def put_task_ids(self, task_id: int):
-        """将任务重新放回队列"""
-        self.task_ids.put(task_id)
-        logger.info(f"put task {task_id} back to queue")
+    def put_task_ids(self, task_id: int, unclaim: bool = False, failed: bool = False):
+        """
+        将领取的运行放回队列
+        unclaim: 运行记录尚未创建(finish_run不会被调用)，同时归还数据库中的领取次数
+        failed: 运行失败，任务按连续失败次数指数退避后才会再被调度，避免立即失败的命令被不停重启
+        """
+        if unclaim:
+            with self.engine.begin() as connection:
+                connection.execute(update(TaskModel).where(TaskModel.id == task_id, TaskModel.claimed_num > 0)
+                                   .values(claimed_num=TaskModel.claimed_num - 1))
+        _, owner, need_gpu_num = self.task_meta.get(task_id, (0, DEFAULT_OWNER, 1))
+        self.fair_share.stop(owner, need_gpu_num)
+        self._put(task_id)
+        if failed:
+            self.failures[task_id] = self.failures.get(task_id, 0) + 1
+            delay = min(config.DEFAULT_RETRY_DELAY * 2 ** (self.failures[task_id] - 1), config.DEFAULT_RETRY_MAX_DELAY)
+            self.task_ids.defer(task_id, time.time() + delay)
+            logger.info(f"put task {task_id} back to queue, retry in {delay:g}s after {self.failures[task_id]} failures")
+        else:
+            logger.info(f"put task {task_id} back to queue")
         
     @synchronized
-    def update_task_ids(self, task_ids: List[int]):
-        """更新任务执行次数"""
+    def get_retry_wait(self) -> Optional[float]:
+        """距最早结束重试退避的任务还有多少秒，没有退避中的任务时为None"""
+        ready_time = self.task_ids.next_ready_time()
+        return None if ready_time is None else max(ready_time - time.time(), 0)
+        
+    @synchronized
+    def set_task_priority(self, task_id: int, priority: int) -> bool:
+        """修改任务优先级，队列中的运行按新优先级重新排序"""
         with self._get_session() as session:
-            for task_id in task_ids:
-                task = session.query(TaskModel).filter(TaskModel.id == task_id).first()
-                if task is None:
-                    logger.warning(f"Task {task_id} not found in database")
-                    continue
-                    
-                task.run_num += 1
-                task.updated_at = datetime.utcnow()
-                
-                logger.info(f"update task {task_id} run times: {task.run_num}")
-            
+            task = session.query(TaskModel).filter(TaskModel.id == task_id).first()
+            if task is None:
+                return False
+            task.priority = priority
+            task.updated_at = datetime.utcnow()
             session.commit()
+            self._remember(task)
+        _, owner, _ = self.task_meta[task_id]
+        self.task_ids.update(task_id, priority, owner)
+        logger.info(f"set task {task_id} priority: {priority}")
+        return True
+        
+    def set_owner_weight(self, owner: str, weight: float):
+        """设置owner的公平共享权重"""
+        self.fair_share.set_weight(owner, weight)
+        
+    def get_queue_stats(self) -> Dict[str, Any]:
+        """获取排队统计信息"""
+        stats = self.queue_stats.to_dict()
+        stats["pending_num"] = len(self.task_ids)
+        stats["fair_share"] = self.fair_share.to_dict()
+        return stats
+        
+    @synchronized
+    def update_task_ids(self, task_ids: List[int]):
+        """任务的运行已完成：停止公平共享计费，完成次数已由finish_run在同一事务中计入"""
+        for task_id in task_ids:
+            _, owner, need_gpu_num = self.task_meta.get(task_id, (0, DEFAULT_OWNER, 1))
+            self.fair_share.stop(owner, need_gpu_num)
+            self.failures.pop(task_id, None)
+            logger.info(f"task {task_id} run completed")
 
     @synchronized
     def create_task(self, name: str, cmd: str, need_run_num: int = 1, 
                    config_dict: Optional[Dict[str, Any]] = None,
-                   working_dir: Optional[str] = None) -> Optional[int]:
+                   working_dir: Optional[str] = None,
+                   need_memory: Optional[int] = None,
+                   need_gpu_num: int = 1,
+                   priority: int = 0,
+                   owner: Optional[str] = None) -> Optional[int]:
         """创建新任务"""
         try:
             with self._get_session() as session:
@@ -215,14 +558,18 @@ class TaskManager:
                     cmd=cmd,
                     need_run_num=need_run_num,
                     config_dict=config_dict or {},
-                    working_dir=working_dir
+                    working_dir=working_dir,
+                    need_memory=need_memory,
+                    need_gpu_num=need_gpu_num,
+                    priority=priority,
+                    owner=owner
                 )
                 session.add(new_task)
                 session.commit()
                 
                 # 将新任务加入队列
-                for _ in range(need_run_num):
-                    self.task_ids.put(new_task.id)
+                self._remember(new_task)
+                self._put(new_task.id, None, need_run_num)
                     
                 logger.info(f"Created new task: {new_task.id} - {name}")
                 return new_task.id
@@ -231,6 +578,223 @@ class TaskManager:
             logger.error(f"Failed to create task: {e}")
             return None
 
+    @synchronized
+    def create_tasks(self, tasks: List[Dict[str, Any]], idempotency_key: Optional[str] = None) -> Tuple[List[int], bool]:
+        """
+        在一个事务中批量创建任务(一次executemany)，返回 (任务ID列表, 是否为新建)
+        tasks: 每项为create_task的参数字典，cmd必填
+        idempotency_key: 同一个键只创建一次，重试时返回第一次创建的任务ID
+        """
+        now = datetime.utcnow()
+        rows = []
+        for i, task in enumerate(tasks):
+            if not task.get("cmd"):
+                raise ValueError(f"task {i}: command is required")
+            rows.append({
+                "name": task.get("name") or "Unnamed Task",
+                "cmd": task["cmd"],
+                "need_run_num": task.get("need_run_num", 1),
+                "config_dict": task.get("config_dict") or {},
+                "working_dir": task.get("working_dir"),
+                "need_memory": task.get("need_memory"),
+                "need_gpu_num": task.get("need_gpu_num", 1),
+                "priority": task.get("priority", 0),
+                "owner": task.get("owner"),
+                "task_type": task.get("task_type", TaskType.TASK),
+                "created_at": now,
+                "updated_at": now,
+            })
+        
+        if idempotency_key is not None:
+            with self.engine.connect() as connection:
+                task_ids = connection.execute(select(SubmissionModel.task_ids).where(SubmissionModel.key == idempotency_key)).scalar()
+            if task_ids is not None:
+                logger.info(f"bulk submission {idempotency_key} already created tasks, return them")
+                return task_ids, False
+        
+        task_ids = []
+        with self.engine.begin() as connection:
+            if rows and connection.dialect.insert_returning:
+                task_ids = list(connection.execute(insert(TaskModel).returning(TaskModel.id, sort_by_parameter_order=True), rows).scalars())
+            elif rows:
+                # SQLite 3.35之前没有RETURNING，逐行插入取自增ID，仍在同一个事务中
+                task_ids = [connection.execute(insert(TaskModel).values(**row)).inserted_primary_key[0] for row in rows]
+            if idempotency_key is not None:
+                connection.execute(insert(SubmissionModel).values(key=idempotency_key, task_ids=task_ids, created_at=now))
+        
+        for task_id, row in zip(task_ids, rows):
+            self._remember(TaskModel(id=task_id, **row))
+            self._put(task_id, None, row["need_run_num"])
+        logger.info(f"Created {len(task_ids)} tasks in one transaction")
+        return task_ids, True
+
+    @synchronized
+    def next_point(self, task_id: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """
+        为扫描任务领取到的一次运行分配配置点，返回 (配置点序号, 配置字典)
+        先重跑失败的配置点，再按游标取下一个从未分配过的，配置字典按序号现场生成
+        """
+        with self._get_session() as session:
+            task = session.query(TaskModel).filter(TaskModel.id == task_id).first()
+            if task is None or task.task_type != TaskType.SWEEP:
+                return None
+            if task_id not in self.sweeps:
+                self.sweeps[task_id] = SweepSpec.from_dict(task.config_dict or {})
+            retry_points = PointRanges(task.retry_points)
+            point = retry_points.pop()
+            if point is not None:
+                task.retry_points = retry_points.to_list()
+            elif task.point_cursor < task.need_run_num:
+                point = task.point_cursor
+                task.point_cursor = point + 1
+            else:
+                logger.warning(f"sweep task {task_id} has no point left to run")
+                return None
+            session.commit()
+        return point, self.sweeps[task_id][point]
+    
+    @synchronized
+    def release_point(self, task_id: int, point: int):
+        """运行记录创建失败，把分配的配置点放回待重跑"""
+        with self._get_session() as session:
+            task = session.query(TaskModel).filter(TaskModel.id == task_id).first()
+            if task is not None:
+                self._return_point(task, point, False)
+                session.commit()
+    
+    @staticmethod
+    def _return_point(task: TaskModel, point: int, completed: bool):
+        """配置点的运行结束：成功则记为已完成，否则放回待重跑"""
+        column = "completed_points" if completed else "retry_points"
+        points = PointRanges(getattr(task, column))
+        points.add(point)
+        setattr(task, column, points.to_list())
+
+    def start_run(self, task_id: int, gpu_ids: List[int], cmd: str, status: str, point: Optional[int] = None) -> Optional[int]:
+        """在启动进程前记录一次运行，返回全局唯一的run_id，同时作为进程ID，point为扫描任务分配到的配置点"""
+        try:
+            with self._get_session() as session:
+                run = RunModel(task_id=task_id, gpu_ids=gpu_ids, cmd=cmd, status=status, point=point)
+                session.add(run)
+                session.commit()
+                return run.id
+        except Exception as e:
+            logger.error(f"Failed to record run of task {task_id}: {e}")
+            return None
+            
+    def update_run(self, run_id: int, **kwargs) -> bool:
+        """更新运行记录，状态从PENDING变为RUNNING时任务的领取次数在同一事务中转为运行次数"""
+        try:
+            with self._get_session() as session:
+                run = session.query(RunModel).filter(RunModel.id == run_id).first()
+                if run is None:
+                    return False
+                if kwargs.get("status") == TaskStatus.RUNNING and run.status == TaskStatus.PENDING:
+                    session.execute(update(TaskModel).where(TaskModel.id == run.task_id).values(
+                        claimed_num=case((TaskModel.claimed_num > 0, TaskModel.claimed_num - 1), else_=0),
+                        running_num=TaskModel.running_num + 1))
+                for key, value in kwargs.items():
+                    if hasattr(run, key):
+                        setattr(run, key, value)
+                session.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Failed to update run {run_id}: {e}")
+            return False
+            
+    @synchronized
+    def finish_run(self, run_id: int, status: str, returncode: Optional[int], usage: Dict[str, Any]) -> bool:
+        """
+        记录一次运行的结束状态和资源用量(峰值与累计值)，同一事务中归还任务的领取/运行次数，
+        运行成功(COMPLETED)时计入完成次数，失败或被终止的运行重新变为可领取
+        扫描任务的配置点记为已完成或放回待重跑，与next_point互斥，避免配置点范围的读改写相互覆盖
+        """
+        try:
+            with self._get_session() as session:
+                run = session.query(RunModel).filter(RunModel.id == run_id).first()
+                if run is None:
+                    return False
+                counter = TaskModel.claimed_num if run.status == TaskStatus.PENDING else TaskModel.running_num
+                values = {counter.key: case((counter > 0, counter - 1), else_=0)}
+                if status == TaskStatus.COMPLETED:
+                    values["run_num"] = TaskModel.run_num + 1
+                    values["updated_at"] = datetime.utcnow()
+                if run.point is not None:
+                    task = session.query(TaskModel).filter(TaskModel.id == run.task_id).first()
+                    if task is not None:
+                        self._return_point(task, run.point, status == TaskStatus.COMPLETED)
+                        session.flush()
+                session.execute(update(TaskModel).where(TaskModel.id == run.task_id).values(**values))
+                run.status = status
+                run.returncode = returncode
+                run.end_time = datetime.utcnow()
+                run.wall_time = (run.end_time - run.start_time).total_seconds() if run.start_time else None
+                for key, value in usage.items():
+                    if hasattr(run, key):
+                        setattr(run, key, value)
+                session.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Failed to finish run {run_id}: {e}")
+            return False
+            
+    def get_unfinished_runs(self, statuses: List[str]) -> List[Dict[str, Any]]:
+        """获取处于给定状态(未结束)的运行，用于重启后重新接管"""
+        with self._get_session() as session:
+            runs = session.query(RunModel).filter(RunModel.status.in_(statuses)).order_by(RunModel.id).all()
+            return [run.to_dict() for run in runs]
+            
+    @synchronized
+    def reclaim_task(self, task_id: int):
+        """重启后重新接管的运行：它已计入数据库的运行次数、不在队列中，只恢复公平共享计费"""
+        _, owner, need_gpu_num = self.task_meta.get(task_id, (0, DEFAULT_OWNER, 1))
+        self.fair_share.start(owner, need_gpu_num)
+        
+    @synchronized
+    def remember_task(self, task: Task):
+        """
+        重启后接管运行前记录任务的排序信息：只剩在途运行的任务(pending_num为0)启动时没有加入队列，
+        不记录的话重新入队和公平共享计费会退回默认owner和优先级
+        """
+        self._remember(task._model)
+        
+    @synchronized
+    def requeue_task(self, task_id: int):
+        """重启时发现已在FlowLine停止期间失败的运行：finish_run已归还领取次数，把它放回队列"""
+        self._put(task_id)
+            
+    def get_run(self, run_id: int) -> Optional[Dict[str, Any]]:
+        """根据run_id获取运行记录"""
+        with self._get_session() as session:
+            run = session.query(RunModel).filter(RunModel.id == run_id).first()
+            return run.to_dict() if run else None
+            
+    def get_runs(self, task_id: Optional[int] = None, status: Optional[str] = None,
+                 since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 before_id: Optional[int] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        查询运行记录，按run_id(有时间过滤时按开始时间)从新到旧，可按任务、状态、开始时间过滤
+        before_id用于翻页：只返回run_id小于它的记录
+        """
+        with self._get_session() as session:
+            query = session.query(RunModel)
+            if task_id is not None:
+                query = query.filter(RunModel.task_id == task_id)
+            if status is not None:
+                query = query.filter(RunModel.status == status)
+            if since is not None:
+                query = query.filter(RunModel.start_time >= since)
+            if until is not None:
+                query = query.filter(RunModel.start_time < until)
+            if before_id is not None:
+                query = query.filter(RunModel.id < before_id)
+            if since is not None or until is not None:
+                # 让SQLite走start_time索引，而不是按主键倒序扫描整张表
+                query = query.order_by(RunModel.start_time.desc(), RunModel.id.desc())
+            else:
+                query = query.order_by(RunModel.id.desc())
+            return [run.to_dict() for run in query.limit(limit).all()]
+
     def get_task_by_id(self, task_id: int) -> Optional[Task]:
         """根据ID获取任务"""
         with self._get_session() as session:
@@ -247,6 +811,9 @@ class TaskManager:
                 if task:
                     session.delete(task)
                     session.commit()
+                    with self._lock:
+                        self.task_ids.remove_task(task_id)
+                        self.sweeps.pop(task_id, None)
                     logger.info(f"Deleted task: {task_id}")
                     return True
                 return False
@@ -292,9 +859,15 @@ class TaskManager:
                 new_task = TaskModel(
                     name=new_name,
                     cmd=original_task.cmd,
-                    need_run_num=new_need_run_num or original_task.need_run_num,
+                    need_run_num=original_task.need_run_num if original_task.task_type == TaskType.SWEEP
+                                 else new_need_run_num or original_task.need_run_num,
                     config_dict=original_task.config_dict.copy() if original_task.config_dict else {},
+                    task_type=original_task.task_type,
                     working_dir=original_task.working_dir,
+                    need_memory=original_task.need_memory,
+                    need_gpu_num=original_task.need_gpu_num,
+                    priority=original_task.priority,
+                    owner=original_task.owner,
                     run_num=0  # 新任务从0开始
                 )
                 
@@ -302,8 +875,8 @@ class TaskManager:
                 session.commit()
                 
                 # 将新任务加入队列
-                for _ in range(new_task.need_run_num):
-                    self.task_ids.put(new_task.id)
+                self._remember(new_task)
+                self._put(new_task.id, None, new_task.need_run_num)
                 
                 logger.info(f"Copied task {task_id} to new task {new_task.id}: {new_name}")
                 return new_task.id
@@ -0,0 +1,252 @@
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class QueueStats:
+    """任务排队等待时间统计，保留最近history_length次调度的等待时间"""
+    def __init__(self, history_length: int = 10000):
+        self.waits = deque(maxlen=history_length)
+        self.dispatched_num = 0
+        self.backfilled_num = 0
+
+    def record(self, wait: float, backfill: bool = False):
+        self.waits.append(wait)
+        self.dispatched_num += 1
+        if backfill:
+            self.backfilled_num += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+        return {
+            "dispatched_num": self.dispatched_num,
+            "backfilled_num": self.backfilled_num,
+            "wait_mean": sum(waits) / len(waits) if waits else None,
+            "wait_p50": waits[len(waits) // 2] if waits else None,
+            "wait_p95": waits[min(int(len(waits) * 0.95), len(waits) - 1)] if waits else None,
+            "wait_max": waits[-1] if waits else None,
+        }
+
+
+class FairShare:
+    """
+    每个owner最近使用的GPU时间(GPU·秒)，按half_life指数衰减
+    运行中的GPU数量持续累加进使用量，share = 使用量 / 权重，越小越优先
+    """
+    def __init__(self, half_life: float, default_weight: float = 1.0):
+        self.half_life = half_life
+        self.default_weight = default_weight
+        self.weights = {}
+        self.usage = {}  # {owner: (GPU·秒, 上次更新时间)}
+        self.running_gpus = {}  # {owner: 运行中的GPU数量}
+
+    def _update(self, owner: str, now: float) -> float:
+        usage, last_time = self.usage.get(owner, (0.0, now))
+        elapsed = max(now - last_time, 0)
+        usage = usage * 0.5 ** (elapsed / self.half_life) + self.running_gpus.get(owner, 0) * elapsed
+        self.usage[owner] = (usage, now)
+        return usage
+
+    def start(self, owner: str, gpu_num: int = 1):
+        self._update(owner, time.time())
+        self.running_gpus[owner] = self.running_gpus.get(owner, 0) + gpu_num
+
+    def stop(self, owner: str, gpu_num: int = 1):
+        self._update(owner, time.time())
+        self.running_gpus[owner] = max(self.running_gpus.get(owner, 0) - gpu_num, 0)
+
+    def set_weight(self, owner: str, weight: float):
+        self.weights[owner] = weight
+
+    def get_weight(self, owner: str) -> float:
+        return self.weights.get(owner, self.default_weight)
+
+    def share(self, owner: str, now: float, extra_usage: float = 0) -> float:
+        return (self._update(owner, now) + extra_usage) / self.get_weight(owner)
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        owners = set(self.usage) | set(self.weights)
+        return {owner: {"usage": self._update(owner, now),
+                        "weight": self.get_weight(owner),
+                        "running_gpus": self.running_gpus.get(owner, 0)} for owner in owners}
+
+
+class QueuedTask:
+    """队列中的一个任务：剩余运行次数，以及按入队时间分组的运行 [[入队时间, 次数]]"""
+    __slots__ = ("task_id", "priority", "owner", "seq", "count", "groups", "not_before")
+
+    def __init__(self, task_id: int, priority: int, owner: str):
+        self.task_id = task_id
+        self.priority = priority
+        self.owner = owner
+        self.seq = None  # 堆中有效项的seq，其余同task_id的项均已失效
+        self.count = 0
+        self.groups = deque()
+        self.not_before = 0.0  # 失败重试退避：此时间之前不调度该任务
+
+    def enqueue_time(self, index: int) -> float:
+        """第index次(从0开始)待执行运行的入队时间"""
+        for enqueue_time, count in self.groups:
+            if index < count:
+                return enqueue_time
+            index -= count
+        return self.groups[-1][0]
+
+
+class TaskQueue:
+    """
+    待执行运行的队列，每个任务一项，记录剩余运行次数，领取时递减，内存和初始化代价与任务数成正比
+    排序: 先按priority严格优先（越大越先），同一优先级内按owner的公平共享份额轮转，同一owner内按task_id先进先出
+    每个owner一个堆，出队/入队O(log 任务数)，选owner的代价与owner数量成正比
+    """
+    def __init__(self, fair_share: FairShare, run_cost: float):
+        self.fair_share = fair_share
+        self.run_cost = run_cost  # 一次窗口内选中多次时，每次选中预先计入的GPU·秒，使各owner交替
+        self.heaps = {}  # {owner: [(-priority, task_id, seq)]}，懒删除，seq与QueuedTask.seq不符的项已失效
+        self.tasks = {}  # {task_id: QueuedTask}
+        self.deferred = {}  # {task_id: not_before}，处于重试退避中的任务
+        self.seq = itertools.count()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _heap_push(self, task: QueuedTask):
+        task.seq = next(self.seq)
+        heapq.heappush(self.heaps.setdefault(task.owner, []), (-task.priority, task.task_id, task.seq))
+
+    def push(self, task_id: int, priority: int, owner: str, enqueue_time: Optional[float] = None, count: int = 1):
+        """加入任务的count次运行"""
+        if count <= 0:
+            return
+        task = self.tasks.get(task_id)
+        if task is None:
+            task = self.tasks[task_id] = QueuedTask(task_id, priority, owner)
+            self._heap_push(task)
+        enqueue_time = enqueue_time or time.time()
+        if task.groups and task.groups[-1][0] == enqueue_time:
+            task.groups[-1][1] += count
+        else:
+            task.groups.append([enqueue_time, count])
+        task.count += count
+        self.size += count
+
+    def defer(self, task_id: int, not_before: float):
+        """not_before之前peek跳过该任务的全部运行"""
+        task = self.tasks.get(task_id)
+        if task is None:
+            return
+        task.not_before = max(task.not_before, not_before)
+        self.deferred[task_id] = task.not_before
+
+    def next_ready_time(self) -> Optional[float]:
+        """最早结束退避的时间，没有退避中的任务时为None"""
+        now = time.time()
+        for task_id, not_before in list(self.deferred.items()):
+            if not_before <= now or task_id not in self.tasks:
+                del self.deferred[task_id]
+        return min(self.deferred.values()) if self.deferred else None
+
+    def update(self, task_id: int, priority: int, owner: str):
+        """任务的priority或owner变化后重新排序"""
+        task = self.tasks.get(task_id)
+        if task is None or (task.priority, task.owner) == (priority, owner):
+            return
+        task.priority, task.owner = priority, owner
+        self._heap_push(task)
+
+    def _valid(self, entry: Tuple) -> bool:
+        task = self.tasks.get(entry[1])
+        return task is not None and task.seq == entry[2]
+
+    def _head(self, owner: str) -> Optional[Tuple]:
+        heap = self.heaps[owner]
+        while heap and not self._valid(heap[0]):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def peek(self, num: int) -> List[Tuple[int, float]]:
+        """按调度顺序返回前num次运行 [(task_id, 入队时间)]，不出队"""
+        now = time.time()
+        extra_usage = {}
+        taken = {}  # {task_id: 本次已返回的运行次数}
+        popped = []
+        runs = []
+        while len(runs) < num:
+            best_owner, best_key = None, None
+            for owner in list(self.heaps):
+                head = self._head(owner)
+                if head is None:
+                    del self.heaps[owner]
+                    continue
+                key = (head[0], self.fair_share.share(owner, now, extra_usage.get(owner, 0)), owner)
+                if best_key is None or key < best_key:
+                    best_owner, best_key = owner, key
+            if best_owner is None:
+                break
+            task = self.tasks[self.heaps[best_owner][0][1]]
+            if task.not_before > now:
+                # 退避中，本次跳过
+                popped.append((best_owner, heapq.heappop(self.heaps[best_owner])))
+                continue
+            index = taken.get(task.task_id, 0)
+            runs.append((task.task_id, task.enqueue_time(index)))
+            taken[task.task_id] = index + 1
+            if index + 1 >= task.count:
+                popped.append((best_owner, heapq.heappop(self.heaps[best_owner])))
+            extra_usage[best_owner] = extra_usage.get(best_owner, 0) + self.run_cost
+        for owner, entry in popped:
+            heapq.heappush(self.heaps.setdefault(owner, []), entry)
+        return runs
+
+    def remove_one(self, task_id: int) -> Optional[float]:
+        """移除任务最早入队的一次运行，返回其入队时间"""
+        task = self.tasks.get(task_id)
+        if task is None:
+            return None
+        group = task.groups[0]
+        enqueue_time = group[0]
+        group[1] -= 1
+        if group[1] == 0:
+            task.groups.popleft()
+        task.count -= 1
+        if task.count == 0:
+            del self.tasks[task_id]
+            self.deferred.pop(task_id, None)
+        self.size -= 1
+        return enqueue_time
+
+    def remove_task(self, task_id: int) -> int:
+        """移除任务的全部运行，返回移除的数量"""
+        task = self.tasks.pop(task_id, None)
+        self.deferred.pop(task_id, None)
+        if task is None:
+            return 0
+        self.size -= task.count
+        return task.count
+
+    def trim(self, task_id: int, count: int):
+        """把任务的待执行运行裁到至多count次，先裁最晚入队的"""
+        task = self.tasks.get(task_id)
+        if task is None or task.count <= count:
+            return
+        if count <= 0:
+            self.remove_task(task_id)
+            return
+        excess = task.count - count
+        while excess > 0:
+            group = task.groups[-1]
+            removed = min(group[1], excess)
+            group[1] -= removed
+            if group[1] == 0:
+                task.groups.pop()
+            excess -= removed
+        self.size -= task.count - count
+        task.count = count
+
+    def count(self, task_id: int) -> int:
+        task = self.tasks.get(task_id)
+        return task.count if task else 0
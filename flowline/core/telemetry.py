@@ -0,0 +1,348 @@
+try:
+    import pynvml
+    PYNVML_AVAILABLE = True
+except ImportError:
+    PYNVML_AVAILABLE = False
+
+import random
+import threading
+import time
+
+import psutil
+
+from flowline.config import config
+from flowline.utils import Log
+from .metrics import LoadSignal
+
+logger = Log(__name__)
+
+
+class GPU_info:
+    def __init__(self, free_memory, total_memory, utilization, all_process_num, name, temperature, power, max_power, process_memory=None):
+        self.free_memory = free_memory
+        self.total_memory = total_memory
+        self.utilization = utilization
+        self.user_process_num = 0
+        self.all_process_num = all_process_num
+        self.time = time.time()
+        self.name = name
+        self.temperature = temperature
+        self.power = power
+        self.max_power = max_power
+        self.process_memory = process_memory or {}  # {pid: used memory (MB)}, every process the backend can see
+        # filled in by GPU_Manager from the FlowLine run trees, until then everything counts as foreign
+        self.run_memory = {}  # {process_id: used memory (MB)} of FlowLine runs
+        self.user_memory = 0
+        self.foreign_memory = total_memory - free_memory
+        self.foreign_process_num = all_process_num
+        # filled in by GPUTelemetry from the recent samples of the GPU
+        self.utilization_ewma = utilization
+        self.utilization_p90 = utilization
+        self.free_memory_ewma = free_memory
+        self.free_memory_p10 = free_memory
+        
+    def to_dict(self):
+        return {
+            "free_memory": self.free_memory,
+            "total_memory": self.total_memory,
+            "utilization": self.utilization,
+            "user_process_num": self.user_process_num,
+            "all_process_num": self.all_process_num,
+            "foreign_process_num": self.foreign_process_num,
+            "user_memory": self.user_memory,
+            "foreign_memory": self.foreign_memory,
+            "utilization_ewma": self.utilization_ewma,
+            "utilization_p90": self.utilization_p90,
+            "free_memory_ewma": self.free_memory_ewma,
+            "free_memory_p10": self.free_memory_p10,
+            "name": self.name,
+            "temperature": self.temperature,
+            "power": self.power,
+            "max_power": self.max_power
+        }
+        
+def virtual_gpu_info(gpu_id):
+    # 模拟GPU信息用于非GPU环境
+    return GPU_info(free_memory=6144, total_memory=8192, utilization=0, all_process_num=0,
+                    name=f"Virtual GPU {gpu_id}", temperature=45, power=50, max_power=250)
+
+
+
+class TelemetryBackend:
+    """
+    source of GPU telemetry: open() once, then sample(gpu_id) for every GPU in each pass
+    on_process_start / on_process_end tell it about the jobs FlowLine launches, only the simulated backend uses them
+    """
+    name = None
+
+    def open(self) -> int:
+        """initialise the backend, return the number of GPUs"""
+        raise NotImplementedError
+
+    def sample(self, gpu_id: int) -> GPU_info:
+        raise NotImplementedError
+
+    def get_topology(self) -> dict:
+        return {}
+
+    def on_process_start(self, pid: int, gpu_ids: list, memory: float):
+        pass
+
+    def on_process_end(self, pid: int):
+        pass
+
+
+class VirtualBackend(TelemetryBackend):
+    """one static virtual GPU, used when nothing else is available"""
+    name = "virtual"
+
+    def open(self):
+        return 1
+
+    def sample(self, gpu_id):
+        return virtual_gpu_info(gpu_id)
+
+
+class NVMLBackend(TelemetryBackend):
+    """one NVML session shared by all GPUs, device handles and static fields (name, total memory, power limit) are cached"""
+    name = "nvml"
+
+    def __init__(self):
+        self.handles = []
+        self.static_info = []  # [(name, total memory (MB), max power (W))]
+
+    def open(self):
+        pynvml.nvmlInit()
+        for gpu_id in range(pynvml.nvmlDeviceGetCount()):
+            handle = pynvml.nvmlDeviceGetHandleByIndex(gpu_id)
+            gpu_name = pynvml.nvmlDeviceGetName(handle)
+            name = gpu_name.decode('utf-8') if isinstance(gpu_name, bytes) else gpu_name
+            total_memory = pynvml.nvmlDeviceGetMemoryInfo(handle).total / (1024 ** 2)
+            try:
+                max_power = pynvml.nvmlDeviceGetPowerManagementLimit(handle) / 1000
+            except pynvml.NVMLError as e:
+                if e.value == pynvml.NVML_ERROR_NOT_SUPPORTED:
+                    max_power = '?'
+                else:
+                    raise
+            self.handles.append(handle)
+            self.static_info.append((name, total_memory, max_power))
+        return len(self.handles)
+
+    def sample(self, gpu_id):
+        handle = self.handles[gpu_id]
+        name, total_memory, max_power = self.static_info[gpu_id]
+        memory_info = pynvml.nvmlDeviceGetMemoryInfo(handle)
+        utilization_info = pynvml.nvmlDeviceGetUtilizationRates(handle)
+        process_info = pynvml.nvmlDeviceGetComputeRunningProcesses(handle)
+        # keep every pid so all of them can be attributed, usedGpuMemory is None without per-process accounting
+        # (e.g. in a container or under MIG), such a process counts with 0 MB
+        process_memory = {}
+        for p in process_info:
+            process_memory[p.pid] = process_memory.get(p.pid, 0) + (p.usedGpuMemory or 0) / (1024 ** 2)
+        temperature = pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU)
+        power = pynvml.nvmlDeviceGetPowerUsage(handle) / 1000
+        return GPU_info(memory_info.free / (1024 ** 2), total_memory, utilization_info.gpu, len(process_memory),
+                        name, temperature, power, max_power, process_memory)
+
+    def get_topology(self):
+        """
+        distance between every pair of GPUs, {(gpu_id, gpu_id): distance}
+        0 for NVLink peers, otherwise the NVML topology level of the closest common ancestor
+        (same PCIe switch < multiple switches < host bridge < NUMA node < system), empty if unknown
+        """
+        handles = self.handles
+        topology = {}
+        try:
+            for i in range(len(handles)):
+                for j in range(i + 1, len(handles)):
+                    distance = pynvml.nvmlDeviceGetTopologyCommonAncestor(handles[i], handles[j])
+                    try:
+                        if pynvml.nvmlDeviceGetP2PStatus(handles[i], handles[j], pynvml.NVML_P2P_CAPS_INDEX_NVLINK) == pynvml.NVML_P2P_STATUS_OK:
+                            distance = 0
+                    except Exception:
+                        pass
+                    topology[(i, j)] = topology[(j, i)] = distance
+        except Exception as e:
+            logger.warning(f"Failed to get GPU topology: {e}")
+            return {}
+        return topology
+
+
+class PsutilBackend(TelemetryBackend):
+    """no GPU at all: the host is reported as one device, memory from RAM and utilization from CPU load"""
+    name = "psutil"
+
+    def open(self):
+        psutil.cpu_percent(None)
+        return 1
+
+    def sample(self, gpu_id):
+        memory = psutil.virtual_memory()
+        temperature = 0
+        try:
+            sensors = psutil.sensors_temperatures()
+            readings = [reading.current for readings in sensors.values() for reading in readings]
+            temperature = max(readings) if readings else 0
+        except (AttributeError, OSError):
+            pass
+        return GPU_info(memory.available / (1024 ** 2), memory.total / (1024 ** 2), psutil.cpu_percent(None), 0,
+                        "Host (psutil)", temperature, 0, '?')
+
+
+class SimulatedBackend(TelemetryBackend):
+    """
+    gpu_num simulated GPUs driven by the jobs FlowLine launches on them: the memory of a job ramps up
+    linearly to what was reserved for it over ramp_time and it adds job_utilization % once ramped,
+    both with relative gaussian noise from a seeded rng, so runs are reproducible on a CPU-only box
+    """
+    name = "simulated"
+
+    def __init__(self, gpu_num=None, total_memory=81920, ramp_time=30, job_utilization=60, noise=0.05, seed=0):
+        self.gpu_num = config.DEFAULT_SIMULATED_GPU_NUM if gpu_num is None else gpu_num
+        self.total_memory = total_memory
+        self.ramp_time = ramp_time
+        self.job_utilization = job_utilization
+        self.noise = noise
+        self.rng = random.Random(seed)
+        self.jobs = {}  # {pid: (gpu_ids, memory per GPU (MB), start time)}
+        self._lock = threading.Lock()
+
+    def open(self):
+        return self.gpu_num
+
+    def on_process_start(self, pid, gpu_ids, memory):
+        with self._lock:
+            self.jobs[pid] = (list(gpu_ids), memory, time.time())
+
+    def on_process_end(self, pid):
+        with self._lock:
+            self.jobs.pop(pid, None)
+
+    def _noisy(self, value):
+        return max(value * (1 + self.rng.gauss(0, self.noise)), 0)
+
+    def sample(self, gpu_id):
+        now = time.time()
+        with self._lock:
+            jobs = [(pid, memory, start_time) for pid, (gpu_ids, memory, start_time) in self.jobs.items() if gpu_id in gpu_ids]
+        process_memory, utilization = {}, 0
+        for pid, memory, start_time in jobs:
+            ramp = min((now - start_time) / self.ramp_time, 1) if self.ramp_time > 0 else 1
+            process_memory[pid] = self._noisy(memory * ramp)
+            utilization += self._noisy(self.job_utilization * ramp)
+        used_memory = min(sum(process_memory.values()), self.total_memory)
+        utilization = min(utilization, 100)
+        return GPU_info(self.total_memory - used_memory, self.total_memory, utilization, len(jobs),
+                        f"Simulated GPU {gpu_id}", 35 + utilization * 0.5, 60 + utilization * 2.4, 300, process_memory)
+
+
+TELEMETRY_BACKENDS = {
+    "virtual": VirtualBackend,
+    "nvml": NVMLBackend,
+    "psutil": PsutilBackend,
+    "simulated": SimulatedBackend,
+}
+
+
+def create_backend(name: str, **kwargs) -> TelemetryBackend:
+    """auto: NVML if pynvml is installed, otherwise the static virtual GPU"""
+    if name == "auto":
+        name = "nvml" if PYNVML_AVAILABLE else "virtual"
+    return TELEMETRY_BACKENDS[name](**kwargs)
+
+
+class GPUTelemetry:
+    """
+    one telemetry service for all GPUs: the backend is opened once and one thread samples every
+    device in a single pass per interval, each pass is published as a new snapshot {gpu_id: GPU_info}
+    so readers never see a half-updated set of GPUs
+    """
+    def __init__(self, interval, on_sample=None, backend: TelemetryBackend = None, annotate=None, smoothing_window=60):
+        """
+        annotate: called on every new GPU_info before the snapshot holding it is published
+        smoothing_window: seconds of samples behind the EWMA / percentile load signals of each GPU
+        """
+        self.interval = interval
+        self.on_sample = on_sample
+        self.annotate = annotate
+        self.backend = backend or create_backend("auto")
+        try:
+            self.gpu_count = self.backend.open()
+        except Exception as e:
+            logger.warning(f"Failed to open {self.backend.name} telemetry: {e}, falling back to virtual GPU")
+            self.backend = VirtualBackend()
+            self.gpu_count = self.backend.open()
+        self.smoothing_window = smoothing_window
+        self.signals = {}  # {gpu_id: (utilization LoadSignal, free memory LoadSignal)}
+        self.snapshot = {}
+        self.snapshot_time = 0
+        self._sample_lock = threading.Lock()
+        self._thread = None
+
+    def sample(self, gpu_ids=None):
+        """
+        sample all GPUs (or only gpu_ids) in one pass and publish the snapshot, a GPU that fails keeps its last info
+        snapshot_time only moves on full passes, so it is the age of the oldest info in the snapshot
+        """
+        with self._sample_lock:
+            snapshot = dict(self.snapshot)
+            sampled = range(self.gpu_count) if gpu_ids is None else gpu_ids
+            for gpu_id in sampled:
+                try:
+                    snapshot[gpu_id] = self.backend.sample(gpu_id)
+                except Exception as e:
+                    logger.error(f"Error sampling GPU {gpu_id}: {e}")
+                    snapshot[gpu_id] = self.snapshot.get(gpu_id) or virtual_gpu_info(gpu_id)
+                self._smooth(gpu_id, snapshot[gpu_id])
+                if self.annotate:
+                    self.annotate(snapshot[gpu_id])
+            self.snapshot = snapshot
+            if gpu_ids is None:
+                self.snapshot_time = time.time()
+        if self.on_sample:
+            self.on_sample({gpu_id: snapshot[gpu_id] for gpu_id in sampled})
+        return snapshot
+
+    def _smooth(self, gpu_id, info):
+        if gpu_id not in self.signals:
+            self.signals[gpu_id] = (LoadSignal(self.smoothing_window), LoadSignal(self.smoothing_window))
+        utilization, free_memory = self.signals[gpu_id]
+        utilization.add(info.time, info.utilization)
+        free_memory.add(info.time, info.free_memory)
+        info.utilization_ewma = utilization.ewma
+        info.utilization_p90 = utilization.percentile(90)
+        info.free_memory_ewma = free_memory.ewma
+        info.free_memory_p10 = free_memory.percentile(10)
+
+    def reset_free_memory(self, gpu_ids):
+        """drop the free memory history of gpu_ids, e.g. after a job on them ended, its freed memory is not noise"""
+        with self._sample_lock:
+            for gpu_id in gpu_ids:
+                if gpu_id in self.signals:
+                    self.signals[gpu_id] = (self.signals[gpu_id][0], LoadSignal(self.smoothing_window))
+
+    def set_smoothing_window(self, smoothing_window):
+        """takes effect on the next sample, the history of the signals is kept"""
+        with self._sample_lock:
+            self.smoothing_window = smoothing_window
+            for signals in self.signals.values():
+                for signal in signals:
+                    signal.window = smoothing_window
+
+    def get_age(self):
+        return time.time() - self.snapshot_time
+
+    def start(self):
+        """take the first snapshot synchronously, then keep sampling in the background"""
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"GPUTelemetry: sample failed: {e}")
@@ -1,87 +1,97 @@
 from .log import Log
 
 import signal
-import psutil
+import shlex
 import subprocess
 import os
 
 logger = Log(__name__)
 
         
+# the job runs in a subshell, the outer shell records its exit code in a file so that
+# a restarted FlowLine can still pick it up, TERM/INT/HUP are trapped (not ignored) so the
+# outer shell outlives a graceful kill of the group and still writes the file
+JOB_WRAPPER = """trap : TERM INT HUP
+(
+{cmd}
+)
+rc=$?
+echo $rc > {exit_path}.tmp && mv {exit_path}.tmp {exit_path}
+exit $rc
+"""
+
+
+def read_exit_status(exit_path):
+    """exit code from the exit file of a job, None if the job didn't get to write it"""
+    try:
+        with open(exit_path, 'r') as f:
+            return int(f.read().strip())
+    except (OSError, TypeError, ValueError):
+        return None
+
+
 class PopenProcess:
-    def __init__(self, result_queue, process_id, working_dir=None):
+    """
+    start cmd detached: a child in its own session / process group that survives FlowLine,
+    stdout/stderr go to log/{process_id}.out and log/{process_id}.err, exit code to log/{process_id}.exit
+    """
+    def __init__(self, process_id, working_dir=None):
         self.process_id = process_id
-        self.result_queue = result_queue
         self.working_dir = working_dir
         self.popen_process = None
+        self.pid = None
+        self.exited = False
+        self.stdout_path = os.path.abspath(f"log/{self.process_id}.out")
+        self.stderr_path = os.path.abspath(f"log/{self.process_id}.err")
+        self.exit_path = os.path.abspath(f"log/{self.process_id}.exit")
+
+    def start(self, cmd):
+        if not os.path.exists("log"):
+            os.makedirs("log")
+        
+        # O_APPEND, so the job keeps writing at the end after its output is rotated (copy-truncate)
+        with open(self.stdout_path, 'a', encoding='utf-8') as stdout_f, \
+             open(self.stderr_path, 'a', encoding='utf-8') as stderr_f:
+            self.popen_process = subprocess.Popen(
+                JOB_WRAPPER.format(cmd=cmd, exit_path=shlex.quote(self.exit_path)),
+                stdout=stdout_f,
+                stderr=stderr_f,
+                shell=True,
+                cwd=self.working_dir,
+                start_new_session=True,
+            )
+        self.pid = self.popen_process.pid
+        return self.pid
 
-    def fcb(self, cmd):
+    def attach(self, pid, stdout_path, stderr_path, exit_path):
+        """take over a job started by an earlier FlowLine, it is not our child so only signals and the exit file work"""
+        self.pid = pid
+        self.stdout_path = stdout_path
+        self.stderr_path = stderr_path
+        self.exit_path = exit_path
+        return self.pid
+
+    def on_exit(self, returncode):
+        """the job was reaped elsewhere (os.wait4) or has gone, record it so Popen never waits on it again"""
+        self.exited = True
+        if self.popen_process is not None:
+            self.popen_process.returncode = returncode
+
+    def read_exit_status(self):
+        return read_exit_status(self.exit_path)
+
+    def signal(self, sig):
+        """send sig to the whole process group of the job"""
+        if self.exited:
+            # already gone, the pid may belong to someone else by now
+            return
         try:
-            signal.signal(signal.SIGTERM, self._handle_terminate)
-            
-            stdout_file = f"log/{self.process_id}.out"
-            stderr_file = f"log/{self.process_id}.err"
-            if not os.path.exists("log"):
-                os.makedirs("log")
-            
-            with open(stdout_file, 'w', encoding='utf-8') as stdout_f, \
-                 open(stderr_file, 'w', encoding='utf-8') as stderr_f:
-                self.popen_process = subprocess.Popen(
-                    cmd,
-                    stdout=stdout_f,
-                    stderr=stderr_f,
-                    shell=True,
-                    cwd=self.working_dir,
-                )
-                self.popen_process.wait()
-            
-            _, stderr = self.popen_process.communicate()
-            returncode = self.popen_process.returncode
-            logger.info(f"Process {self.process_id} finished with return code {returncode}")
-            if returncode == 0:
-                self.result_queue.put((True, None))
-            else:
-                self.result_queue.put((False, stderr))
-        except Exception as e:
-            logger.error(f"Process {self.process_id} failed: {e}")
-            self.result_queue.put((False, str(e)))
+            os.killpg(self.pid, sig)
+        except ProcessLookupError:
+            pass
 
-    def _handle_terminate(self, signum, frame):
-        # print("process terminated", signum)
-        proc_pid = self.popen_process.pid
-        process = psutil.Process(proc_pid)
-        for proc in process.children(recursive=True):
-            proc.kill()
-        process.kill()
-        
-if __name__ == "__main__":
-    import multiprocessing
-    import time
-        
-    result_queue = multiprocessing.Queue()
+    def terminate(self):
+        self.signal(signal.SIGTERM)
 
-    cmd_a = "CUDA_VISIBLE_DEVICES=4 python test.py --test a"
-    cmd_b = "CUDA_VISIBLE_DEVICES=5 python -u test.py --test b"
-    
-    proc_a = multiprocessing.Process(target=PopenProcess(result_queue, 0).fcb, args=(cmd_a,))
-    proc_b = multiprocessing.Process(target=PopenProcess(result_queue, 1).fcb, args=(cmd_b,))
-    
-    proc_a.start()
-    proc_b.start()
-    
-    time.sleep(3)
-    
-    while True:
-        time.sleep(1)
-        if proc_a.is_alive():
-            print("proc_a is alive")
-        else:
-            print("proc_a is dead")
-        if proc_b.is_alive():
-            print("proc_b is alive")
-        else:
-            print("proc_b is dead")
-        if result_queue.empty():
-            print("result_queue is empty")
-        else:
-            print("result_queue is not empty")
+    def kill(self):
+        self.signal(signal.SIGKILL)
@@ -0,0 +1,90 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+from flowline.core.gpu import GPU_Manager
+from flowline.core.process import ProcessStatus
+from flowline.core.telemetry import GPU_info, SimulatedBackend
+
+
+@pytest.fixture
+def gpu_manager():
+    return GPU_Manager([0], backend=SimulatedBackend(gpu_num=1))
+
+
+def gpu_info(process_memory, all_process_num=None, free_memory=60000):
+    all_process_num = len(process_memory) if all_process_num is None else all_process_num
+    return GPU_info(free_memory, 81920, 0, all_process_num, "GPU", 40, 100, 300, process_memory)
+
+
+def test_jobs_without_memory_accounting_are_ours(gpu_manager):
+    child = subprocess.Popen(["sleep", "30"])
+    try:
+        gpu_manager.update_user_process(7, os.getpid(), ProcessStatus.RUNNING)
+        # without per-process accounting NVML reports our job and its child with 0 MB
+        info = gpu_info({os.getpid(): 0, child.pid: 0})
+        gpu_manager._attribute(info)
+        assert (info.user_process_num, info.foreign_process_num) == (2, 0)
+        assert info.run_memory == {7: 0}
+        info = gpu_info({os.getpid(): 0, 1: 0})
+        gpu_manager._attribute(info)
+        assert (info.user_process_num, info.foreign_process_num) == (1, 1)
+        # a process counted without a pid can't be ours
+        info = gpu_info({os.getpid(): 0}, all_process_num=2)
+        gpu_manager._attribute(info)
+        assert info.foreign_process_num == 1
+    finally:
+        child.kill()
+        child.wait()
+
+
+def sample(gpu_manager):
+    time.sleep(0.01)  # samples at the same time are ignored by the load signals
+    gpu_manager.telemetry.sample()
+
+
+def test_placement_uses_the_low_end_of_free_memory():
+    gpu_manager = GPU_Manager([0], backend=SimulatedBackend(gpu_num=1, ramp_time=0, noise=0))
+    backend = gpu_manager.telemetry.backend
+    # a foreign process on the GPU frees its memory for a moment
+    backend.on_process_start(1, [0], 50000)
+    sample(gpu_manager)
+    backend.on_process_end(1)
+    sample(gpu_manager)
+    assert gpu_manager.get_gpu_slots(flash=False)[0].free_memory == 81920 - 50000
+
+
+def test_memory_of_an_ended_run_is_free_right_away():
+    gpu_manager = GPU_Manager([0], backend=SimulatedBackend(gpu_num=1, ramp_time=0, noise=0))
+    gpu_manager.reserve_memory(5, [0], 50000)
+    gpu_manager.update_user_process(5, 4321, ProcessStatus.RUNNING)
+    gpu_manager.on_process_start(5, 4321)
+    sample(gpu_manager)
+    # ramped up, the reservation is gone
+    assert gpu_manager.get_gpu_slots(flash=False)[0].free_memory == 81920 - 50000
+    assert gpu_manager.reservations == {}
+    gpu_manager.release_memory(5, 4321)
+    gpu_manager.update_user_process(5, 4321, ProcessStatus.COMPLETED)
+    time.sleep(0.01)
+    assert gpu_manager.get_gpu_slots()[0].free_memory == 81920
+
+
+def run_info(process_id, memory, t):
+    info = gpu_info({})
+    info.run_memory, info.time = {process_id: memory}, t
+    return info
+
+
+def test_estimated_reservation_is_released_once_memory_levels_off(gpu_manager):
+    gpu_manager.set_min_process_memory(10000)
+    gpu_manager.reserve_memory(5, [0], None)
+    gpu_manager.reserve_memory(6, [0], 10000)
+    assert gpu_manager._reserved_memory(0, run_info(5, 0, 1)) == 20000
+    assert gpu_manager._reserved_memory(0, run_info(5, 1000, 2)) == 19000
+    # task 5 didn't set need_memory and its job stays at 2000 MB, task 6 asked for 10000 MB
+    assert gpu_manager._reserved_memory(0, run_info(5, 2000, 3)) == 18000
+    assert gpu_manager._reserved_memory(0, run_info(5, 2000, 3)) == 18000
+    assert gpu_manager._reserved_memory(0, run_info(5, 2000, 4)) == 10000
+    assert list(gpu_manager.reservations) == [(6, 0)]
@@ -0,0 +1,77 @@
+from flowline.core.output import OutputStream, list_segments, read_output, tail_lines
+
+
+def write_lines(path, start, num):
+    with open(path, "a") as f:
+        for i in range(start, start + num):
+            f.write(f"line {i}\n")
+
+
+def read_all(path, limit=100):
+    data, offset = "", 0
+    while True:
+        output = read_output(path, offset, limit)
+        if not output["data"]:
+            return data
+        data += output["data"]
+        offset = output["next_offset"]
+
+
+def rotate(stream, rotate_size, max_segments):
+    segment = stream.poll(rotate_size)
+    if segment is not None:
+        stream.finish_rotate(segment, max_segments)
+
+
+def test_read_output_across_segments(tmp_path):
+    path = str(tmp_path / "1.out")
+    stream = OutputStream(path, ring_lines=5)
+    for start in range(0, 300, 50):
+        write_lines(path, start, 50)
+        rotate(stream, rotate_size=1000, max_segments=100)
+    assert len(list_segments(path)) > 1
+    assert read_all(path).splitlines() == [f"line {i}" for i in range(300)]
+    assert stream.tail(2) == ["line 298", "line 299"]
+    assert tail_lines(path, 3) == ["line 297", "line 298", "line 299"]
+
+
+def test_read_output_offsets(tmp_path):
+    path = str(tmp_path / "1.out")
+    stream = OutputStream(path, ring_lines=5)
+    write_lines(path, 0, 100)
+    rotate(stream, rotate_size=100, max_segments=10)
+    write_lines(path, 100, 10)
+    whole = read_all(path)
+    output = read_output(path, 500, 20)
+    assert output["data"] == whole[500:520]
+    assert output["next_offset"] == 520
+    assert output["size"] == len(whole)
+    assert not output["truncated"]
+
+
+def test_pruned_segments_are_reported_truncated(tmp_path):
+    path = str(tmp_path / "1.out")
+    stream = OutputStream(path, ring_lines=5)
+    for start in range(0, 400, 100):
+        write_lines(path, start, 100)
+        rotate(stream, rotate_size=100, max_segments=2)
+    segments = list_segments(path)
+    assert len(segments) == 2
+    output = read_output(path, 0, 10)
+    assert output["truncated"]
+    assert output["offset"] == segments[0][0]
+
+
+def test_bytes_written_before_the_rotation_are_kept(tmp_path):
+    path = str(tmp_path / "1.out")
+    stream = OutputStream(path, ring_lines=5)
+    write_lines(path, 0, 100)
+    stream.poll(rotate_size=10 ** 9)
+    write_lines(path, 100, 5)  # written after the last poll, before the rotation reads the file
+    segment = stream.rotate()
+    write_lines(path, 105, 5)  # written while the segment is still raw
+    assert read_all(path).splitlines() == [f"line {i}" for i in range(110)]
+    stream.finish_rotate(segment, max_segments=10)
+    assert [segment_path.endswith(".raw") for _, _, segment_path in list_segments(path)] == [False]
+    assert read_all(path).splitlines() == [f"line {i}" for i in range(110)]
+    assert stream.tail(1) == ["line 104"]
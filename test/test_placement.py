@@ -0,0 +1,49 @@
+from flowline.core.placement import GPUSlot, choose_group, pack_key, place_one, spread_key
+
+
+def slots():
+    return [GPUSlot(0, 8000, 10, 4), GPUSlot(1, 20000, 50, 4), GPUSlot(2, 30000, 0, 4, shared=True)]
+
+
+def test_spread_takes_the_least_loaded_gpu_first():
+    gpus = slots()
+    assert place_one(gpus, 5000, 1, spread_key) == [0]
+    # gpu 0 got a process in this pass, the next one goes elsewhere
+    assert place_one(gpus, 1000, 1, spread_key) == [1]
+
+
+def test_pack_takes_the_fullest_gpu_that_fits():
+    gpus = slots()
+    assert place_one(gpus, 5000, 1, pack_key) == [0]
+    assert place_one(gpus, 1000, 1, pack_key) == [0]
+    assert place_one(gpus, 5000, 1, pack_key) == [1]
+
+
+def test_shared_gpu_is_taken_last():
+    gpus = slots()
+    assert place_one(gpus, 25000, 1, spread_key) == [2]
+    gpus = slots()
+    assert place_one(gpus, 5000, 2, spread_key) == [0, 1]
+    assert place_one(gpus, 5000, 2, spread_key) == [1, 2]
+
+
+def test_place_one_takes_capacity():
+    gpus = [GPUSlot(0, 10000, 0, 2)]
+    assert place_one(gpus, 6000, 1, spread_key) == [0]
+    assert (gpus[0].free_memory, gpus[0].free_slots, gpus[0].placed_num) == (4000, 1, 1)
+    assert place_one(gpus, 6000, 1, spread_key) is None
+    assert place_one(gpus, 1000, 1, spread_key) == [0]
+    assert place_one(gpus, 1000, 1, spread_key) is None  # out of slots
+    assert place_one(gpus, 1000, 2, spread_key) is None
+
+
+def test_choose_group_prefers_close_gpus():
+    gpus = [GPUSlot(i, 10000, 0, 1) for i in range(4)]
+    # 0-1 and 2-3 share a switch
+    topology = {(a, b): 1 if a // 2 == b // 2 else 2 for a in range(4) for b in range(4) if a != b}
+    ordered = [gpus[1], gpus[2], gpus[3], gpus[0]]
+    assert [gpu.gpu_id for gpu in choose_group(ordered, 2, topology)] == [1, 0]
+    assert [gpu.gpu_id for gpu in choose_group(ordered, 2)] == [1, 2]
+    assert choose_group(ordered, 5, topology) is None
+    assert place_one(gpus, 1000, 2, spread_key, topology) == [0, 1]
+    assert place_one(gpus, 1000, 2, spread_key, topology) == [2, 3]
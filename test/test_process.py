@@ -0,0 +1,54 @@
+import queue
+import subprocess
+
+import pytest
+
+from flowline.core.process import ProcessReaper
+
+
+@pytest.fixture(params=["pidfd", "poll"])
+def reaper(request):
+    """the pidfd selector, and the wait4 polling used without pidfd"""
+    exits = queue.Queue()
+    reaper = ProcessReaper(lambda pid, returncode, rusage: exits.put((pid, returncode, rusage)), 0.05)
+    if request.param == "poll":
+        reaper.use_pidfd = False
+    elif not reaper.use_pidfd:
+        pytest.skip("no pidfd on this platform")
+    reaper.exits = exits
+    return reaper
+
+
+def spawn(cmd):
+    # the reaper waits for it, Popen must not: its returncode stays unset
+    return subprocess.Popen(["sh", "-c", cmd])
+
+
+@pytest.mark.parametrize("cmd, returncode", [("exit 0", 0), ("exit 3", 3), ("kill -9 $$", -9)])
+def test_reaper_reports_the_exit_code(reaper, cmd, returncode):
+    job = spawn(cmd)
+    reaper.watch(job.pid)
+    pid, code, rusage = reaper.exits.get(timeout=10)
+    assert (pid, code) == (job.pid, returncode)
+    assert rusage is not None
+    assert job.pid not in reaper.pids
+
+
+def test_reaper_survives_a_pid_that_is_gone(reaper):
+    gone = spawn("true")
+    gone.wait()
+    reaper.watch(gone.pid)
+    # no wait status for it, the caller falls back to the exit file
+    assert reaper.exits.get(timeout=10) == (gone.pid, None, None)
+    job = spawn("exit 2")
+    reaper.watch(job.pid)
+    assert reaper.exits.get(timeout=10)[:2] == (job.pid, 2)
+    assert reaper._thread.is_alive()
+
+
+def test_reaper_runs_timers(reaper):
+    fired = queue.Queue()
+    reaper.call_later(0.1, lambda: fired.put(True))
+    reaper.call_later(0, lambda: 1 / 0)  # a failing callback doesn't stop the others
+    assert fired.get(timeout=10)
+    assert reaper._thread.is_alive()
@@ -0,0 +1,187 @@
+import os
+import time
+
+import psutil
+import pytest
+
+from flowline.config import config
+from flowline.core import ProgramManager
+from flowline.core.process import ProcessStatus
+from flowline.core.task import TaskManager
+from flowline.utils import PopenProcess
+
+
+@pytest.fixture
+def make_program(tmp_path, monkeypatch):
+    """ProgramManager on two simulated GPUs, jobs and their logs live in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "DEFAULT_TELEMETRY_BACKEND", "simulated")
+    monkeypatch.setattr(config, "DEFAULT_SIMULATED_GPU_NUM", 2)
+
+    def make(func=lambda config_dict, gpu_id: "true"):
+        return ProgramManager(func, str(tmp_path / "tasks.db"))
+    return make
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def counts(program, task_id):
+    task = program.task_manager.get_task_by_id(task_id).get_dict()
+    return task["run_num"], task["claimed_num"], task["running_num"], task["pending_num"]
+
+
+def test_user_func_failure_gives_the_claim_back(make_program):
+    def func(config_dict, gpu_id):
+        if config_dict.get("broken"):
+            raise RuntimeError("bad config")
+        return "sleep 0.2"
+
+    program = make_program(func)
+    broken = program.create_task("broken", "", 1, {"broken": True}, need_memory=100)
+    ok = program.create_task("ok", "", 2, {}, need_memory=100)
+    program.new_process()
+    assert counts(program, broken) == (0, 0, 0, 1)
+    assert program.task_manager.task_ids.count(broken) == 1
+    assert program.task_manager.get_runs(broken) == []
+    wait_for(lambda: counts(program, ok)[0] == 2)
+    assert program.task_manager.fair_share.running_gpus["default"] == 0
+
+
+def test_batch_is_unclaimed_when_a_start_fails(make_program, monkeypatch):
+    program = make_program()
+    task_ids = [program.create_task(f"t{i}", "", 1, {}, need_memory=100) for i in range(3)]
+
+    def start_process(task, gpu_ids, backfill=False, claimed=False):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(program, "start_process", start_process)
+    with pytest.raises(RuntimeError):
+        program.new_process()
+    # the first run was handed to start_process, the two after it were never started
+    assert [counts(program, task_id)[1] for task_id in task_ids] == [1, 0, 0]
+    assert all(program.task_manager.task_ids.count(task_id) == 1 for task_id in task_ids[1:])
+
+
+def test_failing_task_is_retried_with_backoff(make_program, monkeypatch):
+    monkeypatch.setattr(config, "DEFAULT_RETRY_DELAY", 0.5)
+    program = make_program(lambda config_dict, gpu_id: "exit 1")
+    task_id = program.create_task("failing", "", 100, {}, need_memory=100)
+    program.start_process_loop()
+    time.sleep(2)
+    program.switch_run()
+    # runs at about 0, 0.5 and 1.5 s, without a backoff it respawns dozens of times a second
+    runs = program.task_manager.get_runs(task_id)
+    assert 2 <= len(runs) <= 4
+    assert all(run["status"] == ProcessStatus.FAILED for run in runs)
+
+
+def start_detached_run(db_path, cmd, status=ProcessStatus.RUNNING):
+    """a run left by an earlier FlowLine: its job is running detached and recorded in the runs table"""
+    task_manager = TaskManager(db_path)
+    task_id = task_manager.create_task("t", cmd)
+    task_manager.claim_task(task_id)
+    run_id = task_manager.start_run(task_id, [0], cmd, ProcessStatus.PENDING)
+    job = PopenProcess(run_id)
+    pid = job.start(cmd)
+    task_manager.update_run(run_id, status=ProcessStatus.RUNNING, pid=pid, pid_create_time=psutil.Process(pid).create_time(),
+                            stdout_path=job.stdout_path, stderr_path=job.stderr_path, exit_path=job.exit_path)
+    if status != ProcessStatus.RUNNING:
+        task_manager.update_run(run_id, status=status)
+    task_manager.engine.dispose()
+    return task_id, run_id, job
+
+
+def test_killing_is_persisted(make_program):
+    program = make_program(lambda config_dict, gpu_id: "trap '' TERM; sleep 30")
+    task_id = program.create_task("t", "", 1, {}, need_memory=100)
+    program.new_process()
+    run = program.task_manager.get_runs(task_id)[0]
+    wait_for(lambda: program.task_manager.get_run(run["run_id"])["status"] == ProcessStatus.RUNNING)
+    assert program.kill_process(run["run_id"], grace_period=0.5)
+    assert program.task_manager.get_run(run["run_id"])["status"] == ProcessStatus.KILLING
+    wait_for(lambda: program.task_manager.get_run(run["run_id"])["status"] == ProcessStatus.KILLED)
+
+
+@pytest.mark.parametrize("cmd, status, returncode", [("true", ProcessStatus.COMPLETED, 0), ("exit 3", ProcessStatus.FAILED, 3)])
+def test_reattach_run_finished_while_down(make_program, tmp_path, cmd, status, returncode):
+    """the job ended while FlowLine was stopped, its exit code is read from the exit file"""
+    task_id, run_id, job = start_detached_run(str(tmp_path / "tasks.db"), cmd)
+    wait_for(lambda: os.path.exists(job.exit_path))
+    program = make_program()
+    run = program.task_manager.get_run(run_id)
+    assert (run["status"], run["returncode"]) == (status, returncode)
+    assert counts(program, task_id) == ((1, 0, 0, 0) if status == ProcessStatus.COMPLETED else (0, 0, 0, 1))
+
+
+def test_reattach_running_run(make_program, tmp_path):
+    """the job outlived FlowLine, it is adopted and its exit code read from the exit file once it ends"""
+    task_id, run_id, job = start_detached_run(str(tmp_path / "tasks.db"), "sleep 1; exit 4")
+    program = make_program()
+    assert program.task_manager.get_run(run_id)["status"] == ProcessStatus.RUNNING
+    assert counts(program, task_id) == (0, 0, 1, 0)
+    wait_for(lambda: program.task_manager.get_run(run_id)["status"] == ProcessStatus.FAILED)
+    assert program.task_manager.get_run(run_id)["returncode"] == 4
+
+
+def test_reattach_run_killed_while_down(make_program, tmp_path):
+    """the kill was under way when FlowLine stopped and the job exited before the restart"""
+    task_id, run_id, job = start_detached_run(str(tmp_path / "tasks.db"), "sleep 30", ProcessStatus.KILLING)
+    job.terminate()
+    wait_for(lambda: os.path.exists(job.exit_path))
+    program = make_program()
+    run = program.task_manager.get_run(run_id)
+    assert run["status"] == ProcessStatus.KILLED
+    assert run["returncode"] != 0
+    assert counts(program, task_id) == (0, 0, 0, 1)
+    assert program.task_manager.task_ids.count(task_id) == 1
+
+
+def test_reattached_kill_escalates_to_sigkill(make_program, monkeypatch, tmp_path):
+    """the job ignores SIGTERM and was in its grace period when FlowLine stopped"""
+    monkeypatch.setattr(config, "DEFAULT_KILL_GRACE_PERIOD", 0.5)
+    task_id, run_id, job = start_detached_run(str(tmp_path / "tasks.db"), "trap '' TERM; sleep 30", ProcessStatus.KILLING)
+    program = make_program()
+    assert program.task_manager.get_run(run_id)["status"] == ProcessStatus.KILLING
+    wait_for(lambda: program.task_manager.get_run(run_id)["status"] == ProcessStatus.KILLED)
+    assert not psutil.pid_exists(job.pid) or psutil.Process(job.pid).status() == psutil.STATUS_ZOMBIE
+    assert program.task_manager.task_ids.count(task_id) == 1
+
+
+def test_head_of_the_queue_is_placed_first(make_program):
+    program = make_program(lambda config_dict, gpu_id: "sleep 30")
+    head = program.create_task("head", "", 1, {}, need_memory=60000)
+    # larger in total, placing it first would leave no GPU with room for the head
+    wide = program.create_task("wide", "", 1, {}, need_memory=50000, need_gpu_num=2)
+    program.switch_gpu(1)
+    program.new_process()
+    try:
+        assert counts(program, head)[1:3] in [(1, 0), (0, 1)]
+        assert counts(program, wide) == (0, 0, 0, 1)
+    finally:
+        program.kill_process_by_task(head, grace_period=0)
+
+
+def test_reservation_is_released_when_the_run_ends(make_program):
+    program = make_program(lambda config_dict, gpu_id: "true")
+    task_id = program.create_task("t", "", 1, {}, need_memory=100)
+    program.new_process()
+    wait_for(lambda: counts(program, task_id)[0] == 1)
+    # the run is recorded and the memory released by two callbacks of the same exit
+    wait_for(lambda: program.gpu_manager.reservations == {} and program.gpu_manager.telemetry.backend.jobs == {})
+
+
+def test_reservation_is_released_when_the_launch_fails(make_program, monkeypatch):
+    program = make_program()
+    task_id = program.create_task("t", "", 1, {}, need_memory=100)
+
+    def add_process(*args):
+        raise OSError("no such working dir")
+    monkeypatch.setattr(program.process_manager, "add_process", add_process)
+    program.new_process()
+    assert program.gpu_manager.reservations == {}
+    assert counts(program, task_id) == (0, 0, 0, 1)
+    assert program.task_manager.get_runs(task_id)[0]["status"] == ProcessStatus.FAILED
@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from flowline.core.sweep import PointRanges, SweepSpec, expand_sweep, format_name, sweep_task_num
+
+
+def test_product_last_param_varies_fastest():
+    spec = SweepSpec({"lr": [1, 2], "seed": [7, 8, 9]}, base={"epochs": 3})
+    assert len(spec) == 6
+    assert list(spec)[:4] == [{"epochs": 3, "lr": 1, "seed": 7}, {"epochs": 3, "lr": 1, "seed": 8},
+                              {"epochs": 3, "lr": 1, "seed": 9}, {"epochs": 3, "lr": 2, "seed": 7}]
+
+
+def test_zip():
+    spec = SweepSpec.from_dict({"mode": "zip", "params": {"a": [1, 2, 3], "b": ["x", "y", "z"]}})
+    assert list(spec) == [{"a": 1, "b": "x"}, {"a": 2, "b": "y"}, {"a": 3, "b": "z"}]
+    with pytest.raises(ValueError):
+        SweepSpec({"a": [1, 2], "b": [1]}, mode="zip")
+
+
+def test_random_sample_is_reproducible_subset():
+    params = {"a": list(range(10)), "b": list(range(10))}
+    spec = SweepSpec(params, mode="random", num=15, seed=3)
+    points = list(spec)
+    assert len(points) == 15
+    assert points == list(SweepSpec(params, mode="random", num=15, seed=3))
+    assert len({(p["a"], p["b"]) for p in points}) == 15
+    with pytest.raises(ValueError):
+        SweepSpec(params, mode="random", num=101)
+
+
+def test_invalid_spec():
+    with pytest.raises(ValueError):
+        SweepSpec({})
+    with pytest.raises(ValueError):
+        SweepSpec({"a": []})
+    with pytest.raises(ValueError):
+        SweepSpec({"a": [1]}, mode="grid")
+    with pytest.raises(IndexError):
+        SweepSpec({"a": [1]})[1]
+
+
+def test_expand_sweep():
+    sweep = {"name": "run-{lr}", "cmd": "python train.py", "need_gpu_num": 2, "params": {"lr": [1, 2]}}
+    tasks = expand_sweep(sweep)
+    assert [(t["name"], t["config_dict"], t["need_gpu_num"]) for t in tasks] == [("run-1", {"lr": 1}, 2), ("run-2", {"lr": 2}, 2)]
+    assert sweep_task_num(sweep) == 2
+    assert sweep_task_num({"mode": "random", "num": 5, "params": {"a": list(range(10))}}) == 5
+    assert format_name("grid", {"lr": 1}, 4) == "grid-4"
+    assert format_name("grid-{missing}", {"lr": 1}, 4) == "grid-{missing}-4"
+
+
+def test_lazy_sweep_is_one_task():
+    sweep = {"name": "grid", "cmd": "python train.py", "params": {"lr": [1, 2, 3]}, "lazy": True}
+    tasks = expand_sweep(sweep)
+    assert len(tasks) == 1
+    assert tasks[0]["task_type"] == "sweep" and tasks[0]["need_run_num"] == 3
+    assert tasks[0]["config_dict"] == {"params": {"lr": [1, 2, 3]}}
+    assert sweep_task_num(sweep) == 1
+    with pytest.raises(ValueError):
+        expand_sweep(dict(sweep, need_run_num=2))
+
+
+def test_point_ranges_match_a_set():
+    rng = random.Random(0)
+    ranges, points = PointRanges(), set()
+    for _ in range(2000):
+        if rng.random() < 0.7:
+            i = rng.randrange(200)
+            ranges.add(i)
+            points.add(i)
+        else:
+            popped = ranges.pop()
+            assert popped == (min(points) if points else None)
+            points.discard(popped)
+        assert len(ranges) == len(points)
+        # sorted, disjoint and never adjacent, adjacent ranges are merged
+        assert all(start < end for start, end in ranges.ranges)
+        assert all(a[1] < b[0] for a, b in zip(ranges.ranges, ranges.ranges[1:]))
+    assert all((i in ranges) == (i in points) for i in range(200))
+    assert PointRanges(ranges.to_list()).to_list() == ranges.to_list()
+
+
+def test_point_ranges_merge():
+    ranges = PointRanges()
+    for i in [0, 1, 3, 4, 2]:
+        ranges.add(i)
+    assert ranges.to_list() == [[0, 5]]
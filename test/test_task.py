@@ -0,0 +1,111 @@
+import pytest
+
+from flowline.core.process import ProcessStatus
+from flowline.core.task import TaskManager
+
+
+def counts(task_manager, task_id):
+    """(run_num, claimed_num, running_num, pending_num) of a task"""
+    task = next(t for t in task_manager.get_task_dict() if t["task_id"] == task_id)
+    return task["run_num"], task["claimed_num"], task["running_num"], task["pending_num"]
+
+
+@pytest.fixture(params=["returning", "fallback"])
+def task_manager(request, tmp_path):
+    """both the UPDATE/INSERT ... RETURNING path and the one for SQLite before 3.35"""
+    task_manager = TaskManager(str(tmp_path / "tasks.db"))
+    if request.param == "fallback":
+        task_manager.engine.dialect.update_returning = task_manager.engine.dialect.insert_returning = False
+    return task_manager
+
+
+def test_claim_tasks(task_manager):
+    (a, b, c), _ = task_manager.create_tasks([{"cmd": "a", "need_run_num": 2}, {"cmd": "b"}, {"cmd": "c"}])
+    # b is claimed twice but has one run: both claims of b fail, the others go through
+    assert task_manager.claim_tasks([(a, False), (a, False), (b, False), (b, False), (c, True)]) == [True, True, False, False, True]
+    assert counts(task_manager, a) == (0, 2, 0, 0)
+    assert counts(task_manager, b) == (0, 0, 0, 1)
+    assert counts(task_manager, c) == (0, 1, 0, 0)
+    assert not task_manager.claim_task(a)
+    assert [task.task_id for task in task_manager.peek_tasks(10)] == [b]
+    assert task_manager.get_queue_stats()["backfilled_num"] == 1
+
+
+def test_run_counters(task_manager):
+    task_id = task_manager.create_task("t", "cmd", need_run_num=2)
+    for status in [ProcessStatus.FAILED, ProcessStatus.COMPLETED]:
+        assert task_manager.claim_task(task_id)
+        run_id = task_manager.start_run(task_id, [0], "cmd", ProcessStatus.PENDING)
+        assert counts(task_manager, task_id) == (0, 1, 0, 1)
+        task_manager.update_run(run_id, status=ProcessStatus.RUNNING, pid=1)
+        assert counts(task_manager, task_id) == (0, 0, 1, 1)
+        task_manager.finish_run(run_id, status, 1, {})
+        task_manager.put_task_ids(task_id) if status == ProcessStatus.FAILED else task_manager.update_task_ids([task_id])
+    # the failed run became pending again, the completed one counts
+    assert counts(task_manager, task_id) == (1, 0, 0, 1)
+    assert task_manager.claim_task(task_id)
+    run_id = task_manager.start_run(task_id, [0], "cmd", ProcessStatus.PENDING)
+    task_manager.finish_run(run_id, ProcessStatus.COMPLETED, 0, {})
+    assert counts(task_manager, task_id) == (2, 0, 0, 0)
+
+
+def test_unclaim(task_manager):
+    task_id = task_manager.create_task("t", "cmd")
+    assert task_manager.claim_task(task_id)
+    task_manager.put_task_ids(task_id, unclaim=True)
+    assert counts(task_manager, task_id) == (0, 0, 0, 1)
+    assert task_manager.task_ids.count(task_id) == 1
+    assert task_manager.fair_share.running_gpus[task_manager.task_meta[task_id][1]] == 0
+
+
+def test_restart_recomputes_counts_from_runs(tmp_path):
+    db_path = str(tmp_path / "tasks.db")
+    task_manager = TaskManager(db_path)
+    leaked = task_manager.create_task("leaked", "cmd", need_run_num=2)
+    running = task_manager.create_task("running", "cmd")
+    # claims whose runs were never recorded, e.g. FlowLine stopped in between
+    assert task_manager.claim_tasks([(leaked, False), (leaked, False)]) == [True, True]
+    assert task_manager.claim_task(running)
+    run_id = task_manager.start_run(running, [0], "cmd", ProcessStatus.PENDING)
+    task_manager.update_run(run_id, status=ProcessStatus.RUNNING)
+    task_manager.engine.dispose()
+
+    task_manager = TaskManager(db_path)
+    assert counts(task_manager, leaked) == (0, 0, 0, 2)
+    assert counts(task_manager, running) == (0, 0, 1, 0)
+    assert task_manager.task_ids.count(leaked) == 2
+
+
+def test_lazy_sweep_points(tmp_path):
+    task_manager = TaskManager(str(tmp_path / "tasks.db"))
+    sweep = {"name": "grid", "cmd": "python train.py", "task_type": "sweep", "need_run_num": 3,
+             "config_dict": {"params": {"lr": [1, 2, 3]}}}
+    (task_id,), _ = task_manager.create_tasks([sweep])
+    points = []
+    for i in range(4):
+        assert task_manager.claim_task(task_id)
+        point, config_dict = task_manager.next_point(task_id)
+        assert config_dict == {"lr": point + 1}
+        points.append(point)
+        run_id = task_manager.start_run(task_id, [0], "python train.py", ProcessStatus.PENDING, point)
+        # the first run fails, its point is handed out again before the cursor moves on
+        task_manager.finish_run(run_id, ProcessStatus.FAILED if i == 0 else ProcessStatus.COMPLETED, 1, {})
+        task_manager.put_task_ids(task_id) if i == 0 else task_manager.update_task_ids([task_id])
+    assert points == [0, 0, 1, 2]
+    task = task_manager.get_task_dict()[0]
+    assert (task["run_num"], task["point_cursor"], task["retry_point_num"], task["status"]) == (3, 3, 0, "COMPLETED")
+    assert not task_manager.claim_task(task_id)
+
+
+def test_status_filter_matches_status(task_manager):
+    (pending, partly_running, claimed, completed), _ = task_manager.create_tasks(
+        [{"cmd": "a"}, {"cmd": "b", "need_run_num": 2}, {"cmd": "c"}, {"cmd": "d"}])
+    assert task_manager.claim_tasks([(partly_running, False), (claimed, False), (completed, False)]) == [True, True, True]
+    run_id = task_manager.start_run(partly_running, [0], "b", ProcessStatus.PENDING)
+    task_manager.update_run(run_id, status=ProcessStatus.RUNNING)
+    run_id = task_manager.start_run(completed, [0], "d", ProcessStatus.PENDING)
+    task_manager.finish_run(run_id, ProcessStatus.COMPLETED, 0, {})
+    for status, task_ids in [("PENDING", [pending, claimed]), ("RUNNING", [partly_running]), ("COMPLETED", [completed])]:
+        tasks = task_manager.get_task_dict(status=status)
+        assert [task["task_id"] for task in tasks] == task_ids
+        assert all(task["status"] == status for task in tasks)
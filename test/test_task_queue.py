@@ -0,0 +1,139 @@
+import random
+import time
+
+from flowline.core.task_queue import FairShare, TaskQueue
+
+RUN_COST = 1.0
+
+
+class NaiveQueue:
+    """the queue as it was before the compact one: every pending run is its own entry"""
+    def __init__(self):
+        self.meta = {}  # {task_id: (priority, owner)}
+        self.runs = []  # [(task_id, enqueue_time)] in push order
+
+    def push(self, task_id, priority, owner, enqueue_time, count):
+        if count <= 0:
+            return
+        if self.count(task_id) == 0:
+            self.meta[task_id] = (priority, owner)
+        self.runs.extend([(task_id, enqueue_time)] * count)
+
+    def update(self, task_id, priority, owner):
+        if self.count(task_id):
+            self.meta[task_id] = (priority, owner)
+
+    def remove_one(self, task_id):
+        for i, (run_task_id, enqueue_time) in enumerate(self.runs):
+            if run_task_id == task_id:
+                del self.runs[i]
+                return enqueue_time
+        return None
+
+    def remove_task(self, task_id):
+        count = self.count(task_id)
+        self.runs = [run for run in self.runs if run[0] != task_id]
+        return count
+
+    def trim(self, task_id, count):
+        excess = self.count(task_id) - max(count, 0)
+        for i in reversed(range(len(self.runs))):
+            if excess <= 0:
+                break
+            if self.runs[i][0] == task_id:
+                del self.runs[i]
+                excess -= 1
+
+    def count(self, task_id):
+        return sum(1 for run_task_id, _ in self.runs if run_task_id == task_id)
+
+    def peek(self, num):
+        """strict priority, then owners in turn (each pick costs RUN_COST), then task_id, then push order"""
+        owner_runs = {}
+        for task_id, enqueue_time in self.runs:
+            priority, owner = self.meta[task_id]
+            owner_runs.setdefault(owner, []).append((-priority, task_id, enqueue_time))
+        for runs in owner_runs.values():
+            runs.sort(key=lambda run: run[:2])  # stable, runs of a task keep their push order
+        usage = {}
+        result = []
+        while len(result) < num and any(owner_runs.values()):
+            owner = min((owner for owner, runs in owner_runs.items() if runs),
+                        key=lambda owner: (owner_runs[owner][0][0], usage.get(owner, 0), owner))
+            _, task_id, enqueue_time = owner_runs[owner].pop(0)
+            result.append((task_id, enqueue_time))
+            usage[owner] = usage.get(owner, 0) + RUN_COST
+        return result
+
+
+def test_matches_per_run_queue():
+    rng = random.Random(0)
+    for _ in range(20):
+        queue = TaskQueue(FairShare(half_life=1e9), RUN_COST)
+        naive = NaiveQueue()
+        clock = 0
+        for _ in range(300):
+            task_id = rng.randrange(12)
+            priority, owner = rng.randrange(3), rng.choice(["alice", "bob", "carol"])
+            op = rng.random()
+            if op < 0.4:
+                clock += 1
+                count = rng.randrange(4)
+                queue.push(task_id, priority, owner, clock, count)
+                naive.push(task_id, priority, owner, clock, count)
+            elif op < 0.55:
+                queue.update(task_id, priority, owner)
+                naive.update(task_id, priority, owner)
+            elif op < 0.8:
+                assert queue.remove_one(task_id) == naive.remove_one(task_id)
+            elif op < 0.9:
+                count = rng.randrange(3)
+                queue.trim(task_id, count)
+                naive.trim(task_id, count)
+            else:
+                assert queue.remove_task(task_id) == naive.remove_task(task_id)
+            num = rng.randrange(1, 20)
+            assert queue.peek(num) == naive.peek(num)
+            assert len(queue) == len(naive.runs)
+            assert queue.count(task_id) == naive.count(task_id)
+
+
+def test_peek_does_not_dequeue():
+    queue = TaskQueue(FairShare(half_life=1e9), RUN_COST)
+    queue.push(1, 0, "alice", 10, count=3)
+    queue.push(2, 1, "alice", 20)
+    assert queue.peek(10) == [(2, 20), (1, 10), (1, 10), (1, 10)]
+    assert queue.peek(10) == [(2, 20), (1, 10), (1, 10), (1, 10)]
+    assert len(queue) == 4
+
+
+def test_owners_alternate_within_a_priority():
+    queue = TaskQueue(FairShare(half_life=1e9), RUN_COST)
+    queue.push(1, 0, "alice", 10, count=3)
+    queue.push(2, 0, "bob", 20, count=3)
+    assert [task_id for task_id, _ in queue.peek(6)] == [1, 2, 1, 2, 1, 2]
+
+
+def test_requeued_runs_keep_their_enqueue_time():
+    queue = TaskQueue(FairShare(half_life=1e9), RUN_COST)
+    queue.push(1, 0, "alice", 10, count=2)
+    queue.push(1, 0, "alice", 30)
+    assert queue.remove_one(1) == 10
+    assert queue.peek(3) == [(1, 10), (1, 30)]
+    queue.trim(1, 1)
+    assert queue.peek(3) == [(1, 10)]
+
+
+def test_deferred_task_is_skipped_until_ready():
+    queue = TaskQueue(FairShare(half_life=1e9), RUN_COST)
+    queue.push(1, 1, "alice", 10)
+    queue.push(2, 0, "alice", 20)
+    queue.defer(1, time.time() + 60)
+    assert queue.peek(10) == [(2, 20)]
+    assert queue.next_ready_time() is not None
+    queue.defer(1, time.time() - 1)  # never moves an existing backoff earlier
+    assert queue.peek(10) == [(2, 20)]
+    queue.remove_task(1)
+    assert queue.next_ready_time() is None
+    queue.push(1, 1, "alice", 30)
+    assert queue.peek(10) == [(1, 30), (2, 20)]